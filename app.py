@@ -1,25 +1,351 @@
 # app.py
-from flask import Flask, request, jsonify, send_from_directory
-from datetime import datetime
+from flask import Flask, request, jsonify, Response, g
+from datetime import datetime, timedelta
 import csv
+import io
 import os
-import win32print # type: ignore
+import select
+import socket
 import tempfile
 import time
 import json
 import logging
+import threading
+import atexit
+import queue
+import uuid
+import functools
+import bisect
+import gzip
+import hashlib
+import collections
+import sqlite3
+import sys
+import base64
+import html
+
+try:
+    import win32print # type: ignore
+except ImportError:
+    win32print = None  # Not on Windows; use the socket or file printer backends
+
+try:
+    from PIL import Image, ImageDraw, ImageFont # type: ignore
+except ImportError:
+    Image = None  # PNG ticket previews need Pillow; text and HTML previews don't
+
+try:
+    import brotli # type: ignore
+except ImportError:
+    brotli = None  # The frontend is then served gzipped only
 
 app = Flask(__name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
 
+# --- Configuration ---
+# Defaults below can be overridden in config.json next to app.py (or the file named by
+# KP_CONFIG), and any setting can be overridden again with a KP_<NAME> environment
+# variable, e.g. KP_PRINTER_NAME="EPSON TM-T20II" or KP_THREADS=32. Dict settings
+# such as printer_backends take JSON in the environment.
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.environ.get('KP_CONFIG', os.path.join(APP_DIR, 'config.json'))
+
+DEFAULT_CONFIG = {
+    'printer_name': "80mm Series Printer",
+    # How tickets reach each printer, keyed by printer name. Printers not listed here
+    # use the Windows spooler when pywin32 is available, and a file in data/ otherwise.
+    #   {"type": "win32"}                                       Windows spooler (RAW)
+    #   {"type": "socket", "host": "192.168.1.50", "port": 9100} Network printer (JetDirect)
+    #   {"type": "file", "path": "data/printer_out.bin"}        Append tickets to a file
+    #   {"type": "memory"}                                      Keep tickets in memory
+    'printer_backends': {},
+    'data_dir': 'data',
+    'host': '0.0.0.0',
+    'port': 5000,
+    # 'waitress' for service; 'dev' runs the Flask development server with the
+    # debugger and reloader (never use it during service).
+    'server': 'waitress',
+    # Worker threads. Every open /api/events stream holds one, so leave room for the
+    # kitchen displays and tablets on top of the normal request load.
+    'threads': 48,
+    # Most /api/events streams open at once; more are turned away with 503 and retry
+    # later. Always kept EVENT_RESERVED_THREADS below threads so orders get a thread.
+    'event_max_clients': 32,
+    # Kitchen stations and the printer each one uses, e.g.
+    #   {"sushi": "Sushi Bar Printer", "hot": "80mm Series Printer", "desserts": "Dessert Printer"}
+    # When empty, every order prints a Kitchen and a Customer copy on printer_name.
+    'stations': {},
+    # Menu category -> station, e.g. {"MAKI ROLLS": "sushi", "Desserts": "desserts"}.
+    # Categories not listed go to default_station.
+    'category_stations': {},
+    'default_station': 'hot',
+    # Sampling interval (seconds) of the profiler behind /api/profiler, off until started.
+    'profiler_interval': 0.02,
+    # Let tablets cache the app in a service worker so it opens instantly (browsers
+    # only allow this on https:// or http://localhost).
+    'service_worker': True,
+    # Printer to use while another one is down, e.g. {"Sushi Bar Printer": "80mm Series Printer"}
+    'backup_printers': {},
+    # Seconds between printer status checks
+    'printer_health_interval': 10.0,
+}
+
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    for key, default_value in DEFAULT_CONFIG.items():
+        env_value = os.environ.get(f"KP_{key.upper()}")
+        if env_value is None:
+            continue
+        if isinstance(default_value, dict):
+            config[key] = json.loads(env_value)
+        elif isinstance(default_value, bool):
+            config[key] = env_value.strip().lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(default_value, int):
+            config[key] = int(env_value)
+        elif isinstance(default_value, float):
+            config[key] = float(env_value)
+        else:
+            config[key] = env_value
+    return config
+
+CONFIG = load_config()
+
 # Printer configuration
-PRINTER_NAME = "80mm Series Printer" 
+PRINTER_NAME = CONFIG['printer_name']
+PRINTER_BACKENDS = CONFIG['printer_backends']
+STATIONS = CONFIG['stations']
+CATEGORY_STATIONS = CONFIG['category_stations']
+DEFAULT_STATION = CONFIG['default_station']
+BACKUP_PRINTERS = CONFIG['backup_printers']
 
 # CSV and Menu File Configuration
-CSV_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-MENU_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data/menu.json')
+CSV_DIR = os.path.join(APP_DIR, CONFIG['data_dir'])
+MENU_FILE = os.path.join(CSV_DIR, 'menu.json')
+
+# --- Metrics ---
+# Small in-process histograms and counters, exposed in the Prometheus text format at
+# /metrics. Recording a value is one lock and a few additions, cheap enough for every
+# order, ticket and print job.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_metric_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_metric_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}  # labelvalues -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labelvalues):
+        return Span(self, labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((labelvalues, list(series)) for labelvalues, series in self._series.items())
+        for labelvalues, series in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_metric_labels(self.labelnames, labelvalues, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_metric_labels(self.labelnames, labelvalues, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_metric_labels(self.labelnames, labelvalues)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{format_metric_labels(self.labelnames, labelvalues)} {series[-1]}")
+        return lines
+
+class Gauge:
+    # Read at scrape time from a callback, e.g. a queue length.
+    def __init__(self, name, help_text, read_value):
+        self.name = name
+        self.help_text = help_text
+        self.read_value = read_value
+
+    def render(self):
+        try:
+            value = self.read_value()
+        except Exception as e:
+            app.logger.error(f"Metric {self.name} could not be read: {str(e)}")
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Span:
+    # with HISTOGRAM.time(label...): ... records the elapsed wall time, also on errors
+    __slots__ = ('histogram', 'labelvalues', 'start')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+METRICS = []
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+HTTP_REQUEST_SECONDS = register_metric(Histogram('kp_http_request_seconds', 'Time to handle an HTTP request (until the response is returned).', ('endpoint', 'method')))
+JSON_PARSE_SECONDS = register_metric(Histogram('kp_json_parse_seconds', 'Time to parse a JSON request body.', ('endpoint',)))
+MENU_LOAD_SECONDS = register_metric(Histogram('kp_menu_load_seconds', 'Time to read, parse and serialize menu.json.'))
+TICKET_RENDER_SECONDS = register_metric(Histogram('kp_ticket_render_seconds', 'Time to render the ESC/POS tickets of one order.'))
+SPOOLER_WRITE_SECONDS = register_metric(Histogram('kp_spooler_write_seconds', 'Time to append records to the print queue journal.', ('sync',)))
+ORDER_LOG_SECONDS = register_metric(Histogram('kp_order_log_seconds', 'Time to append order rows to the daily CSV log.'))
+ORDER_SECONDS = register_metric(Histogram('kp_order_seconds', 'Time to number, queue and log one order (or one batch).', ('kind',)))
+PRINT_SECONDS = register_metric(Histogram('kp_print_seconds', 'Time for a printer to accept one ticket.', ('printer',)))
+PRINT_ATTEMPTS_TOTAL = register_metric(Counter('kp_print_attempts_total', 'Tickets sent to a printer.', ('printer',)))
+PRINT_FAILURES_TOTAL = register_metric(Counter('kp_print_failures_total', 'Tickets a printer did not accept (each attempt).', ('printer',)))
+PRINT_JOBS_TOTAL = register_metric(Counter('kp_print_jobs_total', 'Print jobs finished, by final status.', ('printer', 'status')))
+PRINT_FAILOVERS_TOTAL = register_metric(Counter('kp_print_failovers_total', 'Print jobs moved to a backup printer.', ('printer', 'backup')))
+ORDERS_TOTAL = register_metric(Counter('kp_orders_total', 'Orders processed, by result.', ('result',)))
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method)
+    return response
+
+def parse_request_json():
+    with JSON_PARSE_SECONDS.time(request.url_rule.rule if request.url_rule else 'unmatched'):
+        return request.json
+
+# --- Sampling Profiler ---
+# Off by default. While running, a background thread samples the stacks of all other
+# threads every profiler_interval seconds and counts them in the collapsed format
+# ("frame;frame;frame count") that flamegraph.pl and speedscope read. Meant to be
+# switched on through /api/profiler for a few minutes during a rush. Samples only
+# walk the frame chain (no source line lookups), so with dozens of server threads a
+# sample stays well under the interval and the profiler holds the GIL very little.
+PROFILER_MIN_INTERVAL = 0.01
+
+class SamplingProfiler:
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._labels = {}
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = interval
+            self._stacks.clear()
+            self._samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread:
+            thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own_id = threading.get_ident()
+        frames = sys._current_frames()
+        collapsed = []
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            collapsed.append(";".join(stack))
+        del frames
+        with self._lock:
+            self._stacks.update(collapsed)
+            self._samples += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def report(self):
+        with self._lock:
+            return self._samples, "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+profiler = SamplingProfiler(CONFIG['profiler_interval'])
 
 # --- ESC/POS Commands (Updated to match app DUMMY.py for more formatting options) ---
 ESC = b'\x1B'
@@ -100,320 +426,2806 @@ def word_wrap_text(text, max_width, initial_indent="", subsequent_indent=""):
             
     return lines if lines else [initial_indent]
 
+# --- Static Frontend ---
+# sushaki.html is read once and kept in memory together with its gzip (and, when the
+# brotli package is installed, brotli) variants, so serving it is a dictionary lookup
+# with no disk I/O or compression on the request thread. The file is re-checked at
+# most once per STATIC_RECHECK_SECONDS and rebuilt when it changes. Responses carry a
+# strong ETag per encoding and 'no-cache', so a reload costs a 304; the page itself
+# can't be marked immutable because its URL never changes.
+STATIC_RECHECK_SECONDS = 1.0
+INDEX_FILE = os.path.join(APP_DIR, 'sushaki.html')
+
+class StaticSnapshot:
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': (body, self.etag)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), self.etag + "-gz")
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body), self.etag + "-br")
+
+class StaticAsset:
+    def __init__(self, path, mimetype):
+        self.path = path
+        self.mimetype = mimetype
+        self._lock = threading.Lock()
+        self._file_key = None
+        self._checked_at = 0.0
+        self._snapshot = None
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < STATIC_RECHECK_SECONDS:
+            return snapshot
+        with self._lock:
+            st = os.stat(self.path)
+            file_key = (st.st_mtime_ns, st.st_size)
+            if self._snapshot is None or file_key != self._file_key:
+                with open(self.path, 'rb') as f:
+                    self._snapshot = StaticSnapshot(f.read(), self.mimetype)
+                self._file_key = file_key
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+def static_response(snapshot, cache_control='no-cache'):
+    if any(request.if_none_match.contains(etag) for _, etag in snapshot.variants.values()):
+        response = Response(status=304)
+        encoding = next((name for name, (_, etag) in snapshot.variants.items()
+                         if request.if_none_match.contains(etag)), 'identity')
+    else:
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in snapshot.variants and request.accept_encodings[candidate] > 0:
+                encoding = candidate
+                break
+        response = Response(snapshot.variants[encoding][0], mimetype=snapshot.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(snapshot.variants[encoding][1])
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+index_asset = StaticAsset(INDEX_FILE, 'text/html')
+
 @app.route('/')
 def serve_index():
-    return send_from_directory('.', 'sushaki.html')
+    return static_response(index_asset.get())
+
+# The service worker keeps the page (and the last menu) in the browser's cache, so a
+# tablet opens the app instantly and still starts during a Wi-Fi drop. Its cache name
+# carries the page's ETag: when sushaki.html changes, sw.js changes too and the
+# browser installs the new version in the background. /api requests other than the
+# menu always go to the network.
+SERVICE_WORKER_SCRIPT = """// Generated by app.py
+const CACHE = 'sushaki-__VERSION__';
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(CACHE)
+        .then(cache => cache.addAll(['/', '/api/menu']))
+        .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(key => key !== CACHE).map(key => caches.delete(key))))
+        .then(() => self.clients.claim()));
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== location.origin) return;
+    if (url.pathname === '/') {
+        // Cached page right away; refresh the cached copy in the background.
+        const refresh = fetch(event.request).then(response => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(CACHE).then(cache => cache.put('/', copy));
+            }
+            return response;
+        });
+        event.waitUntil(refresh.catch(() => null));
+        event.respondWith(caches.match('/').then(cached => cached || refresh));
+    } else if (url.pathname === '/api/menu') {
+        // Network first so menu edits show up at once; the cached menu covers outages.
+        event.respondWith(fetch(event.request).then(response => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(CACHE).then(cache => cache.put('/api/menu', copy));
+            }
+            return response;
+        }).catch(() => caches.match('/api/menu')));
+    }
+});
+"""
+
+# Served instead when service_worker is off, so tablets drop a previously installed one
+SERVICE_WORKER_REMOVAL_SCRIPT = """// Generated by app.py; the service worker is disabled in config.json
+self.addEventListener('install', () => self.skipWaiting());
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.map(key => caches.delete(key))))
+        .then(() => self.registration.unregister()));
+});
+"""
+
+_service_worker_snapshots = {}
+
+@app.route('/sw.js')
+def serve_service_worker():
+    if CONFIG['service_worker']:
+        version = index_asset.get().etag
+        script = SERVICE_WORKER_SCRIPT.replace('__VERSION__', version)
+    else:
+        version = 'disabled'
+        script = SERVICE_WORKER_REMOVAL_SCRIPT
+    snapshot = _service_worker_snapshots.get(version)
+    if snapshot is None:
+        _service_worker_snapshots.clear()
+        snapshot = _service_worker_snapshots[version] = StaticSnapshot(script.encode('utf-8'), 'application/javascript')
+    return static_response(snapshot)
+
+# --- Compiled Menu Index ---
+# The menu compiled for the order path: items keyed by id, with integer-cent prices
+# and a name -> cents table for their options. New orders are validated and priced
+# against it in one pass (price_order), so prices sent by the tablets are never
+# trusted. Options in menu.json may be plain strings (no surcharge) or
+# {"name": ..., "price": ...}.
+MAX_ITEM_QUANTITY = 999
+
+def menu_price_cents(value, what):
+    try:
+        return int(round(float(value) * 100))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"Invalid price for {what}: {value!r}")
+
+class CompiledMenuItem:
+    __slots__ = ('id', 'name', 'category', 'price_cents', 'option_cents', 'source')
+
+    def __init__(self, category, item):
+        self.source = item
+        self.id = item['id']
+        self.name = str(item.get('name', ''))
+        self.category = category
+        self.price_cents = menu_price_cents(item.get('price', 0), f"'{self.name}'")
+        self.option_cents = {}
+        for option in item.get('options') or []:
+            if isinstance(option, dict):
+                option_name = str(option.get('name', ''))
+                self.option_cents[option_name] = menu_price_cents(option.get('price', 0), f"option '{option_name}' of '{self.name}'")
+            else:
+                self.option_cents[str(option)] = 0
+
+class MenuIndex:
+    # Compiling again after a save only rebuilds the items that changed (or moved to
+    # another category); the others are taken over from the previous index.
+    def __init__(self, data, previous=None):
+        if not isinstance(data, dict):
+            raise ValueError("The menu must map category names to lists of items")
+        previous_items = previous.items_by_id if previous else {}
+        self.items_by_id = {}
+        self.compiled_count = 0
+        for category, items in data.items():
+            if not isinstance(items, list):
+                raise ValueError(f"Category '{category}' must be a list of items")
+            for item in items:
+                if not isinstance(item, dict) or item.get('id') is None:
+                    raise ValueError(f"Every item in '{category}' needs an id")
+                if item['id'] in self.items_by_id:
+                    raise ValueError(f"Item id {item['id']} is used more than once")
+                entry = previous_items.get(item['id'])
+                if entry is None or entry.category != category or entry.source != item:
+                    entry = CompiledMenuItem(category, item)
+                    self.compiled_count += 1
+                self.items_by_id[item['id']] = entry
+
+    def category_of(self, item_id):
+        entry = self.items_by_id.get(item_id)
+        return entry.category if entry else None
+
+def price_order(order_data, menu_index):
+    # Replaces the tablet's items with validated copies priced from the menu and
+    # stores the per-line and order totals in cents ('line_cents', 'total_cents'),
+    # which the ticket, CSV row and stats then reuse. Raises ValueError with a message
+    # for the tablet.
+    items = order_data.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError("The order has no items")
+    priced_items = []
+    line_cents = []
+    for position, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {position} is not valid")
+        entry = menu_index.items_by_id.get(item.get('id'))
+        if entry is None:
+            raise ValueError(f"'{item.get('name', f'Item {position}')}' is not on the menu")
+        quantity = item.get('quantity', 1)
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or not 1 <= quantity <= MAX_ITEM_QUANTITY:
+            raise ValueError(f"Invalid quantity for '{entry.name}'")
+        unit_cents = entry.price_cents
+        selected_options = []
+        for option in item.get('selectedOptions') or []:
+            option_name = str(option.get('name')) if isinstance(option, dict) else str(option)
+            option_cents = entry.option_cents.get(option_name)
+            if option_cents is None:
+                raise ValueError(f"'{option_name}' is not an option of '{entry.name}'")
+            unit_cents += option_cents
+            selected_options.append({'name': option_name, 'price': option_cents / 100})
+        comment = item.get('comment', '')
+        priced_items.append({
+            'id': entry.id,
+            'name': entry.name,
+            'price': entry.price_cents / 100,
+            'quantity': quantity,
+            'comment': comment if isinstance(comment, str) else '',
+            'selectedOptions': selected_options,
+        })
+        line_cents.append(quantity * unit_cents)
+    order_data['items'] = priced_items
+    order_data['line_cents'] = line_cents
+    order_data['total_cents'] = sum(line_cents)
+    return order_data
+
+def order_item_line_cents(item):
+    # For orders that were not priced by price_order, e.g. reprints of older orders
+    selected_options = item.get('selectedOptions', [])
+    if not (selected_options and isinstance(selected_options, list)):
+        selected_options = []
+    unit_cents = to_cents(item.get('price', 0)) + sum(
+        to_cents(option.get('price', 0)) for option in selected_options if isinstance(option, dict))
+    return int(item.get('quantity', 0) or 0) * unit_cents
+
+# --- Menu Cache ---
+# The parsed menu and its serialized response (a StaticSnapshot, so /api/menu is
+# served by static_response like the page itself) are kept in memory and only
+# rebuilt when menu.json changes on disk (mtime/size) or is saved
+# through the API. Saves go through a temp file and os.replace, so a reader never
+# sees a half-written menu.
+class MenuSnapshot:
+    def __init__(self, data, version, index):
+        self.data = data
+        self.version = version
+        self.index = index
+        self.response = StaticSnapshot(json.dumps(data).encode('utf-8'), 'application/json')
+        self.etag = self.response.etag
+
+class MenuCache:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_key = None
+        self._version = 0
+        self._snapshot = None
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _compile(self, data):
+        return MenuIndex(data, self._snapshot.index if self._snapshot else None)
+
+    def _build(self, data, file_key, index=None):
+        self._version += 1
+        self._snapshot = MenuSnapshot(data, self._version, index or self._compile(data))
+        self._file_key = file_key
+        return self._snapshot
+
+    def get(self):
+        file_key = self._stat_key()
+        with self._lock:
+            if self._snapshot is not None and file_key == self._file_key:
+                return self._snapshot
+            if file_key is None:
+                return self._build({}, None)
+            with MENU_LOAD_SECONDS.time():
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    index = self._compile(data)
+                except ValueError as e:
+                    # Most likely someone is editing menu.json by hand; keep serving the
+                    # last good menu until the file parses (and compiles) again.
+                    if self._snapshot is None:
+                        raise
+                    app.logger.error(f"menu.json could not be loaded, serving cached menu: {str(e)}")
+                    return self._snapshot
+                return self._build(data, file_key, index)
+
+    def save(self, data):
+        # Raises ValueError (before touching the file) if the menu does not compile
+        with self._lock:
+            index = self._compile(data)
+            directory = os.path.dirname(self.path)
+            os.makedirs(directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".menu_", suffix=".json", dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            app.logger.info(f"Menu saved; {index.compiled_count} of {len(index.items_by_id)} item(s) recompiled")
+            return self._build(data, self._stat_key(), index)
+
+menu_cache = MenuCache(MENU_FILE)
 
 @app.route('/api/menu', methods=['GET'])
 def get_menu():
-    try:
-        with open(MENU_FILE, 'r', encoding='utf-8') as f:
-            return jsonify(json.load(f))
-    except FileNotFoundError:
-        return jsonify({})
+    return static_response(menu_cache.get().response)
 
 @app.route('/api/menu', methods=['POST'])
 def save_menu():
-    new_menu_data = request.json
-    os.makedirs(os.path.dirname(MENU_FILE), exist_ok=True)
-    with open(MENU_FILE, 'w', encoding='utf-8') as f:
-        json.dump(new_menu_data, f, indent=2)
-    return jsonify({"status": "success"})
-
-# --- THIS IS THE MAIN MODIFIED FUNCTION ---
-def print_kitchen_ticket(order_data, copy_info="", original_timestamp_str=None):
-    hprinter = None
+    new_menu_data = parse_request_json()
     try:
-        ticket_content = bytearray()
-        ticket_content += InitializePrinter
-        
-        NORMAL_FONT_LINE_WIDTH = 42
-        SMALL_FONT_LINE_WIDTH = 56 
-
-        # --- Header Section (As per app DUMMY.py) ---
-        ticket_content += AlignCenter + SelectFontA + DoubleHeightWidth + BoldOn
-        restaurant_name = "To Sushaki" 
-        ticket_content += to_bytes(restaurant_name + "\n")
-        ticket_content += BoldOff 
-        
-        ticket_content += AlignCenter + SelectFontA + NormalText
-        header_text = "Kitchen Order"
-        if copy_info:
-             header_text += f" - {copy_info.upper()}"
-        ticket_content += to_bytes(header_text + "\n")
-        
-        ticket_content += AlignLeft 
-        
-        ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
-        order_num_text = f"Order #: {order_data.get('number', 'N/A')}"
-        ticket_content += to_bytes(order_num_text + "\n")
-        ticket_content += BoldOff
-
-        ticket_content += SelectFontA + NormalText
-        time_to_display = original_timestamp_str if original_timestamp_str else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ticket_content += to_bytes(f"Time: {time_to_display}\n")
-        
-        ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n")
-        
-        # --- Items Section (Logic from app DUMMY.py) ---
-        grand_total = 0.0
-        for item_idx, item in enumerate(order_data.get('items', [])):
-            item_quantity = item.get('quantity', 0)
-            item_name_orig = item.get('name', 'Unknown Item')
-            item_price_unit = float(item.get('price', 0.0))
-            
-            selected_options = item.get('selectedOptions', [])
-            total_options_price = 0.0
-            if selected_options and isinstance(selected_options, list):
-                for option in selected_options:
-                    total_options_price += float(option.get('price', 0.0))
+        menu = menu_cache.save(new_menu_data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Menu not saved: {str(e)}"}), 400
+    return jsonify({"status": "success", "etag": menu.etag})
 
-            line_total = item_quantity * (item_price_unit + total_options_price)
-            grand_total += line_total
+# --- Printer Backends ---
+# Each backend delivers a finished ESC/POS ticket to one printer. Backends are created
+# once per printer and reused, so connections and spooler handles stay open between
+# tickets instead of being reopened for every print.
+class PrinterBackend:
+    def __init__(self, printer_name):
+        self.printer_name = printer_name
+        self._lock = threading.Lock()
 
-            left_side = f"{item_quantity}x {item_name_orig}"
-            right_side = f"EUR {line_total:.2f}"
+    def send(self, data, doc_name):
+        with self._lock:
+            self._send(data, doc_name)
 
-            large_text_width = len(left_side) * 2
-            normal_text_width = len(right_side)
-            
-            # Smartly print large item name and normal price on the same line if it fits
-            if large_text_width + normal_text_width < NORMAL_FONT_LINE_WIDTH:
-                ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
-                ticket_content += to_bytes(left_side)
-                
-                ticket_content += NormalText + BoldOff
-                
-                padding_size = NORMAL_FONT_LINE_WIDTH - large_text_width - normal_text_width
-                padding = " " * padding_size
-                ticket_content += to_bytes(padding)
-                
-                ticket_content += to_bytes(right_side + "\n")
-            else:
-                # Handle multi-line items if they don't fit
-                ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
-                DOUBLE_WIDTH_LINE_CHARS = NORMAL_FONT_LINE_WIDTH // 2
-                wrapped_name_lines = word_wrap_text(left_side, DOUBLE_WIDTH_LINE_CHARS)
-                
-                for line in wrapped_name_lines[:-1]:
-                    ticket_content += to_bytes(line + "\n")
-                
-                last_line = wrapped_name_lines[-1]
-                last_line_width = len(last_line) * 2
-                
-                available_space = NORMAL_FONT_LINE_WIDTH - last_line_width
-                padding = " " * max(0, available_space - normal_text_width)
-                
-                ticket_content += to_bytes(last_line)
-                
-                ticket_content += NormalText + BoldOff + to_bytes(padding + right_side + "\n")
-                ticket_content += AlignLeft
+    def _send(self, data, doc_name):
+        raise NotImplementedError
 
-            ticket_content += NormalText + BoldOff 
+    def status(self):
+        # Returns (state, detail); state is one of PRINTER_STATES. Called by the
+        # health monitor, never on the order path.
+        return 'unknown', None
 
-            # Print selected options (indented)
-            if selected_options and isinstance(selected_options, list):
-                for option in selected_options:
-                    option_name = option.get('name', 'N/A')
-                    option_price = float(option.get('price', 0.0))
-                    price_change_str = ""
-                    if option_price != 0:
-                        price_change_str = f" ({'+' if option_price > 0 else ''}EUR {option_price:.2f})"
-                    
-                    option_line = f"  -> {option_name}{price_change_str}"
-                    wrapped_option_lines = word_wrap_text(option_line, NORMAL_FONT_LINE_WIDTH, initial_indent="  ", subsequent_indent="    ") 
-                    for opt_line_part in wrapped_option_lines:
-                        ticket_content += to_bytes(opt_line_part + "\n")
-
-            # Print item comment (indented)
-            item_comment = item.get('comment', '').strip()
-            if item_comment:
-                ticket_content += BoldOn
-                wrapped_comments = word_wrap_text(f"Note: {item_comment}", NORMAL_FONT_LINE_WIDTH, initial_indent="    ", subsequent_indent="    ")
-                for comment_line in wrapped_comments:
-                     ticket_content += to_bytes(comment_line + "\n")
-                ticket_content += BoldOff                  
-            
-            # Add a separator between items
-            if item_idx < len(order_data.get('items', [])) - 1:
-                ticket_content += to_bytes("." * NORMAL_FONT_LINE_WIDTH + "\n")
-
-        # --- Footer Section (As per app DUMMY.py) ---
-        ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n")
-        ticket_content += SelectFontA + DoubleHeightWidth + BoldOn + AlignRight
-        total_string = f"TOTAL: EUR {grand_total:.2f}"
-        ticket_content += to_bytes(total_string + "\n")
-        ticket_content += BoldOff + AlignLeft
-        
-        ticket_content += SelectFontA + NormalText
-        ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n\n") 
-        
-        universal_comment = order_data.get('universalComment', '').strip()
-        if universal_comment:
-            ticket_content += SelectFontA + NormalText + BoldOn 
-            ticket_content += to_bytes("ORDER NOTES:\n") + BoldOff 
-            ticket_content += SelectFontA + NormalText 
-            wrapped_universal_comment_lines = word_wrap_text(universal_comment, NORMAL_FONT_LINE_WIDTH, initial_indent="", subsequent_indent="") 
-            for line in wrapped_universal_comment_lines:
-                ticket_content += to_bytes(line + "\n")
-            ticket_content += to_bytes("\n")
-        
-        ticket_content += to_bytes("\n")
-        ticket_content += AlignCenter + SelectFontB
-        disclaimer_text = "This is not a legal receipt and is for informational purposes only."
-        wrapped_disclaimer_lines = word_wrap_text(disclaimer_text, SMALL_FONT_LINE_WIDTH)
-        for line in wrapped_disclaimer_lines:
-            ticket_content += to_bytes(line + "\n")
-
-        ticket_content += SelectFontA + AlignLeft
-            
-        ticket_content += to_bytes("\n\n\n\n") 
-        ticket_content += FullCut
+    def close(self):
+        pass
+
+# (Status flag, state, detail) from GetPrinter level 2, most important first
+WIN32_PRINTER_STATUS_FLAGS = [
+    (0x00000080, 'offline', 'Offline'),
+    (0x00000010, 'paper_out', 'Paper out'),
+    (0x00400000, 'offline', 'Cover open'),
+    (0x00000008, 'error', 'Paper jam'),
+    (0x00001000, 'offline', 'Not available'),
+    (0x00100000, 'error', 'Needs attention'),
+    (0x00000002, 'error', 'Error'),
+    (0x00000001, 'offline', 'Paused'),
+]
+WIN32_PRINTER_ATTRIBUTE_WORK_OFFLINE = 0x00000400
 
-        hprinter = win32print.OpenPrinter(PRINTER_NAME)
+class Win32PrinterBackend(PrinterBackend):
+    def __init__(self, printer_name):
+        super().__init__(printer_name)
+        if win32print is None:
+            raise RuntimeError("pywin32 is not installed; the win32 printer backend is only available on Windows.")
+        self._handle = None
+
+    def _write(self, data, doc_name):
+        if self._handle is None:
+            self._handle = win32print.OpenPrinter(self.printer_name)
+        win32print.StartDocPrinter(self._handle, 1, (doc_name, None, "RAW"))
         try:
-            doc_name = f"Order_{order_data.get('number', 'N/A')}_Ticket_{copy_info.replace(' ','_')}"
-            win32print.StartDocPrinter(hprinter, 1, (doc_name, None, "RAW"))
-            win32print.StartPagePrinter(hprinter)
-            win32print.WritePrinter(hprinter, bytes(ticket_content))
-            win32print.EndPagePrinter(hprinter)
-            win32print.EndDocPrinter(hprinter)
+            win32print.StartPagePrinter(self._handle)
+            win32print.WritePrinter(self._handle, data)
+            win32print.EndPagePrinter(self._handle)
         finally:
-            win32print.ClosePrinter(hprinter)
-        
-        return True
+            win32print.EndDocPrinter(self._handle)
+
+    def _send(self, data, doc_name):
+        if self._handle is not None:
+            try:
+                self._write(data, doc_name)
+                return
+            except Exception:
+                # The cached handle may have gone stale (printer re-added, spooler
+                # restarted); reopen it once before giving up.
+                self._close_handle()
+        try:
+            self._write(data, doc_name)
+        except Exception:
+            self._close_handle()
+            raise
+
+    def status(self):
+        # The spooler's view of the printer. Many USB receipt printers only report
+        # problems here once a job is stuck, so send failures count as well.
+        with self._lock:
+            try:
+                if self._handle is None:
+                    self._handle = win32print.OpenPrinter(self.printer_name)
+                info = win32print.GetPrinter(self._handle, 2)
+            except Exception as e:
+                self._close_handle()
+                return 'offline', str(e)
+        if info.get('Attributes', 0) & WIN32_PRINTER_ATTRIBUTE_WORK_OFFLINE:
+            return 'offline', "Set to 'Use Printer Offline'"
+        for flag, state, detail in WIN32_PRINTER_STATUS_FLAGS:
+            if info.get('Status', 0) & flag:
+                return state, detail
+        return 'ok', None
+
+    def _close_handle(self):
+        if self._handle is not None:
+            try:
+                win32print.ClosePrinter(self._handle)
+            except Exception:
+                pass
+        self._handle = None
+
+    def close(self):
+        with self._lock:
+            self._close_handle()
+
+# ESC/POS real-time status (DLE EOT n). Each request answers with one byte.
+DLE_EOT = b'\x10\x04'
+PRINTER_STATUS_REPLY_TIMEOUT = 0.25  # for all three replies; printers answer within a few ms
+PRINTER_STATUS_MAX_MISSES = 3  # unanswered probes before a printer is taken to have no status support
+
+def is_status_byte(value):
+    # Real-time status bytes always have bits 1 and 4 set and bits 0 and 7 clear
+    return value is not None and value & 0x93 == 0x12
+
+def realtime_status_state(printer_status, offline_cause, paper_status):
+    if not is_status_byte(printer_status):
+        return 'ok', "Connected (no status reply)"
+    if is_status_byte(paper_status) and paper_status & 0x60:
+        return 'paper_out', 'Paper out'
+    if is_status_byte(offline_cause):
+        if offline_cause & 0x04:
+            return 'offline', 'Cover open'
+        if offline_cause & 0x20:
+            return 'paper_out', 'Paper out'
+        if offline_cause & 0x40:
+            return 'error', 'Printer error'
+    if printer_status & 0x08:
+        return 'offline', 'Offline'
+    if is_status_byte(paper_status) and paper_status & 0x0C:
+        return 'ok', 'Paper low'
+    return 'ok', None
 
+class SocketPrinterBackend(PrinterBackend):
+    # Raw TCP printing (JetDirect / port 9100). The connection is kept open and
+    # reopened when it drops or has been idle long enough for the printer to close it.
+    def __init__(self, printer_name, host, port=9100, timeout=5.0, idle_timeout=30.0):
+        super().__init__(printer_name)
+        self.host = host
+        self.port = int(port)
+        self.timeout = float(timeout)
+        self.idle_timeout = float(idle_timeout)
+        self._sock = None
+        self._last_used = 0.0
+        self._status_misses = 0
+
+    def _open_connection(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _connect(self):
+        self._sock = self._open_connection()
+
+    def _connection_alive(self):
+        # A printer that closed its end shows up as readable with no data. Anything
+        # else waiting on the socket (e.g. automatic status bytes) is discarded.
+        try:
+            while select.select([self._sock], [], [], 0)[0]:
+                if not self._sock.recv(1024):
+                    return False
+            return True
+        except OSError:
+            return False
+
+    def _send(self, data, doc_name):
+        if self._sock is not None and (time.monotonic() - self._last_used > self.idle_timeout
+                                       or not self._connection_alive()):
+            self._close_socket()
+        try:
+            if self._sock is None:
+                self._connect()
+            self._sock.sendall(data)
+        except OSError:
+            self._close_socket()
+            self._connect()
+            self._sock.sendall(data)
+        self._last_used = time.monotonic()
+
+    def _read_status_replies(self, count):
+        replies = b''
+        deadline = time.monotonic() + PRINTER_STATUS_REPLY_TIMEOUT
+        while len(replies) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._sock], [], [], remaining)[0]:
+                break
+            reply = self._sock.recv(count - len(replies))
+            if not reply:
+                raise OSError("Printer closed the connection")
+            replies += reply
+        return list(replies) + [None] * (count - len(replies))
+
+    def answers_status(self):
+        return self._status_misses < PRINTER_STATUS_MAX_MISSES
+
+    def status(self):
+        # Asks for printer status (1), offline cause (2) and paper sensor (4) over the
+        # print connection, in one write with one short wait for the replies. The lock
+        # keeps the requests out of a ticket being sent, so connecting happens outside
+        # it. Printers that never answer are only checked for a live connection.
+        with self._lock:
+            if self._sock is not None and (time.monotonic() - self._last_used > self.idle_timeout
+                                           or not self._connection_alive()):
+                self._close_socket()
+            connected = self._sock is not None
+        if not connected:
+            try:
+                sock = self._open_connection()
+            except OSError as e:
+                return 'offline', str(e)
+            with self._lock:
+                if self._sock is None:
+                    self._sock = sock
+                    self._last_used = time.monotonic()
+                else:
+                    sock.close()
+        with self._lock:
+            if self._sock is None:
+                return 'offline', "Connection closed"
+            if not self.answers_status():
+                return 'ok', "Connected (does not answer status requests)"
+            try:
+                self._sock.sendall(b''.join(DLE_EOT + bytes([request_type]) for request_type in (1, 2, 4)))
+                replies = self._read_status_replies(3)
+                self._last_used = time.monotonic()
+            except OSError as e:
+                self._close_socket()
+                return 'offline', str(e)
+            if replies[0] is None:
+                self._status_misses += 1
+                if not self.answers_status():
+                    app.logger.info(f"Printer '{self.printer_name}' does not answer status requests; "
+                                    f"only its connection is checked from now on")
+            else:
+                self._status_misses = 0
+        return realtime_status_state(*replies)
+
+    def _close_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._close_socket()
+
+class FilePrinterBackend(PrinterBackend):
+    # Appends every ticket to a file. Useful for running without a printer, or for
+    # pointing at a device node such as /dev/usb/lp0.
+    def __init__(self, printer_name, path):
+        super().__init__(printer_name)
+        if not os.path.isabs(path):
+            path = os.path.join(APP_DIR, path)
+        self.path = path
+
+    def _send(self, data, doc_name):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def status(self):
+        target = self.path if os.path.exists(self.path) else (os.path.dirname(self.path) or '.')
+        if os.path.exists(target) and not os.access(target, os.W_OK):
+            return 'error', f"'{target}' is not writable"
+        return 'ok', None
+
+class MemoryPrinterBackend(PrinterBackend):
+    def __init__(self, printer_name):
+        super().__init__(printer_name)
+        self.tickets = []
+
+    def _send(self, data, doc_name):
+        self.tickets.append((doc_name, data))
+
+    def status(self):
+        return 'ok', None
+
+PRINTER_BACKEND_TYPES = {
+    'win32': Win32PrinterBackend,
+    'socket': SocketPrinterBackend,
+    'file': FilePrinterBackend,
+    'memory': MemoryPrinterBackend,
+}
+
+_printer_backends = {}
+_printer_backends_lock = threading.Lock()
+
+def default_printer_backend_config(printer_name):
+    if win32print is not None:
+        return {'type': 'win32'}
+    safe_name = "".join(c if c.isalnum() else '_' for c in printer_name)
+    return {'type': 'file', 'path': os.path.join(CSV_DIR, f"printer_{safe_name}.bin")}
+
+def get_printer_backend(printer_name):
+    with _printer_backends_lock:
+        backend = _printer_backends.get(printer_name)
+        if backend is None:
+            config = dict(PRINTER_BACKENDS.get(printer_name) or default_printer_backend_config(printer_name))
+            backend_type = config.pop('type', 'win32')
+            if backend_type not in PRINTER_BACKEND_TYPES:
+                raise ValueError(f"Unknown printer backend type '{backend_type}' for printer '{printer_name}'")
+            backend = PRINTER_BACKEND_TYPES[backend_type](printer_name, **config)
+            _printer_backends[printer_name] = backend
+        return backend
+
+def close_printer_backends():
+    with _printer_backends_lock:
+        for backend in _printer_backends.values():
+            backend.close()
+        _printer_backends.clear()
+
+atexit.register(close_printer_backends)
+
+# --- Ticket Renderer ---
+# Rendering is kept separate from printer I/O. Everything that is the same on every
+# ticket is encoded once at import time, and wrapped item names, option lines and
+# notes are memoized, since the same menu items come up again and again.
+NORMAL_FONT_LINE_WIDTH = 42
+SMALL_FONT_LINE_WIDTH = 56
+DOUBLE_WIDTH_LINE_CHARS = NORMAL_FONT_LINE_WIDTH // 2
+RESTAURANT_NAME = "To Sushaki"
+DISCLAIMER_TEXT = "This is not a legal receipt and is for informational purposes only."
+WRAP_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrapped_lines(text, max_width, initial_indent="", subsequent_indent=""):
+    return tuple(word_wrap_text(text, max_width, initial_indent, subsequent_indent))
+
+@functools.lru_cache(maxsize=WRAP_CACHE_SIZE)
+def wrapped_block(text, max_width, initial_indent="", subsequent_indent=""):
+    return b"".join(to_bytes(line + "\n") for line in wrapped_lines(text, max_width, initial_indent, subsequent_indent))
+
+TICKET_PREAMBLE = (InitializePrinter
+                   + AlignCenter + SelectFontA + DoubleHeightWidth + BoldOn
+                   + to_bytes(RESTAURANT_NAME + "\n") + BoldOff
+                   + AlignCenter + SelectFontA + NormalText)
+SEPARATOR_LINE = to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n")
+ITEM_SEPARATOR_LINE = to_bytes("." * NORMAL_FONT_LINE_WIDTH + "\n")
+TOTAL_PREFIX = SEPARATOR_LINE + SelectFontA + DoubleHeightWidth + BoldOn + AlignRight
+TOTAL_SUFFIX = BoldOff + AlignLeft + SelectFontA + NormalText + SEPARATOR_LINE + b"\n"
+ORDER_NOTES_HEADING = SelectFontA + NormalText + BoldOn + to_bytes("ORDER NOTES:\n") + BoldOff + SelectFontA + NormalText
+TICKET_FOOTER = (b"\n" + AlignCenter + SelectFontB
+                 + wrapped_block(DISCLAIMER_TEXT, SMALL_FONT_LINE_WIDTH)
+                 + SelectFontA + AlignLeft
+                 + b"\n\n\n\n" + FullCut)
+
+@functools.lru_cache(maxsize=64)
+def render_ticket_header(copy_info=""):
+    header_text = "Kitchen Order"
+    if copy_info:
+        header_text += f" - {copy_info.upper()}"
+    return TICKET_PREAMBLE + to_bytes(header_text + "\n")
+
+def render_item_line(left_side, right_side):
+    large_text_width = len(left_side) * 2
+    normal_text_width = len(right_side)
+
+    # Smartly print large item name and normal price on the same line if it fits
+    if large_text_width + normal_text_width < NORMAL_FONT_LINE_WIDTH:
+        padding = " " * (NORMAL_FONT_LINE_WIDTH - large_text_width - normal_text_width)
+        return (SelectFontA + DoubleHeightWidth + BoldOn + to_bytes(left_side)
+                + NormalText + BoldOff + to_bytes(padding + right_side + "\n"))
+
+    # Handle multi-line items if they don't fit
+    wrapped_name_lines = wrapped_lines(left_side, DOUBLE_WIDTH_LINE_CHARS)
+    last_line = wrapped_name_lines[-1]
+    padding = " " * max(0, NORMAL_FONT_LINE_WIDTH - len(last_line) * 2 - normal_text_width)
+    line_content = SelectFontA + DoubleHeightWidth + BoldOn
+    for line in wrapped_name_lines[:-1]:
+        line_content += to_bytes(line + "\n")
+    return (line_content + to_bytes(last_line)
+            + NormalText + BoldOff + to_bytes(padding + right_side + "\n") + AlignLeft)
+
+def render_ticket_body(order_data, timestamp_str):
+    parts = [
+        AlignLeft + SelectFontA + DoubleHeightWidth + BoldOn,
+        to_bytes(f"Order #: {order_data.get('number', 'N/A')}\n"),
+        BoldOff + SelectFontA + NormalText,
+        to_bytes(f"Time: {timestamp_str}\n"),
+        SEPARATOR_LINE,
+    ]
+
+    items = order_data.get('items', [])
+    line_cents = order_data.get('line_cents') or [order_item_line_cents(item) for item in items]
+    grand_total = sum(line_cents) / 100
+    for item_idx, (item, item_line_cents) in enumerate(zip(items, line_cents)):
+        item_quantity = item.get('quantity', 0)
+
+        selected_options = item.get('selectedOptions', [])
+        if not (selected_options and isinstance(selected_options, list)):
+            selected_options = []
+        option_prices = [float(option.get('price', 0.0)) for option in selected_options]
+
+        parts.append(render_item_line(f"{item_quantity}x {item.get('name', 'Unknown Item')}", f"EUR {item_line_cents / 100:.2f}"))
+        parts.append(NormalText + BoldOff)
+
+        # Print selected options (indented)
+        for option, option_price in zip(selected_options, option_prices):
+            price_change_str = ""
+            if option_price != 0:
+                price_change_str = f" ({'+' if option_price > 0 else ''}EUR {option_price:.2f})"
+            parts.append(wrapped_block(f"  -> {option.get('name', 'N/A')}{price_change_str}",
+                                       NORMAL_FONT_LINE_WIDTH, "  ", "    "))
+
+        # Print item comment (indented)
+        item_comment = item.get('comment', '').strip()
+        if item_comment:
+            parts.append(BoldOn + wrapped_block(f"Note: {item_comment}", NORMAL_FONT_LINE_WIDTH, "    ", "    ") + BoldOff)
+
+        # Add a separator between items
+        if item_idx < len(items) - 1:
+            parts.append(ITEM_SEPARATOR_LINE)
+
+    parts.append(TOTAL_PREFIX + to_bytes(f"TOTAL: EUR {grand_total:.2f}\n") + TOTAL_SUFFIX)
+
+    universal_comment = order_data.get('universalComment', '').strip()
+    if universal_comment:
+        parts.append(ORDER_NOTES_HEADING + wrapped_block(universal_comment, NORMAL_FONT_LINE_WIDTH) + b"\n")
+
+    parts.append(TICKET_FOOTER)
+    return b"".join(parts)
+
+def render_kitchen_tickets(order_data, copy_infos, original_timestamp_str=None):
+    # The body is rendered once and shared; copies only differ in their header line.
+    with TICKET_RENDER_SECONDS.time():
+        timestamp_str = original_timestamp_str if original_timestamp_str else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        body = render_ticket_body(order_data, timestamp_str)
+        return [render_ticket_header(copy_info) + body for copy_info in copy_infos]
+
+def render_kitchen_ticket(order_data, copy_info="", original_timestamp_str=None):
+    return render_kitchen_tickets(order_data, [copy_info], original_timestamp_str)[0]
+
+def ticket_doc_name(order_number, copy_info=""):
+    return f"Order_{order_number}_Ticket_{copy_info.replace(' ','_')}"
+
+def send_ticket(ticket_data, doc_name, printer_name=None):
+    printer_name = printer_name or PRINTER_NAME
+    PRINT_ATTEMPTS_TOTAL.inc(1, printer_name)
+    try:
+        with PRINT_SECONDS.time(printer_name):
+            get_printer_backend(printer_name).send(ticket_data, doc_name)
+        return True
     except Exception as e:
-        app.logger.error(f"Printing error (ESC/POS): {str(e)}")
-        if hprinter:
-             win32print.ClosePrinter(hprinter)
+        PRINT_FAILURES_TOTAL.inc(1, printer_name)
+        app.logger.error(f"Printing error (ESC/POS) on '{printer_name}': {str(e)}")
         return False
-        
-def log_order_to_csv(order_data):
+
+# --- Ticket Preview ---
+# A small ESC/POS interpreter for the commands the ticket renderer uses, so tickets
+# can be checked without a printer (or paper). parse_escpos() turns ticket bytes into
+# printed lines; each line keeps its alignment and a list of (text, style) runs, where
+# style is (font, width multiplier, height multiplier, bold). Lines wrap at the paper
+# width like on the printer: 512 dots, Font A cells 12x24 dots (42 per line), Font B
+# cells 9x17 dots (56 per line).
+PREVIEW_PAPER_DOTS = 512
+PREVIEW_FONT_CELLS = {'A': (12, 24), 'B': (9, 17)}
+PREVIEW_TEXT_COLUMN_DOTS = PREVIEW_FONT_CELLS['A'][0]
+PREVIEW_ALIGNMENTS = {0: 'left', 1: 'center', 2: 'right', 48: 'left', 49: 'center', 50: 'right'}
+CP437_CHARS = bytes(range(256)).decode('cp437')
+
+class PreviewLine:
+    __slots__ = ('align', 'runs', 'dots', 'height', 'cut')
+
+    def __init__(self, align, cut=False):
+        self.align = align
+        self.runs = []
+        self.dots = 0
+        self.height = 0
+        self.cut = cut
+
+    def text(self):
+        return "".join(text for text, _ in self.runs)
+
+def parse_escpos(data):
+    lines = []
+    align, font, width, height, bold = 'left', 'A', 1, 1, False
+    line = None
+    run_chars = []
+    run_style = None
+
+    def end_run():
+        nonlocal run_chars
+        if run_chars:
+            line.runs.append(("".join(run_chars), run_style))
+            run_chars = []
+
+    def end_line():
+        nonlocal line
+        if line is None:
+            line = PreviewLine(align)
+            line.height = PREVIEW_FONT_CELLS[font][1] * height
+        end_run()
+        lines.append(line)
+        line = None
+
+    position = 0
+    length = len(data)
+    while position < length:
+        byte = data[position]
+        position += 1
+        if byte == 0x0A:
+            end_line()
+        elif byte == 0x1B and position < length:
+            command = data[position]
+            argument = data[position + 1] if position + 1 < length else 0
+            position += 1
+            if command == 0x40:  # ESC @
+                if line is not None:
+                    end_run()
+                align, font, width, height, bold = 'left', 'A', 1, 1, False
+            elif command == 0x45:  # ESC E n
+                bold = bool(argument & 1)
+                position += 1
+            elif command == 0x61:  # ESC a n
+                align = PREVIEW_ALIGNMENTS.get(argument, align)
+                position += 1
+            elif command == 0x4D:  # ESC M n
+                font = 'B' if argument in (1, 49) else 'A'
+                position += 1
+            elif command == 0x21:  # ESC ! n
+                font = 'B' if argument & 0x01 else 'A'
+                bold = bool(argument & 0x08)
+                height = 2 if argument & 0x10 else 1
+                width = 2 if argument & 0x20 else 1
+                position += 1
+            elif command == 0x64:  # ESC d n
+                if line is not None:
+                    end_line()
+                for _ in range(argument):
+                    end_line()
+                position += 1
+            elif command in (0x2D, 0x4A, 0x74):  # underline, feed dots, code page
+                position += 1
+        elif byte == 0x1D and position < length:
+            command = data[position]
+            argument = data[position + 1] if position + 1 < length else 0
+            position += 1
+            if command == 0x21:  # GS ! n
+                width = min((argument >> 4) + 1, 8)
+                height = min((argument & 0x0F) + 1, 8)
+                position += 1
+            elif command == 0x56:  # GS V m [n]
+                if line is not None:
+                    end_line()
+                lines.append(PreviewLine(align, cut=True))
+                position += 2 if argument in (65, 66, 97, 98) else 1
+        elif byte >= 0x20:
+            style = (font, width, height, bold)
+            cell_width, cell_height = PREVIEW_FONT_CELLS[font]
+            char_dots = cell_width * width
+            if line is not None and line.dots + char_dots > PREVIEW_PAPER_DOTS:
+                end_line()  # the printer wraps long lines itself
+            if line is None:
+                line = PreviewLine(align)
+            if style != run_style:
+                end_run()
+                run_style = style
+            run_chars.append(CP437_CHARS[byte])
+            line.dots += char_dots
+            line.height = max(line.height, cell_height * height)
+    if line is not None:
+        end_line()
+    return lines
+
+def preview_line_padding(line):
+    free_dots = max(PREVIEW_PAPER_DOTS - line.dots, 0)
+    if line.align == 'center':
+        return free_dots // 2
+    if line.align == 'right':
+        return free_dots
+    return 0
+
+def render_preview_text(lines):
+    # Plain text, one printed line per text line in a 42-column frame. Double width
+    # characters are followed by a space; the cut is drawn as a scissors line.
+    out = []
+    for line in lines:
+        if line.cut:
+            out.append("- " * (NORMAL_FONT_LINE_WIDTH // 2 - 2) + "8<")
+            continue
+        parts = [" " * (preview_line_padding(line) // PREVIEW_TEXT_COLUMN_DOTS)]
+        for text, (font, width, height, bold) in line.runs:
+            parts.append(text if width == 1 else "".join(char + " " * (width - 1) for char in text))
+        out.append("".join(parts).rstrip())
+    return "\n".join(out) + "\n"
+
+def render_preview_html(lines, title="Ticket preview"):
+    # Standalone page; sizes are in 'ch' of the Font A monospace font, so the ticket
+    # keeps the printer's proportions at any zoom level.
+    rows = []
+    for line in lines:
+        if line.cut:
+            rows.append('<div class="cut"></div>')
+            continue
+        spans = []
+        for text, (font, width, height, bold) in line.runs:
+            size = (0.75 if font == 'B' else 1.0) * height
+            style = f"font-size:{size:g}em"
+            if width != height:
+                style += f";letter-spacing:{width / height - 1:g}ch"
+            if bold:
+                style += ";font-weight:bold"
+            spans.append(f'<span style="{style}">{html.escape(text)}</span>')
+        rows.append(f'<div style="text-align:{line.align}">{"".join(spans) or "&nbsp;"}</div>')
+    return ("<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+            f"<title>{html.escape(title)}</title><style>"
+            "body{background:#ddd;margin:0;padding:1em}"
+            ".ticket{background:#fff;width:42ch;padding:1ch 2ch;margin:auto;font-family:'Courier New',monospace;"
+            "line-height:1.3;white-space:pre;overflow:hidden}"
+            ".cut{border-top:2px dashed #999;margin:.5em -2ch}"
+            "</style></head><body><div class=\"ticket\">" + "".join(rows) + "</div></body></html>")
+
+@functools.lru_cache(maxsize=8)
+def preview_font(size):
+    for font_name in ("DejaVuSansMono.ttf", "consola.ttf", "cour.ttf"):
+        try:
+            return ImageFont.truetype(font_name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+def render_preview_png(lines, margin=16):
+    # One pixel per printer dot. Needs Pillow.
+    if Image is None:
+        raise RuntimeError("PNG previews need Pillow (pip install Pillow)")
+    total_height = sum(8 if line.cut else line.height for line in lines)
+    image = Image.new('L', (PREVIEW_PAPER_DOTS + 2 * margin, total_height + 2 * margin), 255)
+    draw = ImageDraw.Draw(image)
+    y = margin
+    for line in lines:
+        if line.cut:
+            for x in range(0, image.width, 8):
+                draw.line([(x, y + 4), (x + 4, y + 4)], fill=128)
+            y += 8
+            continue
+        x = margin + preview_line_padding(line)
+        for text, (font, width, height, bold) in line.runs:
+            cell_width, cell_height = PREVIEW_FONT_CELLS[font]
+            # Draw at the cell size, then stretch to the run's box on the paper
+            glyphs = Image.new('L', (cell_width * len(text), cell_height), 255)
+            glyph_font = preview_font(cell_height - 4)
+            glyph_draw = ImageDraw.Draw(glyphs)
+            for index, char in enumerate(text):
+                glyph_draw.text((index * cell_width, 1), char, fill=0, font=glyph_font,
+                                stroke_width=1 if bold else 0, stroke_fill=0)
+            glyphs = glyphs.resize((glyphs.width * width, cell_height * height))
+            image.paste(glyphs, (x, y + line.height - glyphs.height))
+            x += glyphs.width
+        y += line.height
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+PREVIEW_RENDERERS = {
+    'text': (lambda lines, title: render_preview_text(lines), 'text/plain; charset=utf-8'),
+    'html': (render_preview_html, 'text/html; charset=utf-8'),
+    'png': (lambda lines, title: render_preview_png(lines), 'image/png'),
+}
+
+def render_ticket_preview(ticket_data, preview_format='text', title="Ticket preview"):
+    renderer, mimetype = PREVIEW_RENDERERS[preview_format]
+    return renderer(parse_escpos(ticket_data), title), mimetype
+
+# --- Live Event Stream ---
+# Order and print-status events are fanned out to every client connected to
+# /api/events (server-sent events). Each client gets a small bounded buffer; a client
+# that falls behind far enough to fill it is disconnected rather than slowing down
+# the order path, and can reconnect with Last-Event-ID to catch up from the replay
+# buffer. Idle clients block on their queue, they do not poll.
+# Each open stream holds a server worker thread, so at most EVENT_MAX_CLIENTS are
+# served at once; further clients get 503 and try again after EVENT_RETRY_SECONDS,
+# and the threads left over stay free for orders.
+EVENT_CLIENT_BUFFER_SIZE = 100
+EVENT_REPLAY_SIZE = 200
+EVENT_KEEPALIVE_SECONDS = 15
+EVENT_RESERVED_THREADS = 8
+EVENT_MAX_CLIENTS = max(1, min(CONFIG['event_max_clients'], CONFIG['threads'] - EVENT_RESERVED_THREADS))
+EVENT_RETRY_SECONDS = 30
+
+class EventBroker:
+    def __init__(self, buffer_size=EVENT_CLIENT_BUFFER_SIZE, replay_size=EVENT_REPLAY_SIZE, max_clients=EVENT_MAX_CLIENTS):
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._recent = collections.deque(maxlen=replay_size)
+        self._last_event_id = 0
+
+    def subscribe(self, last_event_id=None):
+        # Returns None when max_clients streams are already open
+        client_queue = queue.Queue(maxsize=self.buffer_size)
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                return None
+            if last_event_id is not None:
+                missed = [message for event_id, message in self._recent if event_id > last_event_id]
+                for message in missed[-self.buffer_size:]:
+                    client_queue.put_nowait(message)
+            self._clients.add(client_queue)
+        return client_queue
+
+    def unsubscribe(self, client_queue):
+        with self._lock:
+            self._clients.discard(client_queue)
+
+    def publish(self, event_type, data):
+        with self._lock:
+            self._last_event_id += 1
+            event_id = self._last_event_id
+            # Serialized once, shared by every client
+            message = f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+            self._recent.append((event_id, message))
+            slow_clients = []
+            for client_queue in self._clients:
+                try:
+                    client_queue.put_nowait(message)
+                except queue.Full:
+                    slow_clients.append(client_queue)
+            for client_queue in slow_clients:
+                self._clients.discard(client_queue)
+                self._drop(client_queue)
+        if slow_clients:
+            app.logger.warning(f"Dropped {len(slow_clients)} slow event stream client(s)")
+
+    @staticmethod
+    def _drop(client_queue):
+        # Make room for the sentinel that tells the client's stream to end
+        try:
+            while True:
+                client_queue.get_nowait()
+        except queue.Empty:
+            pass
+        client_queue.put_nowait(None)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def stream(self, client_queue):
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = client_queue.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client_queue)
+
+event_broker = EventBroker()
+
+# --- Background Print Spooler ---
+# Rendered tickets are queued here and printed by one worker thread per printer, so an order
+# request never waits on the printer. Jobs are retried with exponential backoff.
+# When a printer is down (see the health monitor below) new and retried jobs move to
+# its backup printer. Once it is back, failed tickets of orders that were partly
+# printed are queued again if they are recent enough; any other failed ticket is
+# marked late instead of printing long after the order was served.
+# Once every ticket of an order has finished, the outcome (Yes / Partial / No, as
+# the CSV's printed_status column used to say) is written to the order database.
+# New jobs and finished jobs are appended to the PRINT_QUEUE_FILE journal (one JSON
+# record per line) so tickets survive a restart; the journal is compacted down to the
+# unfinished jobs on start and whenever it grows past PRINT_QUEUE_COMPACT_RECORDS.
+PRINT_QUEUE_FILE = os.path.join(CSV_DIR, 'print_queue.jsonl')
+PRINT_QUEUE_COMPACT_RECORDS = 2000
+PRINT_MAX_ATTEMPTS = 5
+PRINT_RETRY_BASE_DELAY = 2.0   # seconds, doubled after every failed attempt
+PRINT_RETRY_MAX_DELAY = 60.0
+PRINT_JOB_HISTORY_LIMIT = 500  # finished jobs kept around for status polling
+PRINT_REQUEUE_MAX_AGE = 15 * 60  # seconds; older failed tickets are not reprinted
+
+class PrintSpooler:
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._finished = collections.deque()
+        self._queues = {}
+        self._workers = {}
+        self._started = False
+        self._journal = None
+        self._journal_records = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            restored_jobs = self._load()
+        for job in restored_jobs:
+            self._enqueue(job)
+        if restored_jobs:
+            app.logger.info(f"Restored {len(restored_jobs)} unfinished print job(s) from {self.state_file}")
+
+    def submit_orders(self, order_tickets, order_timestamp=None):
+        # order_tickets: (order_number, tickets) pairs, where tickets are
+        # (copy_info, ticket_data, printer_name) tuples. All jobs are saved in one write.
+        # order_timestamp identifies the logged order whose print outcome is recorded.
+        self.start()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        jobs_per_order = [[{
+            'id': uuid.uuid4().hex,
+            'order_number': str(order_number),
+            'order_timestamp': order_timestamp,
+            'order_copies': len(tickets),
+            'copy_info': copy_info,
+            'printer': printer_name or PRINTER_NAME,
+            'status': 'queued',
+            'attempts': 0,
+            'last_error': None,
+            'created_at': now,
+            'updated_at': now,
+            'ticket': base64.b64encode(ticket_data).decode('ascii'),
+        } for copy_info, ticket_data, printer_name in tickets] for order_number, tickets in order_tickets]
+        jobs = [job for order_jobs in jobs_per_order for job in order_jobs]
+        with self._lock:
+            for job in jobs:
+                self._jobs[job['id']] = job
+            self._append_records(jobs, sync=True)
+        for job in jobs:
+            self._enqueue(job)
+        return [[self.public_view(job) for job in order_jobs] for order_jobs in jobs_per_order]
+
+    def submit_many(self, order_number, tickets, order_timestamp=None):
+        return self.submit_orders([(order_number, tickets)], order_timestamp)[0]
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self.public_view(job) if job else None
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'printing'))
+
+    def jobs_for_order(self, order_number):
+        with self._lock:
+            return [self.public_view(job) for job in self._jobs.values() if job['order_number'] == str(order_number)]
+
+    @staticmethod
+    def public_view(job):
+        return {key: value for key, value in job.items() if key != 'ticket'}
+
+    def _requeue_refusal(self, job, now):
+        # Called with self._lock held. Why a failed job should not be printed again
+        # now, or None if it should.
+        try:
+            age = (now - datetime.strptime(job['created_at'], '%Y-%m-%d %H:%M:%S')).total_seconds()
+        except (KeyError, ValueError):
+            age = None
+        if age is None or age > PRINT_REQUEUE_MAX_AGE:
+            return f"more than {PRINT_REQUEUE_MAX_AGE // 60} minutes old"
+        if not any(other['status'] == 'done' for other in self._jobs.values()
+                   if other['order_number'] == job['order_number']
+                   and other.get('order_timestamp') == job.get('order_timestamp')):
+            return "no other copy of the order printed"
+        return None
+
+    def requeue_failed(self, printer_name):
+        # Jobs that failed on printer_name, or on a backup after failing over from it,
+        # go back into the queue if their order was partly printed and is recent; the
+        # rest are marked late. Done jobs are not reprinted.
+        now = datetime.now()
+        now_str = now.strftime('%Y-%m-%d %H:%M:%S')
+        jobs = []
+        late_jobs = []
+        with self._lock:
+            for job in self._jobs.values():
+                if (job['status'] != 'failed' or 'ticket' not in job or job.get('late')
+                        or printer_name not in (job['printer'], job.get('failover_from'))):
+                    continue
+                refusal = self._requeue_refusal(job, now)
+                if refusal:
+                    job['late'] = True
+                    job['last_error'] = f"Late: not printed again after '{printer_name}' came back ({refusal})"
+                    job['updated_at'] = now_str
+                    late_jobs.append(job)
+                else:
+                    jobs.append(job)
+            for job in jobs:
+                job['printer'] = job.pop('failover_from', None) or job['printer']
+                job['status'] = 'queued'
+                job['attempts'] = 0
+                job['last_error'] = f"Queued again after '{printer_name}' came back"
+                job['updated_at'] = now_str
+            if jobs:
+                requeued_ids = {job['id'] for job in jobs}
+                self._finished = collections.deque(job_id for job_id in self._finished if job_id not in requeued_ids)
+                self._append_records(jobs, sync=True)
+            late_views = [self.public_view(job) for job in late_jobs]
+        for job in jobs:
+            self._enqueue(job)
+            event_broker.publish('print_job', self.public_view(job))
+        for job_view in late_views:
+            event_broker.publish('print_job', job_view)
+        if jobs:
+            app.logger.info(f"Re-queued {len(jobs)} failed print job(s) for '{printer_name}'")
+        if late_jobs:
+            app.logger.warning(f"{len(late_jobs)} failed print job(s) for '{printer_name}' are late and were not re-queued")
+        return len(jobs)
+
+    def _enqueue(self, job):
+        # Routing only reads the monitor's cached state; it never waits on a printer.
+        routed_printer = printer_health.route(job['printer'])
+        with self._lock:
+            if routed_printer != job['printer']:
+                PRINT_FAILOVERS_TOTAL.inc(1, job['printer'], routed_printer)
+                app.logger.warning(f"Printer '{job['printer']}' is down; job {job['id']} for order "
+                                   f"#{job['order_number']} goes to '{routed_printer}'")
+                job.setdefault('failover_from', job['printer'])
+                job['printer'] = routed_printer
+            printer_name = job['printer']
+            if printer_name not in self._queues:
+                self._queues[printer_name] = queue.Queue()
+                worker = threading.Thread(target=self._worker_loop, args=(printer_name,),
+                                          name=f"print-worker-{printer_name}", daemon=True)
+                self._workers[printer_name] = worker
+                worker.start()
+            job_queue = self._queues[printer_name]
+        job_queue.put(job['id'])
+
+    def _print_outcome(self, job):
+        # Called with self._lock held. The order's printed_status once all of its
+        # tickets have finished, else None. Jobs restored after a restart may miss
+        # siblings that finished before it; those orders keep their status.
+        if not job.get('order_timestamp'):
+            return None
+        order_jobs = [other for other in self._jobs.values()
+                      if other['order_number'] == job['order_number']
+                      and other.get('order_timestamp') == job['order_timestamp']]
+        if len(order_jobs) != job.get('order_copies') or any(
+                other['status'] not in ('done', 'failed') for other in order_jobs):
+            return None
+        done = sum(1 for other in order_jobs if other['status'] == 'done')
+        if done == len(order_jobs):
+            return f"Yes ({done} {'copy' if done == 1 else 'copies'})"
+        if done:
+            return f"Partial ({done} {'copy' if done == 1 else 'copies'})"
+        return 'No'
+
+    def _set_status(self, job, status, error=None):
+        printed_status = None
+        with self._lock:
+            job['status'] = status
+            job['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if error is not None:
+                job['last_error'] = error
+            # Only leaving the unfinished set changes what has to survive a restart.
+            # Not fsynced: losing this record in a crash at worst prints a ticket twice.
+            if status in ('done', 'failed'):
+                self._append_records([{'id': job['id'], 'status': status}], sync=False)
+                if status == 'done':
+                    job.pop('ticket', None)
+                printed_status = self._print_outcome(job)
+                self._finished.append(job['id'])
+                while len(self._finished) > PRINT_JOB_HISTORY_LIMIT:
+                    self._jobs.pop(self._finished.popleft(), None)
+            job_view = self.public_view(job)
+        event_broker.publish('print_job', job_view)
+        if printed_status:
+            record_print_outcome(job['order_number'], job['order_timestamp'], printed_status)
+
+    def _worker_loop(self, printer_name):
+        job_queue = self._queues[printer_name]
+        while True:
+            job_id = job_queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if not job or job['status'] not in ('queued', 'printing'):
+                continue
+            try:
+                self._run_job(job)
+            except Exception as e:
+                # A broken job (e.g. an unreadable ticket restored from the journal) must
+                # not stop the worker: every later job for this printer would stay queued.
+                app.logger.error(f"Print job {job['id']} for order #{job['order_number']} failed: {str(e)}")
+                try:
+                    if job['status'] not in ('done', 'failed'):
+                        self._set_status(job, 'failed', error=f"Could not be printed: {str(e)}")
+                except Exception as status_error:
+                    app.logger.error(f"Could not mark print job {job['id']} as failed: {str(status_error)}")
+
+    def _run_job(self, job):
+        delay = PRINT_RETRY_BASE_DELAY
+        while True:
+            with self._lock:
+                job['attempts'] += 1
+            self._set_status(job, 'printing')
+            printer_name = job['printer']
+            success = send_ticket(base64.b64decode(job['ticket']),
+                                  ticket_doc_name(job['order_number'], job['copy_info']),
+                                  printer_name=printer_name)
+            if success:
+                printer_health.report_success(printer_name)
+                self._set_status(job, 'done')
+                PRINT_JOBS_TOTAL.inc(1, printer_name, 'done')
+                return
+            printer_health.report_failure(printer_name, "Did not accept a ticket")
+            if job['attempts'] >= PRINT_MAX_ATTEMPTS:
+                app.logger.error(f"Print job {job['id']} for order #{job['order_number']} failed after {job['attempts']} attempts")
+                PRINT_JOBS_TOTAL.inc(1, job['printer'], 'failed')
+                self._set_status(job, 'failed', error=f"Printer '{job['printer']}' did not accept the ticket")
+                return
+            if printer_health.route(printer_name) != printer_name:
+                # A backup is available: hand the job over instead of waiting here
+                self._set_status(job, 'queued', error=f"Attempt {job['attempts']} failed on '{printer_name}'")
+                self._enqueue(job)
+                return
+            self._set_status(job, 'queued', error=f"Attempt {job['attempts']} failed, retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, PRINT_RETRY_MAX_DELAY)
+
+    def _load(self):
+        # Replays the journal. A torn last line from a crash is ignored.
+        restored_jobs = {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if 'ticket' in record:
+                        restored_jobs[record['id']] = record
+                    else:
+                        restored_jobs.pop(record.get('id'), None)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            app.logger.error(f"Could not read print queue journal: {str(e)}")
+        for job in restored_jobs.values():
+            job['status'] = 'queued'
+            self._jobs[job['id']] = job
+        self._compact()
+        return list(restored_jobs.values())
+
+    def _compact(self):
+        # Called with self._lock held. Rewrites the journal with only the unfinished jobs.
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        unfinished = [job for job in self._jobs.values() if job['status'] in ('queued', 'printing')]
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            temp_path = self.state_file + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for job in unfinished:
+                    f.write(json.dumps(job) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.state_file)
+            self._journal = open(self.state_file, 'a', encoding='utf-8')
+        except OSError as e:
+            app.logger.error(f"Could not compact print queue journal: {str(e)}")
+        self._journal_records = len(unfinished)
+
+    def _append_records(self, records, sync):
+        # Called with self._lock held.
+        try:
+            with SPOOLER_WRITE_SECONDS.time('fsync' if sync else 'flush'):
+                if self._journal is None:
+                    os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+                    self._journal = open(self.state_file, 'a', encoding='utf-8')
+                self._journal.write("".join(json.dumps(record) + "\n" for record in records))
+                self._journal.flush()
+                if sync:
+                    os.fsync(self._journal.fileno())
+        except OSError as e:
+            app.logger.error(f"Could not write print queue journal: {str(e)}")
+            return
+        self._journal_records += len(records)
+        if self._journal_records > PRINT_QUEUE_COMPACT_RECORDS:
+            self._compact()
+
+print_spooler = PrintSpooler(PRINT_QUEUE_FILE)
+
+# --- Printer Health Monitor ---
+# A background thread asks every known printer for its status (DLE EOT real-time
+# status on network printers, the Windows spooler's printer status otherwise) every
+# printer_health_interval seconds. Print results update the state right away as well.
+# The order path only reads the cached state, so a dead printer never adds a timeout
+# there. State changes are logged and published as 'printer' events; when a printer
+# comes back, its failed jobs are queued again.
+PRINTER_STATES = ('ok', 'unknown', 'offline', 'paper_out', 'error')
+PRINTER_DOWN_STATES = ('offline', 'paper_out', 'error')
+
+class PrinterHealthMonitor:
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._health = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def printer_names(self):
+        names = {PRINTER_NAME, *STATIONS.values(), *BACKUP_PRINTERS.keys(), *BACKUP_PRINTERS.values()}
+        with self._lock:
+            names.update(self._health)
+        return sorted(name for name in names if name)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="printer-health", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            for printer_name in self.printer_names():
+                self.check(printer_name)
+            if self._stop.wait(self.interval):
+                return
+
+    def check(self, printer_name):
+        try:
+            state, detail = get_printer_backend(printer_name).status()
+        except Exception as e:
+            state, detail = 'error', str(e)
+        self._update(printer_name, state, detail)
+        return state
+
+    def report_success(self, printer_name):
+        with self._lock:
+            health = self._health.get(printer_name)
+            if health and health['state'] == 'ok':
+                return
+        self._update(printer_name, 'ok', None)
+
+    def report_failure(self, printer_name, detail):
+        with self._lock:
+            health = self._health.get(printer_name)
+            if health and health['state'] in PRINTER_DOWN_STATES:
+                return
+        self._update(printer_name, 'error', detail)
+
+    def _update(self, printer_name, state, detail):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            previous = self._health.get(printer_name)
+            previous_state = previous['state'] if previous else 'unknown'
+            changed = previous is None or previous_state != state
+            self._health[printer_name] = {
+                'printer': printer_name,
+                'state': state,
+                'detail': detail,
+                'checked_at': now,
+                'since': now if changed else previous['since'],
+                'backup': BACKUP_PRINTERS.get(printer_name),
+            }
+            health_view = dict(self._health[printer_name])
+        if not changed:
+            return
+        if state in PRINTER_DOWN_STATES:
+            app.logger.warning(f"Printer '{printer_name}' is down ({state}): {detail}")
+        elif previous_state in PRINTER_DOWN_STATES:
+            app.logger.info(f"Printer '{printer_name}' is back ({state})")
+        event_broker.publish('printer', health_view)
+        if state == 'ok' and previous_state in PRINTER_DOWN_STATES:
+            print_spooler.requeue_failed(printer_name)
+
+    def is_down(self, printer_name):
+        with self._lock:
+            health = self._health.get(printer_name)
+            return health is not None and health['state'] in PRINTER_DOWN_STATES
+
+    def route(self, printer_name):
+        # The printer a new or retried job should go to right now
+        if not self.is_down(printer_name):
+            return printer_name
+        backup = BACKUP_PRINTERS.get(printer_name)
+        if backup and backup != printer_name and not self.is_down(backup):
+            return backup
+        return printer_name
+
+    def snapshot(self):
+        with self._lock:
+            health = {name: dict(state) for name, state in self._health.items()}
+        for printer_name in self.printer_names():
+            health.setdefault(printer_name, {'printer': printer_name, 'state': 'unknown', 'detail': None,
+                                             'checked_at': None, 'since': None,
+                                             'backup': BACKUP_PRINTERS.get(printer_name)})
+        return [health[name] for name in sorted(health)]
+
+printer_health = PrinterHealthMonitor(CONFIG['printer_health_interval'])
+atexit.register(printer_health.stop)
+
+# --- Station Routing ---
+# Splits an order into one ticket per kitchen station (by menu category, see
+# 'stations' and 'category_stations' in the config). Each station's ticket goes to
+# that station's printer; since the spooler runs one worker per printer, the stations
+# print at the same time and the order is out as soon as the slowest printer is done.
+def route_order_items(order_data):
+    # Returns station -> positions of that station's items in order_data['items']
     try:
+        menu_index = menu_cache.get().index
+    except Exception as e:
+        app.logger.error(f"Menu unavailable for station routing, using '{DEFAULT_STATION}': {str(e)}")
+        menu_index = None
+    positions_by_station = {}
+    for position, item in enumerate(order_data.get('items', [])):
+        category = menu_index.category_of(item.get('id')) if menu_index else None
+        station = CATEGORY_STATIONS.get(category, DEFAULT_STATION)
+        if station not in STATIONS:
+            station = DEFAULT_STATION
+        positions_by_station.setdefault(station, []).append(position)
+    return positions_by_station
+
+def plan_order_tickets(order_data, timestamp_str):
+    # Returns (copy_info, ticket_data, printer_name) for every ticket of a new order
+    if not STATIONS:
+        copy_infos = ("Kitchen", "Customer")
+        tickets = render_kitchen_tickets(order_data, copy_infos, original_timestamp_str=timestamp_str)
+        return [(copy_info, ticket_data, None) for copy_info, ticket_data in zip(copy_infos, tickets)]
+
+    planned = []
+    items = order_data.get('items', [])
+    line_cents = order_data.get('line_cents') or [order_item_line_cents(item) for item in items]
+    for station, positions in route_order_items(order_data).items():
+        station_order = dict(order_data, items=[items[position] for position in positions],
+                             line_cents=[line_cents[position] for position in positions])
+        station_ticket = render_kitchen_ticket(station_order, copy_info=station, original_timestamp_str=timestamp_str)
+        planned.append((station, station_ticket, STATIONS.get(station) or PRINTER_NAME))
+    customer_ticket = render_kitchen_ticket(order_data, copy_info="Customer", original_timestamp_str=timestamp_str)
+    planned.append(("Customer", customer_ticket, PRINTER_NAME))
+    return planned
+
+# --- Append-only Order Log ---
+# Each order is appended to the daily CSV instead of re-reading and rewriting the
+# whole file. fsync is batched: the OS buffers are flushed on every append, but the
+# disk sync only happens every FSYNC_BATCH_SIZE rows, or FSYNC_INTERVAL_SECONDS after
+# the last sync at most (a background timer syncs rows left over in a quiet spell).
+# A torn last row left by a crash is cut off when the log is reopened, and rows that
+# can't be parsed are never deleted: both are moved to ORDER_QUARANTINE_DIR.
+CSV_FIELDNAMES = [
+    'order_number', 'table_number', 'timestamp', 'items_summary', 
+    'universal_comment', 'order_total', 'printed_status', 'items_json'
+]
+FSYNC_BATCH_SIZE = 10
+FSYNC_INTERVAL_SECONDS = 2.0
+ORDER_QUARANTINE_DIR = os.path.join(CSV_DIR, 'quarantine')
+
+def order_log_path(date_str):
+    return os.path.join(CSV_DIR, f"orders_{date_str}.csv")
+
+def order_log_complete_size(filename):
+    # Length in bytes of the complete rows at the start of a log. A row ends at a
+    # newline outside quotes, so a row torn inside a quoted field (items_json always
+    # is one) is not mistaken for a finished one.
+    complete_size = 0
+    size = 0
+    in_quotes = False
+    with open(filename, 'rb') as f:
+        for raw_line in f:
+            size += len(raw_line)
+            if raw_line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes and raw_line.endswith(b'\n'):
+                complete_size = size
+    return complete_size
+
+def quarantine_order_log_data(date_str, data):
+    # Keeps what could not be used from a day's log in quarantine/orders_DATE.csv
+    os.makedirs(ORDER_QUARANTINE_DIR, exist_ok=True)
+    with open(os.path.join(ORDER_QUARANTINE_DIR, f"orders_{date_str}.csv"), 'ab') as f:
+        f.write(data if data.endswith(b'\n') else data + b'\r\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+class OrderJournal:
+    def __init__(self, fsync_batch_size=FSYNC_BATCH_SIZE, fsync_interval=FSYNC_INTERVAL_SECONDS):
+        self.fsync_batch_size = fsync_batch_size
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+        self._date_str = None
+        self._unsynced_rows = 0
+        self._last_sync = time.monotonic()
+        self._flush_stop = None
+
+    def _start_flush_timer(self):
+        # Called with self._lock held
+        if self._flush_stop is None:
+            self._flush_stop = threading.Event()
+            threading.Thread(target=self._flush_loop, args=(self._flush_stop,),
+                             name="order-log-fsync", daemon=True).start()
+
+    def _flush_loop(self, stop):
+        while not stop.wait(self.fsync_interval):
+            with self._lock:
+                try:
+                    if self._unsynced_rows and time.monotonic() - self._last_sync >= self.fsync_interval / 2:
+                        self._sync()
+                except OSError as e:
+                    app.logger.error(f"Could not sync order log: {str(e)}")
+
+    def _open(self, date_str):
+        previous_date = self._date_str
+        self._close()
         os.makedirs(CSV_DIR, exist_ok=True)
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        filename = os.path.join(CSV_DIR, f"orders_{date_str}.csv")
-
-        fieldnames = [
-            'order_number', 'table_number', 'timestamp', 'items_summary', 
-            'universal_comment', 'order_total', 'printed_status', 'items_json'
-        ]
-
-        # Print the receipt twice, without the copy info
-        app.logger.info(f"Printing receipt for order #{order_data.get('number', 'N/A')}")
-        print_success1 = print_kitchen_ticket(order_data, copy_info="Kitchen")
-        time.sleep(1)  # Small delay for the printer queue
-        print_success2 = print_kitchen_ticket(order_data, copy_info="Customer")
-
-        if print_success1 and print_success2:
-            printed_status = 'Yes (2 copies)'
-        elif print_success1 or print_success2:
-            printed_status = 'Partial (1 copy)'
-        else:
-            printed_status = 'No'
+        filename = order_log_path(date_str)
+        if os.path.exists(filename):
+            # A crash in the middle of an append can leave a torn last row behind; cut
+            # it off so the next row does not get glued onto it.
+            complete_size = order_log_complete_size(filename)
+            if complete_size < os.path.getsize(filename):
+                with open(filename, 'rb') as f_torn:
+                    f_torn.seek(complete_size)
+                    quarantine_order_log_data(date_str, f_torn.read())
+                os.truncate(filename, complete_size)
+                app.logger.warning(f"Moved a torn row at the end of {filename} to {ORDER_QUARANTINE_DIR}")
+        needs_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self._file = open(filename, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDNAMES)
+        if needs_header:
+            self._writer.writeheader()
+        self._date_str = date_str
+        if previous_date and previous_date != date_str:
+            # Off the order path: the first order of the day should not wait for it
+            threading.Thread(target=self.compact, args=(previous_date,),
+                             name=f"compact-orders-{previous_date}", daemon=True).start()
+
+    def _sync(self):
+        if self._file and self._unsynced_rows:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced_rows = 0
+        self._last_sync = time.monotonic()
+
+    def _close(self):
+        if self._file:
+            self._sync()
+            self._file.close()
+        self._file = None
+        self._writer = None
+        self._date_str = None
+
+    def append(self, row, date_str=None):
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            if self._date_str != date_str:
+                self._open(date_str)
+            self._writer.writerow(row)
+            self._file.flush()
+            self._unsynced_rows += 1
+            if (self._unsynced_rows >= self.fsync_batch_size
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+            else:
+                self._start_flush_timer()
+
+    def append_many(self, rows, date_str=None):
+        # Writes all rows and syncs once, for callers that need them on disk together
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            if self._date_str != date_str:
+                self._open(date_str)
+            self._writer.writerows(rows)
+            self._unsynced_rows += len(rows)
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._close()
+            if self._flush_stop is not None:
+                self._flush_stop.set()
+                self._flush_stop = None
 
-        existing_rows = []
-        file_exists = os.path.exists(filename)
-        if file_exists:
+    def compact(self, date_str):
+        # Rewrites a finished day's log in the standard CSV layout, dropping manual
+        # 'total' rows. Rows that don't fit the layout go to the quarantine file. The
+        # new file is swapped in with os.replace, and not at all if the day's log was
+        # written to in the meantime. Returns the number of rows kept, or None.
+        filename = order_log_path(date_str)
+        try:
+            size_before = os.path.getsize(filename)
+            kept_rows = []
+            quarantined = io.StringIO()
+            quarantine_writer = csv.writer(quarantined)
             with open(filename, 'r', newline='', encoding='utf-8') as f_read:
-                reader = csv.DictReader(f_read)
-                for row in reader:
-                    if row.get('order_number', '').lower() != 'total':
-                        existing_rows.append(row)
+                reader = csv.reader(f_read)
+                header = next(reader, None) or CSV_FIELDNAMES
+                for fields in reader:
+                    if not fields:
+                        continue
+                    row = dict(zip(header, fields))
+                    if len(fields) != len(header) or any(field not in row for field in CSV_FIELDNAMES):
+                        quarantine_writer.writerow(fields)
+                        continue
+                    if not row['order_number'] or row['order_number'].lower() == 'total':
+                        continue
+                    kept_rows.append(row)
+        except FileNotFoundError:
+            return None
+        except (OSError, csv.Error, UnicodeDecodeError) as e:
+            app.logger.error(f"Could not compact order log {filename}: {str(e)}")
+            return None
+        fd, temp_path = tempfile.mkstemp(prefix=f".orders_{date_str}_", suffix=".csv", dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f_write:
+                writer = csv.DictWriter(f_write, fieldnames=CSV_FIELDNAMES, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(kept_rows)
+                f_write.flush()
+                os.fsync(f_write.fileno())
+            with self._lock:
+                if self._date_str == date_str or os.path.getsize(filename) != size_before:
+                    app.logger.info(f"Order log {filename} changed while compacting; left as it is")
+                    os.remove(temp_path)
+                    return None
+                if quarantined.getvalue():
+                    quarantine_order_log_data(date_str, quarantined.getvalue().encode('utf-8'))
+                os.replace(temp_path, filename)
+        except Exception as e:
+            app.logger.error(f"Could not compact order log {filename}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        return len(kept_rows)
+
+order_journal = OrderJournal()
+atexit.register(order_journal.close)
+
+# --- In-memory Order Store ---
+# Today's orders, loaded once from the day's CSV and kept up to date as orders are
+# logged, so reprint lookups never touch the disk. Orders are kept sorted by
+# timestamp and indexed by order number. The store reloads itself the
+# first time it is used on a new day.
+class OrderStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._date_str = None
+        self._orders = []
+        self._timestamps = []
+        self._by_number = {}
+
+    def _ensure_current_day(self):
+        today_date_str = datetime.now().strftime("%Y-%m-%d")
+        if self._date_str != today_date_str:
+            self._load(today_date_str)
+
+    def _load(self, date_str):
+        self._date_str = date_str
+        self._orders = []
+        self._timestamps = []
+        self._by_number = {}
+        filename = order_log_path(date_str)
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r', newline='', encoding='utf-8') as f_read:
+            reader = csv.DictReader(f_read)
+            for row in reader:
+                if row.get('order_number', '').lower() in ['total', ''] or not row.get('items_json'):
+                    continue
+                try:
+                    items = json.loads(row['items_json'])
+                except json.JSONDecodeError:
+                    items = None
+                self._add(row, items)
+
+    def _add(self, row, items):
+        # A reload can pick up a row that add() is about to insert as well
+        for existing in self._by_number.get(str(row.get('order_number')), []):
+            if existing['timestamp'] == (row.get('timestamp') or ''):
+                return existing
+        order = {
+            'order_number': str(row.get('order_number')),
+            'table_number': str(row.get('table_number', 'N/A')),
+            'timestamp': row.get('timestamp') or '',
+            'universal_comment': row.get('universal_comment', ''),
+            'order_total': row.get('order_total', ''),
+            'items': items,
+        }
+        order['summary'] = {
+            'order_number': order['order_number'],
+            'table_number': order['table_number'],
+            'timestamp': order['timestamp'],
+        }
+        # Orders nearly always arrive in timestamp order, so this is an append.
+        position = bisect.bisect_right(self._timestamps, order['timestamp'])
+        self._timestamps.insert(position, order['timestamp'])
+        self._orders.insert(position, order)
+        self._by_number.setdefault(order['order_number'], []).append(order)
+        return order
+
+    def add(self, row, items):
+        date_str = (row.get('timestamp') or '')[:10]
+        with self._lock:
+            if date_str == self._date_str:
+                self._add(row, items)
+            else:
+                # Not loaded for this day yet; the row is already in the day's log.
+                self._ensure_current_day()
+
+    def get(self, order_number):
+        with self._lock:
+            self._ensure_current_day()
+            matches = self._by_number.get(str(order_number))
+            return matches[0] if matches else None
+
+    def reprint_list(self):
+        # Newest first, straight from the sorted list
+        with self._lock:
+            self._ensure_current_day()
+            return [order['summary'] for order in reversed(self._orders)]
+
+    def max_order_number(self):
+        with self._lock:
+            self._ensure_current_day()
+            return max((int(number) for number in self._by_number if number.isdigit()), default=0)
+
+order_store = OrderStore()
+
+def order_item_dicts(items):
+    # The items of a logged order. items_json in a hand-edited CSV can hold any JSON,
+    # so anything that isn't a list of item objects is skipped.
+    if not isinstance(items, list):
+        return []
+    return [item for item in items if isinstance(item, dict)]
+
+def summarize_order_items(items, line_cents=None):
+    if line_cents is None:
+        line_cents = [order_item_line_cents(item) for item in items]
+    items_summary_parts = []
+    for item in items:
+        option_summary_parts = []
+        selected_options = item.get('selectedOptions', [])
+        if selected_options and isinstance(selected_options, list):
+            for option in selected_options:
+                option_price = float(option.get('price', 0.0))
+                option_name = option.get('name', '')
+                price_str = f" (+{option_price:.2f})" if option_price > 0 else ""
+                option_summary_parts.append(f"{option_name}{price_str}")
         
-        new_order_total = 0.0
-        items_summary_parts = []
-        for item in order_data.get('items', []):
-            item_price = float(item.get('price', 0))
-            
-            total_options_price = 0.0
-            option_summary_parts = []
+        summary_part = f"{item.get('quantity', 0)}x {item.get('name', 'N/A')}"
+        if option_summary_parts:
+            summary_part += f" (Opts: {', '.join(option_summary_parts)})"
+
+        if item.get('comment','').strip():
+             summary_part += f" (Note: {item.get('comment','').strip()})"
+        items_summary_parts.append(summary_part)
+
+    return " | ".join(items_summary_parts), sum(line_cents) / 100
+
+# --- SQLite Order Database ---
+# Orders are also stored in SQLite (WAL mode) in normalized orders / order_items /
+# order_item_options tables, so questions spanning many days don't mean parsing a CSV
+# per day. Each thread gets its own connection and every write is a single
+# BEGIN IMMEDIATE transaction, so concurrent writers queue up instead of racing.
+# The daily CSV stays the bookkeeping format: import_csv_files() loads existing
+# orders_*.csv files and export_csv() writes a day back out in the same layout.
+ORDER_DB_FILE = os.path.join(CSV_DIR, 'orders.db')
+
+ORDER_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    order_date TEXT NOT NULL,
+    order_number TEXT NOT NULL,
+    table_number TEXT,
+    timestamp TEXT NOT NULL,
+    universal_comment TEXT NOT NULL DEFAULT '',
+    total_cents INTEGER NOT NULL,
+    printed_status TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_unique ON orders(order_date, order_number, timestamp);
+CREATE INDEX IF NOT EXISTS idx_orders_number ON orders(order_number);
+CREATE INDEX IF NOT EXISTS idx_orders_table ON orders(order_date, table_number);
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    menu_item_id INTEGER,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_price_cents INTEGER NOT NULL,
+    comment TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items(name);
+CREATE TABLE IF NOT EXISTS order_item_options (
+    id INTEGER PRIMARY KEY,
+    item_id INTEGER NOT NULL REFERENCES order_items(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    price_cents INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_order_item_options_item ON order_item_options(item_id);
+CREATE TABLE IF NOT EXISTS imported_files (
+    filename TEXT PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    file_mtime_ns INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    imported_at TEXT NOT NULL
+);
+"""
+
+def to_cents(value):
+    try:
+        return int(round(float(value) * 100))
+    except (TypeError, ValueError):
+        return 0
+
+def parse_euro_amount(text):
+    # '€12.30' as written to the order_total column
+    return to_cents((text or '').replace('€', '').replace(',', '').strip() or 0)
+
+class OrderDatabase:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(ORDER_DB_SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    def _insert_order(self, conn, row, items):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO orders (order_date, order_number, table_number, timestamp, "
+            "universal_comment, total_cents, printed_status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((row.get('timestamp') or '')[:10], str(row.get('order_number')), str(row.get('table_number', 'N/A')),
+             row.get('timestamp') or '', row.get('universal_comment') or '',
+             parse_euro_amount(row.get('order_total')), row.get('printed_status')))
+        if cursor.rowcount == 0:
+            return False  # Already stored (e.g. re-importing a CSV)
+        order_id = cursor.lastrowid
+        for position, item in enumerate(items or []):
+            menu_item_id = item.get('id')
+            item_cursor = conn.execute(
+                "INSERT INTO order_items (order_id, position, menu_item_id, name, quantity, unit_price_cents, comment) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (order_id, position, menu_item_id if isinstance(menu_item_id, int) else None,
+                 item.get('name', 'N/A'), int(item.get('quantity', 0) or 0), to_cents(item.get('price', 0)),
+                 (item.get('comment') or '').strip()))
             selected_options = item.get('selectedOptions', [])
             if selected_options and isinstance(selected_options, list):
-                for option in selected_options:
-                    option_price = float(option.get('price', 0.0))
-                    total_options_price += option_price
-                    option_name = option.get('name', '')
-                    price_str = f" (+{option_price:.2f})" if option_price > 0 else ""
-                    option_summary_parts.append(f"{option_name}{price_str}")
-            
-            new_order_total += (item_price + total_options_price) * item.get('quantity', 0)
-            
-            summary_part = f"{item.get('quantity', 0)}x {item.get('name', 'N/A')}"
-            if option_summary_parts:
-                summary_part += f" (Opts: {', '.join(option_summary_parts)})"
-
-            if item.get('comment','').strip():
-                 summary_part += f" (Note: {item.get('comment','').strip()})"
-            items_summary_parts.append(summary_part)
-
-        items_summary_str = " | ".join(items_summary_parts)
-
-        new_row = {
-            'order_number': order_data.get('number', 'N/A'),
-            'table_number': order_data.get('tableNumber', 'N/A'),
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'items_summary': items_summary_str,
-            'items_json': json.dumps(order_data.get('items', [])),
-            'universal_comment': order_data.get('universalComment', '').strip(),
-            'order_total': f"€{new_order_total:.2f}",
-            'printed_status': printed_status
+                conn.executemany(
+                    "INSERT INTO order_item_options (item_id, position, name, price_cents) VALUES (?, ?, ?, ?)",
+                    [(item_cursor.lastrowid, option_position, option.get('name', ''), to_cents(option.get('price', 0)))
+                     for option_position, option in enumerate(selected_options)])
+        return True
+
+    def insert_orders(self, rows_with_items, skip_invalid=False):
+        # With skip_invalid, a row whose data can't be stored is left out (and logged)
+        # instead of failing the whole transaction.
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = 0
+            for row, items in rows_with_items:
+                if not skip_invalid:
+                    inserted += self._insert_order(conn, row, items)
+                    continue
+                conn.execute("SAVEPOINT order_row")
+                try:
+                    inserted += self._insert_order(conn, row, items)
+                except (ValueError, TypeError, AttributeError) as e:
+                    conn.execute("ROLLBACK TO order_row")
+                    app.logger.warning(f"Skipping order #{row.get('order_number')} of {row.get('timestamp')}: {str(e)}")
+                conn.execute("RELEASE order_row")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return inserted
+
+    def set_printed_status(self, order_number, timestamp, printed_status):
+        conn = self._connection()
+        conn.execute("UPDATE orders SET printed_status = ? WHERE order_date = ? AND order_number = ? AND timestamp = ?",
+                     (printed_status, timestamp[:10], str(order_number), timestamp))
+
+    def import_csv_files(self):
+        # One-shot migration of the daily CSV logs. Files that haven't changed since
+        # their last import are skipped, and rows already in the database are ignored,
+        # so this is safe to run on every start.
+        conn = self._connection()
+        imported_orders = 0
+        for filename in sorted(os.listdir(CSV_DIR)) if os.path.isdir(CSV_DIR) else []:
+            if not (filename.startswith('orders_') and filename.endswith('.csv')):
+                continue
+            path = os.path.join(CSV_DIR, filename)
+            st = os.stat(path)
+            previous = conn.execute("SELECT file_size, file_mtime_ns FROM imported_files WHERE filename = ?",
+                                    (filename,)).fetchone()
+            if previous and previous['file_size'] == st.st_size and previous['file_mtime_ns'] == st.st_mtime_ns:
+                continue
+            rows_with_items = []
+            try:
+                with open(path, 'r', newline='', encoding='utf-8') as f_read:
+                    for row in csv.DictReader(f_read):
+                        if (row.get('order_number') or '').lower() in ['total', ''] or not row.get('timestamp'):
+                            continue
+                        try:
+                            items = json.loads(row.get('items_json') or '[]')
+                        except json.JSONDecodeError:
+                            items = None
+                        if not isinstance(items, list):
+                            app.logger.warning(f"Skipping items of order #{row.get('order_number')} in {filename}: bad items_json")
+                        rows_with_items.append((row, order_item_dicts(items)))
+            except (csv.Error, UnicodeDecodeError) as e:
+                app.logger.error(f"Could not import {filename}: {str(e)}")
+                continue
+            imported_orders += self.insert_orders(rows_with_items, skip_invalid=True)
+            conn.execute("INSERT OR REPLACE INTO imported_files (filename, file_size, file_mtime_ns, row_count, imported_at) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (filename, st.st_size, st.st_mtime_ns, len(rows_with_items),
+                          datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        return imported_orders
+
+    def orders_for_date(self, date_str):
+        conn = self._connection()
+        orders = [dict(row) for row in conn.execute(
+            "SELECT * FROM orders WHERE order_date = ? ORDER BY timestamp, id", (date_str,))]
+        if not orders:
+            return []
+        by_id = {order['id']: order for order in orders}
+        items_by_id = {}
+        for order in orders:
+            order['items'] = []
+        placeholders = ",".join("?" * len(by_id))
+        for item in conn.execute(f"SELECT * FROM order_items WHERE order_id IN ({placeholders}) ORDER BY order_id, position",
+                                 list(by_id)):
+            item_dict = {'name': item['name'], 'price': item['unit_price_cents'] / 100,
+                         'quantity': item['quantity'], 'comment': item['comment'], 'selectedOptions': []}
+            if item['menu_item_id'] is not None:
+                item_dict['id'] = item['menu_item_id']
+            items_by_id[item['id']] = item_dict
+            by_id[item['order_id']]['items'].append(item_dict)
+        if items_by_id:
+            placeholders = ",".join("?" * len(items_by_id))
+            for option in conn.execute(f"SELECT * FROM order_item_options WHERE item_id IN ({placeholders}) "
+                                       "ORDER BY item_id, position", list(items_by_id)):
+                items_by_id[option['item_id']]['selectedOptions'].append(
+                    {'name': option['name'], 'price': option['price_cents'] / 100})
+        return orders
+
+    def export_csv(self, date_str, path):
+        # Writes one day from the database in the daily CSV layout
+        orders = self.orders_for_date(date_str)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=f".export_{date_str}_", suffix=".csv", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f_write:
+                writer = csv.DictWriter(f_write, fieldnames=CSV_FIELDNAMES)
+                writer.writeheader()
+                for order in orders:
+                    items_summary_str, _ = summarize_order_items(order['items'])
+                    writer.writerow({
+                        'order_number': order['order_number'],
+                        'table_number': order['table_number'],
+                        'timestamp': order['timestamp'],
+                        'items_summary': items_summary_str,
+                        'items_json': json.dumps(order['items']),
+                        'universal_comment': order['universal_comment'],
+                        'order_total': f"€{order['total_cents'] / 100:.2f}",
+                        'printed_status': order['printed_status'],
+                    })
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return len(orders)
+
+order_db = OrderDatabase(ORDER_DB_FILE)
+
+def record_print_outcome(order_number, order_timestamp, printed_status):
+    # The CSV log is append-only and keeps 'Queued (N copies)'; the database row
+    # (and so export_csv) gets the final outcome.
+    try:
+        order_db.set_printed_status(order_number, order_timestamp, printed_status)
+    except Exception as e:
+        app.logger.error(f"Could not record print outcome of order #{order_number}: {str(e)}")
+
+# --- Sales Statistics ---
+# Running aggregates per day: revenue by hour, item and option counts, per-table
+# totals. Today's rollup lives in memory and is updated in O(items) as each order is
+# logged. Past days are computed once from their CSV and cached as JSON in
+# STATS_DIR, keyed to the CSV's size and mtime, so a long report only reads small
+# rollup files.
+STATS_DIR = os.path.join(CSV_DIR, 'stats')
+STATS_MAX_RANGE_DAYS = 400
+STATS_MEMORY_CACHE_DAYS = 120
+
+def empty_rollup(date_str):
+    return {
+        'date': date_str,
+        'order_count': 0,
+        'revenue_cents': 0,
+        'revenue_by_hour': {},
+        'items': {},
+        'tables': {},
+    }
+
+def add_order_to_rollup(rollup, timestamp, table_number, items, line_cents=None):
+    items = items or []
+    if line_cents is None:
+        line_cents = [order_item_line_cents(item) for item in items]
+    order_cents = 0
+    for item, item_line_cents in zip(items, line_cents):
+        quantity = int(item.get('quantity', 0) or 0)
+        selected_options = item.get('selectedOptions', [])
+        if not (selected_options and isinstance(selected_options, list)):
+            selected_options = []
+        order_cents += item_line_cents
+
+        item_stats = rollup['items'].setdefault(item.get('name', 'N/A'), {'quantity': 0, 'revenue_cents': 0, 'options': {}})
+        item_stats['quantity'] += quantity
+        item_stats['revenue_cents'] += item_line_cents
+        for option in selected_options:
+            option_name = option.get('name', '') if isinstance(option, dict) else str(option)
+            item_stats['options'][option_name] = item_stats['options'].get(option_name, 0) + quantity
+
+    hour = (timestamp or '')[11:13] or '??'
+    rollup['order_count'] += 1
+    rollup['revenue_cents'] += order_cents
+    rollup['revenue_by_hour'][hour] = rollup['revenue_by_hour'].get(hour, 0) + order_cents
+    table_stats = rollup['tables'].setdefault(str(table_number), {'orders': 0, 'revenue_cents': 0})
+    table_stats['orders'] += 1
+    table_stats['revenue_cents'] += order_cents
+
+def rollup_from_csv(date_str, loaded_keys=None):
+    # loaded_keys, if given, collects the (order_number, timestamp) of every row read
+    rollup = empty_rollup(date_str)
+    filename = order_log_path(date_str)
+    if not os.path.exists(filename):
+        return rollup
+    with open(filename, 'r', newline='', encoding='utf-8') as f_read:
+        for row in csv.DictReader(f_read):
+            if row.get('order_number', '').lower() in ['total', ''] or not row.get('items_json'):
+                continue
+            if loaded_keys is not None:
+                loaded_keys.add((str(row.get('order_number')), row.get('timestamp') or ''))
+            try:
+                items = order_item_dicts(json.loads(row['items_json']))
+                add_order_to_rollup(rollup, row.get('timestamp'), row.get('table_number', 'N/A'), items)
+            except (ValueError, TypeError, AttributeError) as e:
+                app.logger.warning(f"Stats skip order #{row.get('order_number')} in {filename}: {str(e)}")
+    return rollup
+
+class SalesStats:
+    def __init__(self, stats_dir):
+        self.stats_dir = stats_dir
+        self._lock = threading.Lock()
+        self._today = None
+        self._today_keys = set()
+        self._past = collections.OrderedDict()
+
+    def _current_rollup(self):
+        today_date_str = datetime.now().strftime("%Y-%m-%d")
+        if self._today is None or self._today['date'] != today_date_str:
+            self._today_keys = set()
+            self._today = rollup_from_csv(today_date_str, self._today_keys)
+        return self._today
+
+    def add_order(self, row, items, line_cents=None):
+        # The rollup may have been loaded from the CSV after this row was appended
+        # but before this call; each (order_number, timestamp) is only counted once.
+        date_str = (row.get('timestamp') or '')[:10]
+        key = (str(row.get('order_number')), row.get('timestamp') or '')
+        with self._lock:
+            if self._today is not None and self._today['date'] == date_str:
+                if key in self._today_keys:
+                    return
+                self._today_keys.add(key)
+                add_order_to_rollup(self._today, row.get('timestamp'), row.get('table_number', 'N/A'), items, line_cents)
+            else:
+                # Not loaded for this day yet; the row is already in the day's log.
+                self._current_rollup()
+
+    def _past_rollup(self, date_str):
+        filename = order_log_path(date_str)
+        try:
+            st = os.stat(filename)
+            source_key = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            return empty_rollup(date_str)
+
+        cached = self._past.get(date_str)
+        if cached and cached['source'] == source_key:
+            self._past.move_to_end(date_str)
+            return cached['rollup']
+
+        rollup_path = os.path.join(self.stats_dir, f"rollup_{date_str}.json")
+        rollup = None
+        try:
+            with open(rollup_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('source') == source_key:
+                rollup = saved['rollup']
+        except (OSError, json.JSONDecodeError, KeyError):
+            pass
+        if rollup is None:
+            rollup = rollup_from_csv(date_str)
+            try:
+                os.makedirs(self.stats_dir, exist_ok=True)
+                temp_path = rollup_path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'source': source_key, 'rollup': rollup}, f)
+                os.replace(temp_path, rollup_path)
+            except OSError as e:
+                app.logger.error(f"Could not cache stats rollup for {date_str}: {str(e)}")
+
+        self._past[date_str] = {'source': source_key, 'rollup': rollup}
+        while len(self._past) > STATS_MEMORY_CACHE_DAYS:
+            self._past.popitem(last=False)
+        return rollup
+
+    def daily_rollup(self, date_str):
+        with self._lock:
+            if date_str == datetime.now().strftime("%Y-%m-%d"):
+                return json.loads(json.dumps(self._current_rollup()))
+            return self._past_rollup(date_str)
+
+    def report(self, start_date, end_date, top_n=10):
+        totals = empty_rollup(None)
+        days = []
+        day = start_date
+        while day <= end_date:
+            rollup = self.daily_rollup(day.strftime("%Y-%m-%d"))
+            days.append({'date': rollup['date'], 'order_count': rollup['order_count'],
+                         'revenue': rollup['revenue_cents'] / 100})
+            totals['order_count'] += rollup['order_count']
+            totals['revenue_cents'] += rollup['revenue_cents']
+            for hour, cents in rollup['revenue_by_hour'].items():
+                totals['revenue_by_hour'][hour] = totals['revenue_by_hour'].get(hour, 0) + cents
+            for name, item_stats in rollup['items'].items():
+                merged = totals['items'].setdefault(name, {'quantity': 0, 'revenue_cents': 0, 'options': {}})
+                merged['quantity'] += item_stats['quantity']
+                merged['revenue_cents'] += item_stats['revenue_cents']
+                for option_name, count in item_stats['options'].items():
+                    merged['options'][option_name] = merged['options'].get(option_name, 0) + count
+            for table, table_stats in rollup['tables'].items():
+                merged = totals['tables'].setdefault(table, {'orders': 0, 'revenue_cents': 0})
+                merged['orders'] += table_stats['orders']
+                merged['revenue_cents'] += table_stats['revenue_cents']
+            day += timedelta(days=1)
+
+        top_items = sorted(totals['items'].items(), key=lambda entry: (-entry[1]['quantity'], entry[0]))[:top_n]
+        return {
+            'from': start_date.strftime("%Y-%m-%d"),
+            'to': end_date.strftime("%Y-%m-%d"),
+            'order_count': totals['order_count'],
+            'revenue': totals['revenue_cents'] / 100,
+            'revenue_by_hour': {hour: cents / 100 for hour, cents in sorted(totals['revenue_by_hour'].items())},
+            'top_items': [{'name': name, 'quantity': item_stats['quantity'], 'revenue': item_stats['revenue_cents'] / 100}
+                          for name, item_stats in top_items],
+            'option_attach_rates': {
+                name: {option_name: round(count / item_stats['quantity'], 4)
+                       for option_name, count in sorted(item_stats['options'].items())}
+                for name, item_stats in sorted(totals['items'].items())
+                if item_stats['options'] and item_stats['quantity'] > 0
+            },
+            'tables': {table: {'orders': table_stats['orders'], 'revenue': table_stats['revenue_cents'] / 100}
+                       for table, table_stats in sorted(totals['tables'].items())},
+            'days': days,
         }
-        existing_rows.append(new_row)
 
-        with open(filename, 'w', newline='', encoding='utf-8') as f_write:
-            writer = csv.DictWriter(f_write, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(existing_rows)
-            
+sales_stats = SalesStats(STATS_DIR)
+
+# --- Order History Search ---
+# Searches and exports read the daily CSV logs one row at a time and stream the
+# results, so memory use does not grow with the number of days covered. Each past
+# day gets a small index in ORDER_INDEX_DIR (row offsets by order number, tables and
+# item names), keyed to the CSV's size and mtime like the stats rollups. A search
+# skips days whose index can't match and seeks straight to the rows of a wanted
+# order number. Today's log is still growing, so it is always scanned.
+ORDER_INDEX_DIR = os.path.join(CSV_DIR, 'index')
+ORDER_SEARCH_DEFAULT_LIMIT = 500
+ORDER_EXPORT_CHUNK_SIZE = 64 * 1024
+
+def order_log_dates(start_date_str=None, end_date_str=None):
+    if not os.path.isdir(CSV_DIR):
+        return []
+    dates = []
+    for filename in os.listdir(CSV_DIR):
+        if filename.startswith('orders_') and filename.endswith('.csv'):
+            date_str = filename[len('orders_'):-len('.csv')]
+            if (start_date_str is None or date_str >= start_date_str) and (end_date_str is None or date_str <= end_date_str):
+                dates.append(date_str)
+    return sorted(dates)
+
+def iter_order_log_rows(filename, offsets=None):
+    # Yields (byte offset, row) for every complete order row, or only for the rows
+    # starting at the given offsets. Manual 'total' rows and torn rows are skipped.
+    with open(filename, 'rb') as f:
+        position = 0
+
+        def lines():
+            nonlocal position
+            for raw_line in f:
+                position += len(raw_line)
+                yield raw_line.decode('utf-8', errors='replace')
+
+        try:
+            header = next(csv.reader(lines()), None)
+        except csv.Error:
+            return
+        if not header:
+            return
+        starts = [None] if offsets is None else offsets
+        for start in starts:
+            if start is not None:
+                f.seek(start)
+                position = start
+            reader = csv.reader(lines())
+            while True:
+                row_offset = position
+                try:
+                    fields = next(reader, None)
+                except csv.Error:
+                    break  # unterminated last row while it is being written
+                if fields is None:
+                    break
+                if len(fields) == len(header):
+                    row = dict(zip(header, fields))
+                    if row.get('order_number') and row['order_number'].lower() != 'total':
+                        yield row_offset, row
+                if start is not None:
+                    break
+
+def order_row_items(row):
+    try:
+        items = json.loads(row.get('items_json') or '[]')
+    except json.JSONDecodeError:
+        return None
+    return items if isinstance(items, list) else None
+
+def build_order_log_index(filename):
+    rows, tables, item_names = [], set(), set()
+    for offset, row in iter_order_log_rows(filename):
+        rows.append([row['order_number'], offset])
+        tables.add(row.get('table_number', 'N/A'))
+        for item in order_row_items(row) or []:
+            if isinstance(item, dict):
+                item_names.add(str(item.get('name', '')).lower())
+    return {'rows': rows, 'tables': sorted(tables), 'item_names': sorted(item_names)}
+
+class OrderLogIndex:
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+
+    def get(self, date_str):
+        if date_str == datetime.now().strftime("%Y-%m-%d"):
+            return None
+        filename = order_log_path(date_str)
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        source_key = [st.st_size, st.st_mtime_ns]
+        index_path = os.path.join(self.index_dir, f"index_{date_str}.json")
+        with self._lock:
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get('source') == source_key:
+                    return saved['index']
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+            index = build_order_log_index(filename)
+            try:
+                os.makedirs(self.index_dir, exist_ok=True)
+                temp_path = index_path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'source': source_key, 'index': index}, f)
+                os.replace(temp_path, index_path)
+            except OSError as e:
+                app.logger.error(f"Could not save order index for {date_str}: {str(e)}")
+            return index
+
+order_log_index = OrderLogIndex(ORDER_INDEX_DIR)
+
+def search_order_log(start_date_str=None, end_date_str=None, order_number=None, table_number=None, item_name=None):
+    # Generator of matching CSV rows, oldest day first. item_name matches any part of
+    # an item's name, case-insensitively.
+    item_name = item_name.lower() if item_name else None
+    for date_str in order_log_dates(start_date_str, end_date_str):
+        offsets = None
+        index = order_log_index.get(date_str)
+        if index is not None:
+            if table_number is not None and table_number not in index['tables']:
+                continue
+            if item_name and not any(item_name in name for name in index['item_names']):
+                continue
+            if order_number is not None:
+                offsets = [offset for number, offset in index['rows'] if number == order_number]
+                if not offsets:
+                    continue
+        for _, row in iter_order_log_rows(order_log_path(date_str), offsets):
+            if order_number is not None and row['order_number'] != order_number:
+                continue
+            if table_number is not None and row.get('table_number') != table_number:
+                continue
+            if item_name and not any(isinstance(item, dict) and item_name in str(item.get('name', '')).lower()
+                                     for item in order_row_items(row) or []):
+                continue
+            yield row
+
+def build_order_row(order_data, order_timestamp, copies):
+    items_summary_str, new_order_total = summarize_order_items(order_data.get('items', []), order_data.get('line_cents'))
+    return {
+        'order_number': order_data.get('number', 'N/A'),
+        'table_number': order_data.get('tableNumber', 'N/A'),
+        'timestamp': order_timestamp,
+        'items_summary': items_summary_str,
+        'items_json': json.dumps(order_data.get('items', [])),
+        'universal_comment': order_data.get('universalComment', '').strip(),
+        'order_total': f"€{new_order_total:.2f}",
+        'printed_status': f"Queued ({copies} copies)"
+    }
+
+def record_logged_orders(rows_with_orders):
+    # Updates the reprint store, today's stats and the database for orders whose rows
+    # are already in the CSV log. The order has been taken by then, so a failure here
+    # is logged and does not fail it: each of them is rebuilt from the CSV log (the
+    # store and stats on the next day or restart, the database by import_csv_files()).
+    for new_row, order_data in rows_with_orders:
+        try:
+            order_store.add(new_row, order_data.get('items', []))
+        except Exception as e:
+            app.logger.error(f"Order store error for order #{new_row['order_number']}: {str(e)}")
+        try:
+            sales_stats.add_order(new_row, order_data.get('items', []), order_data.get('line_cents'))
+        except Exception as e:
+            app.logger.error(f"Sales stats error for order #{new_row['order_number']}: {str(e)}")
+    try:
+        order_db.insert_orders([(new_row, order_data.get('items', [])) for new_row, order_data in rows_with_orders])
+    except Exception as e:
+        app.logger.error(f"Order database error for {len(rows_with_orders)} order(s): {str(e)}")
+
+def log_order_to_csv(order_data):
+    # The row is written before any ticket is queued: if writing it fails, nothing
+    # has printed and the tablet's retry can safely process the order again.
+    try:
+        order_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tickets = plan_order_tickets(order_data, order_timestamp)
+        new_row = build_order_row(order_data, order_timestamp, len(tickets))
+        with ORDER_LOG_SECONDS.time():
+            order_journal.append(new_row, date_str=order_timestamp[:10])
+
+        # The database row goes in first so the print outcome has a row to update
+        record_logged_orders([(new_row, order_data)])
+
+        # Queue the station and customer tickets; the spooler prints them in the background
+        app.logger.info(f"Queueing receipt for order #{order_data.get('number', 'N/A')}")
+        print_jobs = print_spooler.submit_many(order_data.get('number', 'N/A'), tickets, order_timestamp)
+        order_data['print_jobs'] = [job['id'] for job in print_jobs]
         return True
     except Exception as e:
         app.logger.error(f"CSV logging error: {str(e)}")
         return False
 
+def log_orders_to_csv(orders):
+    # Batch version of log_order_to_csv. As there, all rows are written (with one
+    # fsync) before any ticket is queued, so a failed write prints nothing and the
+    # tablet's replay of the batch is safe. The print queue then gets one write for
+    # all tickets and the database one transaction for all orders.
+    try:
+        order_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tickets_per_order = [plan_order_tickets(order_data, order_timestamp) for order_data in orders]
+        new_rows = [build_order_row(order_data, order_timestamp, len(tickets))
+                    for order_data, tickets in zip(orders, tickets_per_order)]
+        with ORDER_LOG_SECONDS.time():
+            order_journal.append_many(new_rows, date_str=order_timestamp[:10])
+
+        record_logged_orders(list(zip(new_rows, orders)))
+
+        app.logger.info(f"Queueing receipts for {len(orders)} batched orders")
+        print_jobs_per_order = print_spooler.submit_orders(
+            [(order_data.get('number', 'N/A'), tickets) for order_data, tickets in zip(orders, tickets_per_order)],
+            order_timestamp)
+        for order_data, print_jobs in zip(orders, print_jobs_per_order):
+            order_data['print_jobs'] = [job['id'] for job in print_jobs]
+        return True
+    except Exception as e:
+        app.logger.error(f"CSV logging error (batch): {str(e)}")
+        return False
+
+# --- Order Number Allocator ---
+# Order numbers are handed out by the server, starting at 1 each day. Every allocation
+# is appended (and fsynced) to a small per-day log before the number is used, so the
+# counter survives a restart. Requests may carry a client key (Idempotency-Key header
+# or clientRequestId field); a retried request with the same key gets the same number
+# back instead of creating a second order.
+ORDER_NUMBER_LOG_DIR = os.path.join(CSV_DIR, 'order_numbers')
+
+class OrderNumberAllocator:
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self._date_str = None
+        self._last_number = 0
+        self._numbers_by_key = {}
+        self._in_flight = set()
+        self._log = None
+
+    def _log_path(self, date_str):
+        return os.path.join(self.log_dir, f"order_numbers_{date_str}.log")
+
+    def _load(self, date_str):
+        if self._log:
+            self._log.close()
+            self._log = None
+        self._date_str = date_str
+        self._last_number = 0
+        self._numbers_by_key = {}
+        self._in_flight = set()
+        path = self._log_path(date_str)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line
+                    self._last_number = max(self._last_number, record['number'])
+                    if record.get('key'):
+                        self._numbers_by_key[record['key']] = record['number']
+        else:
+            # First start on a day that already has orders (e.g. numbered by the tablets
+            # before this allocator existed): continue after the highest one.
+            self._last_number = order_store.max_order_number()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._log = open(path, 'a', encoding='utf-8')
+
+    def claim(self, request_key=None):
+        # Returns (number, state): 'new' for a fresh number, 'retry' for a known key
+        # whose order should be (re)processed, 'in_progress' while another request
+        # with the same key is still being handled.
+        return self.claim_many([request_key])[0]
+
+    def claim_many(self, request_keys):
+        # claim() for several requests at once; new numbers are logged with one fsync
+        today_date_str = datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            if self._date_str != today_date_str:
+                self._load(today_date_str)
+            claims = []
+            new_records = []
+            for request_key in request_keys:
+                if request_key and request_key in self._numbers_by_key:
+                    if request_key in self._in_flight:
+                        claims.append((self._numbers_by_key[request_key], 'in_progress'))
+                        continue
+                    self._in_flight.add(request_key)
+                    claims.append((self._numbers_by_key[request_key], 'retry'))
+                    continue
+                number = self._last_number + len(new_records) + 1
+                new_records.append({'number': number, 'key': request_key})
+                claims.append((number, 'new'))
+                if request_key:
+                    self._numbers_by_key[request_key] = number
+                    self._in_flight.add(request_key)
+            if new_records:
+                try:
+                    self._log.write("".join(json.dumps(record) + "\n" for record in new_records))
+                    self._log.flush()
+                    os.fsync(self._log.fileno())
+                except Exception:
+                    for record in new_records:
+                        if record['key']:
+                            self._numbers_by_key.pop(record['key'], None)
+                            self._in_flight.discard(record['key'])
+                    raise
+                self._last_number = new_records[-1]['number']
+            return claims
+
+    def release(self, request_key):
+        self.release_many([request_key])
+
+    def release_many(self, request_keys):
+        with self._lock:
+            self._in_flight.difference_update(request_keys)
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+order_number_allocator = OrderNumberAllocator(ORDER_NUMBER_LOG_DIR)
+atexit.register(order_number_allocator.close)
+
+def order_request_key(order_data):
+    key = request.headers.get('Idempotency-Key') or order_data.get('clientRequestId')
+    return str(key)[:128] if key else None
+
 @app.route('/api/orders', methods=['POST'])
 def handle_order():
-    order_data = request.json
+    order_data = parse_request_json()
     if not order_data or 'items' not in order_data:
         return jsonify({"status": "error", "message": "Invalid order data"}), 400
     try:
-        if 'number' not in order_data: 
-            order_data['number'] = int(datetime.now().timestamp() % 10000) 
+        price_order(order_data, menu_cache.get().index)
+    except ValueError as e:
+        ORDERS_TOTAL.inc(1, 'rejected')
+        return jsonify({"status": "error", "message": str(e)}), 400
+    request_key = order_request_key(order_data)
+    try:
+        # The number is always assigned here; numbers kept by the tablets are ignored.
+        order_number, claim_state = order_number_allocator.claim(request_key)
+        if claim_state == 'in_progress':
+            return jsonify({"status": "error", "order_number": order_number,
+                            "message": f"Order #{order_number} is still being processed, retry shortly."}), 409
+        if claim_state == 'retry' and (order_store.get(order_number) or print_spooler.jobs_for_order(order_number)):
+            order_number_allocator.release(request_key)
+            app.logger.info(f"Duplicate submission of order #{order_number} ignored (key {request_key})")
+            ORDERS_TOTAL.inc(1, 'duplicate')
+            return jsonify({"status": "success", "order_number": order_number, "duplicate": True,
+                            "print_jobs": [job['id'] for job in print_spooler.jobs_for_order(order_number)]})
+        order_data['number'] = order_number
         
-        success = log_order_to_csv(order_data)
+        try:
+            with ORDER_SECONDS.time('single'):
+                success = log_order_to_csv(order_data)
+        finally:
+            order_number_allocator.release(request_key)
+        ORDERS_TOTAL.inc(1, 'logged' if success else 'failed')
         
         if success:
-            return jsonify({"status": "success", "order_number": order_data['number']})
+            event_broker.publish('order', {
+                'order_number': str(order_data['number']),
+                'table_number': str(order_data.get('tableNumber', 'N/A')),
+                'print_jobs': order_data.get('print_jobs', []),
+            })
+            return jsonify({"status": "success", "order_number": order_data['number'],
+                            "print_jobs": order_data.get('print_jobs', [])})
         else: 
             return jsonify({"status": "error", "message": "Failed to process order (log/print)"}), 500
     except Exception as e: 
         app.logger.error(f"Error in handle_order: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Orders queued on a tablet while the network was down are replayed through here in
+# one request. Each order is validated and deduplicated on its own (by clientRequestId),
+# and its result says whether the tablet should drop it ('rejected': invalid, it will
+# never be accepted) or send it again ('retry': not logged yet). Numbering, the CSV log, the print queue and the database each get a single write
+# for the whole batch: three fsyncs and one SQLite commit, however many orders it has.
+ORDER_BATCH_MAX_SIZE = 200
+
+@app.route('/api/orders/batch', methods=['POST'])
+def handle_order_batch():
+    batch_data = parse_request_json()
+    orders = batch_data.get('orders') if isinstance(batch_data, dict) else batch_data
+    if not isinstance(orders, list) or not orders:
+        return jsonify({"status": "error", "message": "Expected a non-empty list of orders"}), 400
+    if len(orders) > ORDER_BATCH_MAX_SIZE:
+        return jsonify({"status": "error", "message": f"At most {ORDER_BATCH_MAX_SIZE} orders per batch"}), 400
+
+    try:
+        menu_index = menu_cache.get().index
+    except Exception as e:
+        app.logger.error(f"Menu unavailable for order batch: {str(e)}")
+        return jsonify({"status": "error", "message": "Menu unavailable"}), 500
+
+    results = [None] * len(orders)
+    to_claim = []
+    first_index_by_key = {}
+    for index, order_data in enumerate(orders):
+        if not isinstance(order_data, dict) or not isinstance(order_data.get('items'), list):
+            results[index] = {"status": "error", "rejected": True, "message": "Invalid order data"}
+            continue
+        try:
+            price_order(order_data, menu_index)
+        except ValueError as e:
+            ORDERS_TOTAL.inc(1, 'rejected')
+            results[index] = {"status": "error", "rejected": True, "message": str(e)}
+            continue
+        key = order_data.get('clientRequestId')
+        request_key = str(key)[:128] if key else None
+        if request_key in first_index_by_key:
+            results[index] = {"status": "duplicate_of", "index": first_index_by_key[request_key]}
+            continue
+        if request_key:
+            first_index_by_key[request_key] = index
+        to_claim.append((index, request_key))
+
+    claimed_keys = []
+    try:
+        claims = order_number_allocator.claim_many([request_key for _, request_key in to_claim])
+        claimed_keys = [request_key for (_, request_key), (_, claim_state) in zip(to_claim, claims)
+                        if request_key and claim_state != 'in_progress']
+        to_log = []
+        for (index, request_key), (order_number, claim_state) in zip(to_claim, claims):
+            if claim_state == 'in_progress':
+                results[index] = {"status": "error", "order_number": order_number, "retry": True,
+                                  "message": f"Order #{order_number} is still being processed, retry shortly."}
+                continue
+            if claim_state == 'retry' and (order_store.get(order_number) or print_spooler.jobs_for_order(order_number)):
+                results[index] = {"status": "success", "order_number": order_number, "duplicate": True,
+                                  "print_jobs": [job['id'] for job in print_spooler.jobs_for_order(order_number)]}
+                continue
+            orders[index]['number'] = order_number
+            to_log.append(index)
+
+        if to_log:
+            with ORDER_SECONDS.time('batch'):
+                success = log_orders_to_csv([orders[index] for index in to_log])
+            ORDERS_TOTAL.inc(len(to_log), 'logged' if success else 'failed')
+        if to_log and not success:
+            for index in to_log:
+                results[index] = {"status": "error", "order_number": orders[index]['number'], "retry": True,
+                                  "message": "Failed to process order (log/print)"}
+            to_log = []
+        for index in to_log:
+            order_data = orders[index]
+            event_broker.publish('order', {
+                'order_number': str(order_data['number']),
+                'table_number': str(order_data.get('tableNumber', 'N/A')),
+                'print_jobs': order_data.get('print_jobs', []),
+            })
+            results[index] = {"status": "success", "order_number": order_data['number'],
+                              "print_jobs": order_data.get('print_jobs', [])}
+    except Exception as e:
+        app.logger.error(f"Error in handle_order_batch: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        order_number_allocator.release_many(claimed_keys)
+
+    for index, result in enumerate(results):
+        if result['status'] == 'duplicate_of':
+            first_result = results[result['index']]
+            results[index] = dict(first_result, duplicate=True) if first_result['status'] == 'success' else first_result
+        results[index] = dict(results[index], index=index)
+    app.logger.info(f"Order batch: {sum(1 for result in results if result['status'] == 'success')}/{len(results)} accepted")
+    return jsonify({"status": "success", "results": results})
+
 # --- NEW ENDPOINTS FOR REPRINT FUNCTIONALITY ---
 
 @app.route('/api/todays_orders_for_reprint', methods=['GET'])
 def get_todays_orders_for_reprint():
     try:
-        today_date_str = datetime.now().strftime("%Y-%m-%d")
-        filename = os.path.join(CSV_DIR, f"orders_{today_date_str}.csv")
-        
-        if not os.path.exists(filename):
-            return jsonify([])
-
-        orders_for_reprint = []
-        with open(filename, 'r', newline='', encoding='utf-8') as f_read:
-            reader = csv.DictReader(f_read)
-            for row in reader:
-                if row.get('order_number', '').lower() not in ['total', ''] and row.get('items_json'): 
-                    orders_for_reprint.append({
-                        'order_number': row.get('order_number'),
-                        'table_number': row.get('table_number', 'N/A'),
-                        'timestamp': row.get('timestamp')
-                    })
-        orders_for_reprint.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        return jsonify(orders_for_reprint)
+        return jsonify(order_store.reprint_list())
 
     except Exception as e:
         app.logger.error(f"Error fetching today's orders for reprint: {str(e)}")
@@ -422,76 +3234,322 @@ def get_todays_orders_for_reprint():
 
 @app.route('/api/reprint_order', methods=['POST'])
 def reprint_order_endpoint():
-    data = request.json
+    data = parse_request_json()
     order_number_to_reprint = data.get('order_number')
 
     if not order_number_to_reprint:
         return jsonify({"status": "error", "message": "Order number is required for reprint."}), 400
 
     try:
-        today_date_str = datetime.now().strftime("%Y-%m-%d")
-        filename = os.path.join(CSV_DIR, f"orders_{today_date_str}.csv")
-
-        if not os.path.exists(filename):
-            return jsonify({"status": "error", "message": f"No orders found for today."}), 404
-
-        found_order_row = None
-        with open(filename, 'r', newline='', encoding='utf-8') as f_read:
-            reader = csv.DictReader(f_read)
-            for row in reader:
-                if row.get('order_number') == str(order_number_to_reprint):
-                    found_order_row = row
-                    break
+        found_order = order_store.get(order_number_to_reprint)
         
-        if not found_order_row:
+        if not found_order:
             return jsonify({"status": "error", "message": f"Order #{order_number_to_reprint} not found in today's records."}), 404
 
-        items_list_str = found_order_row.get('items_json', '[]')
-        items_list = json.loads(items_list_str)
+        if found_order['items'] is None:
+            app.logger.error(f"Error decoding item data for order #{order_number_to_reprint} during reprint.")
+            return jsonify({"status": "error", "message": f"Corrupted item data for order #{order_number_to_reprint}. Cannot reprint."}), 500
         
         reprint_order_data = {
-            'number': found_order_row.get('order_number'),
-            'tableNumber': found_order_row.get('table_number', 'N/A'),
-            'items': items_list,
-            'universalComment': found_order_row.get('universal_comment', '')
+            'number': found_order['order_number'],
+            'tableNumber': found_order['table_number'],
+            'items': found_order['items'],
+            'universalComment': found_order['universal_comment']
         }
-        original_timestamp = found_order_row.get('timestamp')
+        original_timestamp = found_order['timestamp']
 
         app.logger.info(f"Attempting to reprint order #{order_number_to_reprint}")
 
-        # Reprint the receipt twice, with a simple "Reprint" header
-        reprint_success1 = print_kitchen_ticket(reprint_order_data, 
-                                               copy_info="Reprint", 
+        # Queue the reprint twice, with a simple "Reprint" header
+        reprint_ticket = render_kitchen_ticket(reprint_order_data, copy_info="Reprint",
                                                original_timestamp_str=original_timestamp)
-        time.sleep(1) # Small delay for the printer
-        reprint_success2 = print_kitchen_ticket(reprint_order_data, 
-                                               copy_info="Reprint", 
-                                               original_timestamp_str=original_timestamp)
-        
-        reprint_success = reprint_success1 and reprint_success2
-        
-        if reprint_success:
-            return jsonify({"status": "success", "message": f"Order #{order_number_to_reprint} REPRINTED successfully (2 copies)."}), 200
-        else:
-            return jsonify({"status": "error", "message": f"Failed to reprint Order #{order_number_to_reprint}. Check printer."}), 500
+        reprint_jobs = print_spooler.submit_many(order_number_to_reprint, [("Reprint", reprint_ticket, None)] * 2)
+        return jsonify({"status": "success",
+                        "message": f"Order #{order_number_to_reprint} queued for reprint (2 copies).",
+                        "print_jobs": [job['id'] for job in reprint_jobs]}), 200
 
-    except json.JSONDecodeError:
-        app.logger.error(f"Error decoding item data for order #{order_number_to_reprint} during reprint.")
-        return jsonify({"status": "error", "message": f"Corrupted item data for order #{order_number_to_reprint}. Cannot reprint."}), 500
     except Exception as e:
         app.logger.error(f"Error reprinting order #{order_number_to_reprint}: {str(e)}")
         return jsonify({"status": "error", "message": f"Could not reprint order #{order_number_to_reprint}: {str(e)}"}), 500
 
 
-if __name__ == '__main__':
+# --- Ticket Preview Endpoint ---
+
+def find_logged_order(order_number, date_str=None):
+    # Today's orders come from the order store, older ones from the daily logs
+    if not date_str or date_str == datetime.now().strftime("%Y-%m-%d"):
+        order = order_store.get(order_number)
+        if not order:
+            return None
+        return {
+            'number': order['order_number'],
+            'tableNumber': order['table_number'],
+            'items': order['items'],
+            'universalComment': order['universal_comment'],
+        }, order['timestamp']
+    for row in search_order_log(date_str, date_str, order_number=str(order_number)):
+        return {
+            'number': row['order_number'],
+            'tableNumber': row.get('table_number', 'N/A'),
+            'items': order_row_items(row),
+            'universalComment': row.get('universal_comment', ''),
+        }, row.get('timestamp')
+    return None
+
+@app.route('/api/orders/<order_number>/preview', methods=['GET'])
+def preview_order_ticket(order_number):
+    # ?format=text|html|png, ?copy=Kitchen (header line), ?date=YYYY-MM-DD for older orders
+    preview_format = request.args.get('format', 'html')
+    copy_info = request.args.get('copy', 'Kitchen')
+    if preview_format not in PREVIEW_RENDERERS:
+        return jsonify({"status": "error", "message": f"format must be one of: {', '.join(PREVIEW_RENDERERS)}"}), 400
+    if preview_format == 'png' and Image is None:
+        return jsonify({"status": "error", "message": "PNG previews need Pillow on the server (pip install Pillow)."}), 501
     try:
-        import win32print
-    except ImportError:
-        app.logger.error("pywin32 not found. Please ensure it is installed (pip install pywin32).")
+        found = find_logged_order(order_number, request.args.get('date'))
+        if not found:
+            return jsonify({"status": "error", "message": f"Order #{order_number} not found."}), 404
+        order_data, original_timestamp = found
+        if order_data['items'] is None:
+            return jsonify({"status": "error", "message": f"Corrupted item data for order #{order_number}."}), 500
+        ticket_data = render_kitchen_ticket(order_data, copy_info=copy_info, original_timestamp_str=original_timestamp)
+        body, mimetype = render_ticket_preview(ticket_data, preview_format, title=f"Order #{order_number} - {copy_info}")
+        return Response(body, mimetype=mimetype)
+    except Exception as e:
+        app.logger.error(f"Error previewing order #{order_number}: {str(e)}")
+        return jsonify({"status": "error", "message": f"Could not preview order #{order_number}: {str(e)}"}), 500
+
+# --- Print Job Status Endpoints ---
+
+@app.route('/api/print_jobs', methods=['GET'])
+def get_print_jobs():
+    order_number = request.args.get('order_number')
+    if not order_number:
+        return jsonify({"status": "error", "message": "order_number is required."}), 400
+    return jsonify(print_spooler.jobs_for_order(order_number))
+
+@app.route('/api/print_jobs/<job_id>', methods=['GET'])
+def get_print_job(job_id):
+    job = print_spooler.get_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": f"Print job {job_id} not found."}), 404
+    return jsonify(job)
+
+
+@app.route('/api/printers', methods=['GET'])
+def get_printers():
+    return jsonify(printer_health.snapshot())
+
+# --- Sales Statistics Endpoint ---
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    today_date_str = datetime.now().strftime("%Y-%m-%d")
+    try:
+        start_date = datetime.strptime(request.args.get('from', today_date_str), "%Y-%m-%d")
+        end_date = datetime.strptime(request.args.get('to', request.args.get('from', today_date_str)), "%Y-%m-%d")
+        top_n = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Dates must be YYYY-MM-DD and top must be a number."}), 400
+    if end_date < start_date:
+        return jsonify({"status": "error", "message": "'to' must not be before 'from'."}), 400
+    if (end_date - start_date).days >= STATS_MAX_RANGE_DAYS:
+        return jsonify({"status": "error", "message": f"Date range is limited to {STATS_MAX_RANGE_DAYS} days."}), 400
+    try:
+        return jsonify(sales_stats.report(start_date, end_date, top_n=top_n))
+    except Exception as e:
+        app.logger.error(f"Error building sales stats: {str(e)}")
+        return jsonify({"status": "error", "message": f"Could not build stats: {str(e)}"}), 500
+
+# --- Order History Search Endpoints ---
+
+def order_search_filters():
+    # Raises ValueError for malformed parameters
+    filters = {
+        'start_date_str': request.args.get('from') or None,
+        'end_date_str': request.args.get('to') or None,
+        'order_number': request.args.get('order_number') or None,
+        'table_number': request.args.get('table') or None,
+        'item_name': request.args.get('item') or None,
+    }
+    for key in ('start_date_str', 'end_date_str'):
+        if filters[key]:
+            datetime.strptime(filters[key], "%Y-%m-%d")
+    return filters
+
+@app.route('/api/orders/search', methods=['GET'])
+def search_orders():
+    try:
+        filters = order_search_filters()
+        limit = int(request.args.get('limit', ORDER_SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Dates must be YYYY-MM-DD and limit must be a number."}), 400
+
+    def generate():
+        yield '{"orders": ['
+        count = 0
+        try:
+            for row in search_order_log(**filters):
+                if count >= limit:
+                    break
+                yield (',' if count else '') + json.dumps({
+                    'order_number': row['order_number'],
+                    'table_number': row.get('table_number', 'N/A'),
+                    'timestamp': row.get('timestamp', ''),
+                    'items_summary': row.get('items_summary', ''),
+                    'universal_comment': row.get('universal_comment', ''),
+                    'order_total': row.get('order_total', ''),
+                    'printed_status': row.get('printed_status', ''),
+                    'items': order_row_items(row),
+                })
+                count += 1
+        except Exception as e:
+            # Headers are already sent; the client sees the truncated result and the log says why.
+            app.logger.error(f"Error during order search: {str(e)}")
+        yield f'], "count": {count}}}'
+
+    return Response(generate(), mimetype='application/json')
+
+@app.route('/api/orders/export', methods=['GET'])
+def export_orders():
+    try:
+        filters = order_search_filters()
+    except ValueError:
+        return jsonify({"status": "error", "message": "Dates must be YYYY-MM-DD."}), 400
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDNAMES, extrasaction='ignore')
+        writer.writeheader()
+        try:
+            for row in search_order_log(**filters):
+                writer.writerow(row)
+                if buffer.tell() >= ORDER_EXPORT_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        except Exception as e:
+            app.logger.error(f"Error during order export: {str(e)}")
+        yield buffer.getvalue()
+
+    export_name = f"orders_{filters['start_date_str'] or 'all'}_{filters['end_date_str'] or 'latest'}.csv"
+    response = Response(generate(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_name}"'
+    return response
+
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    client_queue = event_broker.subscribe(int(last_event_id) if last_event_id.isdigit() else None)
+    if client_queue is None:
+        return Response(f"retry: {EVENT_RETRY_SECONDS * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(EVENT_RETRY_SECONDS), 'Cache-Control': 'no-cache'})
+    return Response(event_broker.stream(client_queue), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# --- Metrics Endpoints ---
+
+register_metric(Gauge('kp_print_jobs_pending', 'Print jobs queued or printing.', lambda: print_spooler.pending_count()))
+register_metric(Gauge('kp_event_clients', 'Connected /api/events streams.', lambda: event_broker.client_count()))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiler', methods=['GET'])
+def get_profile():
+    samples, collapsed_stacks = profiler.report()
+    response = Response(collapsed_stacks, mimetype='text/plain')
+    response.headers['X-Profiler-Running'] = 'true' if profiler.running else 'false'
+    response.headers['X-Profiler-Samples'] = str(samples)
+    return response
+
+@app.route('/api/profiler', methods=['POST'])
+def control_profiler():
+    data = parse_request_json() or {}
+    action = data.get('action')
+    if action == 'start':
+        interval = data.get('interval')
+        if interval is not None and not (isinstance(interval, (int, float)) and PROFILER_MIN_INTERVAL <= interval <= 1):
+            return jsonify({"status": "error", "message": f"interval must be between {PROFILER_MIN_INTERVAL} and 1 seconds"}), 400
+        started = profiler.start(interval)
+        app.logger.info(f"Sampling profiler {'started' if started else 'already running'} ({profiler.interval}s interval)")
+    elif action == 'stop':
+        profiler.stop()
+        app.logger.info("Sampling profiler stopped")
+    else:
+        return jsonify({"status": "error", "message": "action must be 'start' or 'stop'"}), 400
+    samples, _ = profiler.report()
+    return jsonify({"status": "success", "running": profiler.running, "interval": profiler.interval, "samples": samples})
+
+# --- Serving ---
+
+def start_background_services():
+    # Resume unfinished print jobs, warm the order store, today's stats and the
+    # compressed frontend, and pick up any CSV rows that are not in the order database yet.
+    print_spooler.start()
+    printer_health.start()
+    index_asset.get()
+    order_store.reprint_list()
+    sales_stats.daily_rollup(datetime.now().strftime("%Y-%m-%d"))
+    try:
+        imported = order_db.import_csv_files()
+        if imported:
+            app.logger.info(f"Imported {imported} order(s) from CSV into {ORDER_DB_FILE}")
+    except Exception as e:
+        # The database is a copy of the CSV logs; serving orders does not depend on it
+        app.logger.error(f"CSV import into the order database failed: {str(e)}")
+
+def serve():
+    if win32print is None and PRINTER_NAME not in PRINTER_BACKENDS:
+        app.logger.warning("pywin32 not found; tickets for the default printer will be written to a file. "
+                           "Install pywin32 or add the printer to printer_backends in config.json.")
     
     app.logger.info(f"CSV files will be saved to: {CSV_DIR}")
     if PRINTER_NAME: 
         app.logger.info(f"Attempting to use printer: {PRINTER_NAME}")
     else:
         app.logger.warning("Warning: PRINTER_NAME is not set. Printing will likely fail.")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+
+    if CONFIG['server'] == 'dev':
+        # With the debug reloader the server runs in a child process; only that one
+        # should start the background services.
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_services()
+        app.run(host=CONFIG['host'], port=CONFIG['port'], debug=True)
+        return
+
+    start_background_services()
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        app.logger.warning("waitress is not installed (pip install waitress); "
+                           "falling back to the threaded Flask server without debug mode.")
+        app.run(host=CONFIG['host'], port=CONFIG['port'], debug=False, threaded=True, use_reloader=False)
+        return
+    app.logger.info(f"Serving on http://{CONFIG['host']}:{CONFIG['port']} with {CONFIG['threads']} threads")
+    waitress_serve(app, host=CONFIG['host'], port=CONFIG['port'], threads=CONFIG['threads'])
+
+
+if __name__ == '__main__':
+    # Maintenance commands:
+    #   python app.py import-csv                     load data/orders_*.csv into orders.db
+    #   python app.py export-csv YYYY-MM-DD [path]   write one day from orders.db as CSV
+    #   python app.py preview ORDER [YYYY-MM-DD]     show an order's ticket as text
+    if len(sys.argv) > 1 and sys.argv[1] == 'import-csv':
+        print(f"Imported {order_db.import_csv_files()} order(s) into {ORDER_DB_FILE}")
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == 'export-csv':
+        export_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(CSV_DIR, f"export_{sys.argv[2]}.csv")
+        print(f"Exported {order_db.export_csv(sys.argv[2], export_path)} order(s) to {export_path}")
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == 'preview':
+        found = find_logged_order(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        if not found or found[0]['items'] is None:
+            print(f"Order #{sys.argv[2]} not found")
+            sys.exit(1)
+        ticket_data = render_kitchen_ticket(found[0], copy_info="Kitchen", original_timestamp_str=found[1])
+        print(render_ticket_preview(ticket_data, 'text')[0], end="")
+        sys.exit(0)
+    serve()
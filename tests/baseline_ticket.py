@@ -0,0 +1,232 @@
+# The ticket renderer as it was before rendering was split from printing (baseline
+# commit), with the printer calls removed. test_ticket_renderer.py checks that the
+# current renderer still produces exactly these bytes.
+from datetime import datetime
+
+ESC = b'\x1B'
+GS = b'\x1D'
+
+InitializePrinter = ESC + b'@'
+BoldOn = ESC + b'E\x01'
+BoldOff = ESC + b'E\x00'
+DoubleHeightWidth = GS + b'!\x11'  # Double Height and Double Width
+DoubleHeight = GS + b'!\x01'       # Double Height only
+DoubleWidth = GS + b'!\x10'        # Double Width only
+NormalText = GS + b'!\x00'
+AlignLeft = ESC + b'a\x00'
+AlignCenter = ESC + b'a\x01'
+AlignRight = ESC + b'a\x02'
+SelectFontA = ESC + b'M\x00' # Standard Font A
+SelectFontB = ESC + b'M\x01' # Smaller Font B
+FullCut = GS + b'V\x00'
+
+
+def to_bytes(s, encoding='cp437'):
+    if isinstance(s, bytes):
+        return s
+    return s.encode(encoding, errors='replace')
+
+# --- Word Wrap Helper Function (Updated to match app DUMMY.py for better wrapping) ---
+def word_wrap_text(text, max_width, initial_indent="", subsequent_indent=""):
+    lines = []
+    if not text: return lines
+    
+    paragraphs = text.split('\n')
+    
+    for i, paragraph_text in enumerate(paragraphs):
+        if not paragraph_text.strip() and i < len(paragraphs) -1 : 
+            lines.append(initial_indent if not lines else subsequent_indent) 
+            continue
+
+        current_line = []
+        current_length = 0
+        words = paragraph_text.split(' ')
+        
+        current_indent = initial_indent if not lines and not any(lines) else subsequent_indent
+        
+        for word_idx, word in enumerate(words):
+            if not word: 
+                if current_line: current_line.append("") 
+                continue
+
+            available_width_for_word = max_width - len(current_indent) - current_length - (1 if current_line else 0)
+            if len(word) > available_width_for_word and not current_line : 
+                part_fits = word[:available_width_for_word]
+                remaining_part = word[available_width_for_word:]
+                lines.append(current_indent + part_fits)
+                
+                while remaining_part:
+                    available_width_for_remaining = max_width - len(subsequent_indent)
+                    part_fits = remaining_part[:available_width_for_remaining]
+                    remaining_part = remaining_part[available_width_for_remaining:]
+                    lines.append(subsequent_indent + part_fits)
+                current_line = []
+                current_length = 0
+                current_indent = subsequent_indent 
+                continue
+
+            if current_length + len(word) + (1 if current_line else 0) <= (max_width - len(current_indent)):
+                current_line.append(word)
+                current_length += len(word) + (1 if len(current_line) > 1 else 0) 
+            else:
+                if current_line: 
+                    lines.append(current_indent + " ".join(current_line))
+                
+                current_line = [word]
+                current_length = len(word)
+                current_indent = subsequent_indent 
+        
+        if current_line: 
+            lines.append(current_indent + " ".join(current_line))
+            
+    return lines if lines else [initial_indent]
+
+
+def render_baseline_ticket(order_data, copy_info="", original_timestamp_str=None):
+    ticket_content = bytearray()
+    ticket_content += InitializePrinter
+    
+    NORMAL_FONT_LINE_WIDTH = 42
+    SMALL_FONT_LINE_WIDTH = 56 
+
+    # --- Header Section (As per app DUMMY.py) ---
+    ticket_content += AlignCenter + SelectFontA + DoubleHeightWidth + BoldOn
+    restaurant_name = "To Sushaki" 
+    ticket_content += to_bytes(restaurant_name + "\n")
+    ticket_content += BoldOff 
+    
+    ticket_content += AlignCenter + SelectFontA + NormalText
+    header_text = "Kitchen Order"
+    if copy_info:
+         header_text += f" - {copy_info.upper()}"
+    ticket_content += to_bytes(header_text + "\n")
+    
+    ticket_content += AlignLeft 
+    
+    ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
+    order_num_text = f"Order #: {order_data.get('number', 'N/A')}"
+    ticket_content += to_bytes(order_num_text + "\n")
+    ticket_content += BoldOff
+
+    ticket_content += SelectFontA + NormalText
+    time_to_display = original_timestamp_str if original_timestamp_str else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ticket_content += to_bytes(f"Time: {time_to_display}\n")
+    
+    ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n")
+    
+    # --- Items Section (Logic from app DUMMY.py) ---
+    grand_total = 0.0
+    for item_idx, item in enumerate(order_data.get('items', [])):
+        item_quantity = item.get('quantity', 0)
+        item_name_orig = item.get('name', 'Unknown Item')
+        item_price_unit = float(item.get('price', 0.0))
+        
+        selected_options = item.get('selectedOptions', [])
+        total_options_price = 0.0
+        if selected_options and isinstance(selected_options, list):
+            for option in selected_options:
+                total_options_price += float(option.get('price', 0.0))
+
+        line_total = item_quantity * (item_price_unit + total_options_price)
+        grand_total += line_total
+
+        left_side = f"{item_quantity}x {item_name_orig}"
+        right_side = f"EUR {line_total:.2f}"
+
+        large_text_width = len(left_side) * 2
+        normal_text_width = len(right_side)
+        
+        # Smartly print large item name and normal price on the same line if it fits
+        if large_text_width + normal_text_width < NORMAL_FONT_LINE_WIDTH:
+            ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
+            ticket_content += to_bytes(left_side)
+            
+            ticket_content += NormalText + BoldOff
+            
+            padding_size = NORMAL_FONT_LINE_WIDTH - large_text_width - normal_text_width
+            padding = " " * padding_size
+            ticket_content += to_bytes(padding)
+            
+            ticket_content += to_bytes(right_side + "\n")
+        else:
+            # Handle multi-line items if they don't fit
+            ticket_content += SelectFontA + DoubleHeightWidth + BoldOn
+            DOUBLE_WIDTH_LINE_CHARS = NORMAL_FONT_LINE_WIDTH // 2
+            wrapped_name_lines = word_wrap_text(left_side, DOUBLE_WIDTH_LINE_CHARS)
+            
+            for line in wrapped_name_lines[:-1]:
+                ticket_content += to_bytes(line + "\n")
+            
+            last_line = wrapped_name_lines[-1]
+            last_line_width = len(last_line) * 2
+            
+            available_space = NORMAL_FONT_LINE_WIDTH - last_line_width
+            padding = " " * max(0, available_space - normal_text_width)
+            
+            ticket_content += to_bytes(last_line)
+            
+            ticket_content += NormalText + BoldOff + to_bytes(padding + right_side + "\n")
+            ticket_content += AlignLeft
+
+        ticket_content += NormalText + BoldOff 
+
+        # Print selected options (indented)
+        if selected_options and isinstance(selected_options, list):
+            for option in selected_options:
+                option_name = option.get('name', 'N/A')
+                option_price = float(option.get('price', 0.0))
+                price_change_str = ""
+                if option_price != 0:
+                    price_change_str = f" ({'+' if option_price > 0 else ''}EUR {option_price:.2f})"
+                
+                option_line = f"  -> {option_name}{price_change_str}"
+                wrapped_option_lines = word_wrap_text(option_line, NORMAL_FONT_LINE_WIDTH, initial_indent="  ", subsequent_indent="    ") 
+                for opt_line_part in wrapped_option_lines:
+                    ticket_content += to_bytes(opt_line_part + "\n")
+
+        # Print item comment (indented)
+        item_comment = item.get('comment', '').strip()
+        if item_comment:
+            ticket_content += BoldOn
+            wrapped_comments = word_wrap_text(f"Note: {item_comment}", NORMAL_FONT_LINE_WIDTH, initial_indent="    ", subsequent_indent="    ")
+            for comment_line in wrapped_comments:
+                 ticket_content += to_bytes(comment_line + "\n")
+            ticket_content += BoldOff                  
+        
+        # Add a separator between items
+        if item_idx < len(order_data.get('items', [])) - 1:
+            ticket_content += to_bytes("." * NORMAL_FONT_LINE_WIDTH + "\n")
+
+    # --- Footer Section (As per app DUMMY.py) ---
+    ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n")
+    ticket_content += SelectFontA + DoubleHeightWidth + BoldOn + AlignRight
+    total_string = f"TOTAL: EUR {grand_total:.2f}"
+    ticket_content += to_bytes(total_string + "\n")
+    ticket_content += BoldOff + AlignLeft
+    
+    ticket_content += SelectFontA + NormalText
+    ticket_content += to_bytes("-" * NORMAL_FONT_LINE_WIDTH + "\n\n") 
+    
+    universal_comment = order_data.get('universalComment', '').strip()
+    if universal_comment:
+        ticket_content += SelectFontA + NormalText + BoldOn 
+        ticket_content += to_bytes("ORDER NOTES:\n") + BoldOff 
+        ticket_content += SelectFontA + NormalText 
+        wrapped_universal_comment_lines = word_wrap_text(universal_comment, NORMAL_FONT_LINE_WIDTH, initial_indent="", subsequent_indent="") 
+        for line in wrapped_universal_comment_lines:
+            ticket_content += to_bytes(line + "\n")
+        ticket_content += to_bytes("\n")
+    
+    ticket_content += to_bytes("\n")
+    ticket_content += AlignCenter + SelectFontB
+    disclaimer_text = "This is not a legal receipt and is for informational purposes only."
+    wrapped_disclaimer_lines = word_wrap_text(disclaimer_text, SMALL_FONT_LINE_WIDTH)
+    for line in wrapped_disclaimer_lines:
+        ticket_content += to_bytes(line + "\n")
+
+    ticket_content += SelectFontA + AlignLeft
+        
+    ticket_content += to_bytes("\n\n\n\n") 
+    ticket_content += FullCut
+
+    return bytes(ticket_content)
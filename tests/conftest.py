@@ -0,0 +1,68 @@
+# Test setup: app.py reads its settings at import, so point it at a scratch data
+# directory with a copy of the menu and an in-memory printer before importing it.
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='kp-tests-')
+shutil.copy(os.path.join(ROOT_DIR, 'data', 'menu.json'), DATA_DIR)
+
+os.environ['KP_CONFIG'] = os.path.join(DATA_DIR, 'config.json')
+os.environ['KP_DATA_DIR'] = DATA_DIR
+os.environ['KP_PRINTER_NAME'] = 'Test Printer'
+os.environ['KP_PRINTER_BACKENDS'] = json.dumps({'Test Printer': {'type': 'memory'}})
+sys.path.insert(0, ROOT_DIR)
+
+import app as kp  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "benchmark: timing benchmark, only run with KP_BENCHMARK=1")
+
+
+def pytest_collection_modifyitems(config, items):
+    # Wall-clock asserts flake on a busy machine, so benchmarks are opt-in
+    if os.environ.get('KP_BENCHMARK'):
+        return
+    skip_benchmark = pytest.mark.skip(reason="benchmark; set KP_BENCHMARK=1 to run it")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+@pytest.fixture
+def client():
+    return kp.app.test_client()
+
+
+@pytest.fixture
+def log_dir(tmp_path, monkeypatch):
+    # A private directory for order log tests, so they don't see each other's files
+    monkeypatch.setattr(kp, 'CSV_DIR', str(tmp_path))
+    monkeypatch.setattr(kp, 'ORDER_QUARANTINE_DIR', str(tmp_path / 'quarantine'))
+    return tmp_path
+
+
+def menu_items():
+    return [item for items in kp.menu_cache.get().data.values() for item in items]
+
+
+def make_order(index, **extra):
+    # A valid order built from the real menu; index picks the items
+    items = menu_items()
+    order = {
+        'tableNumber': str(index % 20 + 1),
+        'universalComment': 'No wasabi' if index % 7 == 0 else '',
+        'items': [
+            {'id': item['id'], 'name': item['name'], 'price': item['price'], 'quantity': index % 3 + 1,
+             'comment': 'extra spicy' if index % 5 == 0 else ''}
+            for item in (items[index % len(items)], items[(index * 7 + 3) % len(items)])
+        ],
+    }
+    order.update(extra)
+    return order
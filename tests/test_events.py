@@ -0,0 +1,51 @@
+import socket
+import threading
+import time
+
+import pytest
+from waitress.server import create_server
+
+from conftest import kp
+
+
+def test_stream_is_refused_with_retry_when_full(client, monkeypatch):
+    monkeypatch.setattr(kp.event_broker, 'max_clients', kp.event_broker.client_count())
+    response = client.get('/api/events')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(kp.EVENT_RETRY_SECONDS)
+    assert response.get_data(as_text=True).startswith('retry: ')
+
+
+def test_event_streams_leave_threads_for_requests(monkeypatch):
+    # With 4 worker threads and room for 2 streams, 4 open streams must not stop a
+    # normal request from being served
+    clients_before = kp.event_broker.client_count()
+    monkeypatch.setattr(kp.event_broker, 'max_clients', clients_before + 2)
+    monkeypatch.setattr(kp, 'EVENT_KEEPALIVE_SECONDS', 0.05)
+    server = create_server(kp.app, host='127.0.0.1', port=0, threads=4)
+    threading.Thread(target=server.run, daemon=True).start()
+    port = server.socket.getsockname()[1]
+    streams = []
+    try:
+        statuses = []
+        for _ in range(4):
+            stream = socket.create_connection(('127.0.0.1', port), timeout=5)
+            stream.sendall(b"GET /api/events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            statuses.append(stream.recv(64).split(b" ")[1])
+            streams.append(stream)
+        assert sorted(statuses) == [b'200', b'200', b'503', b'503']
+
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as menu:
+            menu.sendall(b"GET /api/menu HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            try:
+                assert menu.recv(64).startswith(b"HTTP/1.1 200")
+            except socket.timeout:
+                pytest.fail("/api/menu was not served while event streams were open")
+    finally:
+        for stream in streams:
+            stream.close()
+        # Streams end at their next keepalive once the client is gone
+        deadline = time.monotonic() + 5
+        while kp.event_broker.client_count() > clients_before and time.monotonic() < deadline:
+            time.sleep(0.02)
+        server.close()
@@ -0,0 +1,43 @@
+import gzip
+import json
+
+from conftest import kp
+
+
+def test_menu_is_served_compressed_with_an_etag(client):
+    plain = client.get('/api/menu', headers={'Accept-Encoding': 'identity'})
+    assert plain.status_code == 200
+    assert plain.headers.get('Content-Encoding') is None
+    assert plain.get_json() == kp.menu_cache.get().data
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+    assert plain.headers['Cache-Control'] == 'no-cache'
+
+    compressed = client.get('/api/menu', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.get_json()
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+
+
+def test_menu_revalidation_returns_304_for_either_encoding(client):
+    for encoding in ('identity', 'gzip'):
+        first = client.get('/api/menu', headers={'Accept-Encoding': encoding})
+        again = client.get('/api/menu', headers={'Accept-Encoding': encoding, 'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+        assert again.get_data() == b''
+        assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_saved_menu_gets_a_new_etag(client):
+    before = client.get('/api/menu', headers={'Accept-Encoding': 'identity'})
+    menu = before.get_json()
+    category = next(iter(menu))
+    menu[category][0]['name'] += ' (new)'
+    saved = client.post('/api/menu', json=menu).get_json()
+    try:
+        after = client.get('/api/menu', headers={'Accept-Encoding': 'identity', 'If-None-Match': before.headers['ETag']})
+        assert after.status_code == 200
+        assert after.get_json() == menu
+        assert after.headers['ETag'] == f'"{saved["etag"]}"'
+    finally:
+        menu[category][0]['name'] = menu[category][0]['name'][:-len(' (new)')]
+        client.post('/api/menu', json=menu)
@@ -0,0 +1,33 @@
+import csv
+
+from conftest import kp, make_order
+
+DATE = '2024-05-01'
+
+
+def test_import_skips_bad_rows_and_keeps_the_rest(log_dir, caplog):
+    rows = [kp.build_order_row(make_order(number, number=number), f"{DATE} 20:{number:02d}:00", 2)
+            for number in range(1, 6)]
+    rows[1]['items_json'] = '{"name": "x"}'
+    rows[2]['items_json'] = '[{"name": "Edamame", "price": 4.2, "quantity": "lots"}]'
+    rows[3]['items_json'] = 'not json'
+    with open(log_dir / f"orders_{DATE}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+        f.write('6,short row\r\n')
+    database = kp.OrderDatabase(str(log_dir / 'orders.db'))
+    assert database.import_csv_files() == 4
+    orders = {order['order_number']: order for order in database.orders_for_date(DATE)}
+    assert sorted(orders) == ['1', '2', '4', '5']
+    assert orders['2']['items'] == [] and orders['4']['items'] == []
+    assert len(orders['1']['items']) == 2
+    assert "Skipping order #3" in caplog.text
+
+
+def test_startup_survives_a_failing_import(monkeypatch):
+    def fail():
+        raise AttributeError("'str' object has no attribute 'get'")
+
+    monkeypatch.setattr(kp.order_db, 'import_csv_files', fail)
+    kp.start_background_services()
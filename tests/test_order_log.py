@@ -0,0 +1,156 @@
+import csv
+import statistics
+import time
+
+import pytest
+
+from conftest import kp, make_order
+
+DATE = '2024-05-01'
+
+
+def order_row(number):
+    order = make_order(number, number=number, universalComment='Table by the window\nbring chopsticks')
+    return kp.build_order_row(order, f"{DATE} 12:00:{number % 60:02d}", 2)
+
+
+def logged_numbers(log_dir):
+    with open(log_dir / f"orders_{DATE}.csv", newline='', encoding='utf-8') as f:
+        return [int(row['order_number']) if row['order_number'].isdigit() else row['order_number']
+                for row in csv.DictReader(f)]
+
+
+def write_log(log_dir, rows, tail=''):
+    with open(log_dir / f"orders_{DATE}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+        f.write(tail)
+
+
+def torn_row(number):
+    # A crash in the middle of items_json, the way an interrupted append leaves it
+    buffer = kp.io.StringIO()
+    csv.DictWriter(buffer, fieldnames=kp.CSV_FIELDNAMES).writerow(order_row(number))
+    line = buffer.getvalue()
+    return line[:line.index('"[') + 20]
+
+
+def test_append_writes_header_once(log_dir):
+    journal = kp.OrderJournal()
+    for number in range(1, 4):
+        journal.append(order_row(number), date_str=DATE)
+    journal.close()
+    journal.append(order_row(4), date_str=DATE)
+    journal.close()
+    assert logged_numbers(log_dir) == [1, 2, 3, 4]
+
+
+def test_torn_quoted_row_is_cut_off_and_quarantined(log_dir):
+    write_log(log_dir, [order_row(1)], tail=torn_row(2))
+    journal = kp.OrderJournal()
+    for number in (3, 4, 5):
+        journal.append(order_row(number), date_str=DATE)
+    journal.close()
+    assert logged_numbers(log_dir) == [1, 3, 4, 5]
+    quarantined = (log_dir / 'quarantine' / f"orders_{DATE}.csv").read_text(encoding='utf-8')
+    assert quarantined.startswith('2,')
+
+
+def test_torn_row_ending_inside_a_quoted_newline_is_cut_off(log_dir):
+    buffer = kp.io.StringIO()
+    csv.DictWriter(buffer, fieldnames=kp.CSV_FIELDNAMES).writerow(order_row(2))
+    line = buffer.getvalue()
+    write_log(log_dir, [order_row(1)], tail=line[:line.index('window\n') + len('window\n')])
+    journal = kp.OrderJournal()
+    journal.append(order_row(3), date_str=DATE)
+    journal.close()
+    assert logged_numbers(log_dir) == [1, 3]
+
+
+def test_compact_quarantines_rows_it_cannot_parse(log_dir):
+    write_log(log_dir, [order_row(1), order_row(2)])
+    with open(log_dir / f"orders_{DATE}.csv", 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['total', '', '', '', '', '€99.00', '', ''])
+        writer.writerow(['3', '5', 'not enough fields'])
+        writer.writerow(list(order_row(4).values()))
+    assert kp.OrderJournal().compact(DATE) == 3
+    assert logged_numbers(log_dir) == [1, 2, 4]
+    quarantined = (log_dir / 'quarantine' / f"orders_{DATE}.csv").read_text(encoding='utf-8')
+    assert 'not enough fields' in quarantined
+    assert 'total' not in quarantined
+
+
+def test_compact_leaves_the_log_alone_while_it_is_being_written(log_dir):
+    journal = kp.OrderJournal()
+    journal.append(order_row(1), date_str=DATE)
+    assert journal.compact(DATE) is None
+    journal.close()
+    assert journal.compact(DATE) == 1
+
+
+def test_day_change_compacts_the_previous_day_in_the_background(log_dir):
+    journal = kp.OrderJournal()
+    journal.append(order_row(1), date_str=DATE)
+    with open(log_dir / f"orders_{DATE}.csv", 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(['total', '', '', '', '', '€9.00', '', ''])
+    journal.append(order_row(2), date_str='2024-05-02')
+    for _ in range(100):
+        if logged_numbers(log_dir) == [1]:
+            break
+        time.sleep(0.02)
+    journal.close()
+    assert logged_numbers(log_dir) == [1]
+
+
+def test_a_busy_day_is_logged_in_full(log_dir):
+    journal = kp.OrderJournal()
+    for number in range(1, 5001):
+        journal.append(order_row(number), date_str=DATE)
+    journal.close()
+    assert logged_numbers(log_dir) == list(range(1, 5001))
+
+
+@pytest.mark.benchmark
+def test_append_latency_is_flat(log_dir):
+    # Benchmark: per-order append time must not grow with the size of the day's log
+    rows = [order_row(number) for number in range(1, 5001)]
+    journal = kp.OrderJournal()
+    latencies = []
+    for row in rows:
+        started = time.perf_counter()
+        journal.append(row, date_str=DATE)
+        latencies.append(time.perf_counter() - started)
+    journal.close()
+    first = statistics.median(latencies[:500])
+    last = statistics.median(latencies[-500:])
+    print(f"\nappend median: orders 1-500 {first * 1e6:.1f}us, orders 4501-5000 {last * 1e6:.1f}us")
+    assert last < first * 3 + 20e-6
+
+
+def test_store_reloaded_between_append_and_add_keeps_one_copy(log_dir):
+    today = kp.datetime.now().strftime('%Y-%m-%d')
+    row = kp.build_order_row(make_order(7, number=7), f"{today} 12:00:00", 2)
+    with open(log_dir / f"orders_{today}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerow(row)
+    store = kp.OrderStore()
+    assert [order['order_number'] for order in store.reprint_list()] == ['7']
+    store.add(row, make_order(7)['items'])
+    assert [order['order_number'] for order in store.reprint_list()] == ['7']
+
+
+def test_quiet_journal_is_synced_within_the_interval(log_dir):
+    journal = kp.OrderJournal(fsync_batch_size=10, fsync_interval=0.05)
+    try:
+        journal.append(order_row(1), date_str=DATE)
+        journal.append(order_row(2), date_str=DATE)
+        assert journal._unsynced_rows == 2
+        deadline = time.monotonic() + 2
+        while journal._unsynced_rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert journal._unsynced_rows == 0
+    finally:
+        journal.close()
@@ -0,0 +1,118 @@
+import csv
+import io
+import os
+
+import pytest
+
+from conftest import kp, make_order
+
+DAY_1 = '2024-05-01'
+DAY_2 = '2024-05-02'
+
+
+def order_row(number, date_str, table, item_name='Edamame', comment=''):
+    order = make_order(number, number=number, tableNumber=table, universalComment=comment,
+                       items=[{'name': item_name, 'price': 4.2, 'quantity': 1,
+                               'comment': 'no salt,\r\n"really" none'}])
+    return kp.build_order_row(order, f"{date_str} 19:{number % 60:02d}:00", 2)
+
+
+def write_log(log_dir, date_str, rows, total_row=False):
+    with open(log_dir / f"orders_{date_str}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+        if total_row:
+            writer.writerow({'order_number': 'TOTAL', 'order_total': '€99.00'})
+
+
+@pytest.fixture
+def logs(log_dir, monkeypatch):
+    monkeypatch.setattr(kp, 'order_log_index', kp.OrderLogIndex(str(log_dir / 'index')))
+    write_log(log_dir, DAY_1, [
+        order_row(1, DAY_1, '3', comment='Birthday\nbring a candle'),
+        order_row(2, DAY_1, '4', item_name='Unagi Don'),
+        order_row(3, DAY_1, '3', comment='line one\r\n\r\nline three'),
+    ], total_row=True)
+    write_log(log_dir, DAY_2, [
+        order_row(1, DAY_2, '7'),
+        order_row(2, DAY_2, '8', comment='window seat'),
+    ])
+    return log_dir
+
+
+@pytest.fixture
+def files_read(logs, monkeypatch):
+    # (date, offsets) of every log read by a search, once the day indexes are built
+    for date_str in (DAY_1, DAY_2):
+        kp.order_log_index.get(date_str)
+    reads = []
+    iter_rows = kp.iter_order_log_rows
+
+    def recording_iter_rows(filename, offsets=None):
+        reads.append((os.path.basename(filename)[len('orders_'):-len('.csv')], offsets))
+        return iter_rows(filename, offsets)
+
+    monkeypatch.setattr(kp, 'iter_order_log_rows', recording_iter_rows)
+    return reads
+
+
+def test_rows_with_multi_line_fields_are_read_whole_and_seekable(logs):
+    filename = kp.order_log_path(DAY_1)
+    rows = list(kp.iter_order_log_rows(filename))
+    assert [row['order_number'] for _, row in rows] == ['1', '2', '3']
+    assert rows[0][1]['universal_comment'] == 'Birthday\nbring a candle'
+    assert rows[2][1]['universal_comment'] == 'line one\r\n\r\nline three'
+    for offset, row in rows:
+        assert list(kp.iter_order_log_rows(filename, [offset])) == [(offset, row)]
+    assert [row['order_number'] for _, row in kp.iter_order_log_rows(filename, [rows[2][0], rows[0][0]])] == ['3', '1']
+
+
+def test_order_number_lookup_seeks_to_the_indexed_rows(logs, files_read):
+    rows = list(kp.search_order_log(DAY_1, DAY_2, order_number='3'))
+    assert [(row['timestamp'], row['universal_comment']) for row in rows] == [(f"{DAY_1} 19:03:00", 'line one\r\n\r\nline three')]
+    assert [date_str for date_str, _ in files_read] == [DAY_1]
+    assert len(files_read[0][1]) == 1
+
+
+def test_index_is_rebuilt_when_the_log_changes(logs):
+    assert list(kp.search_order_log(DAY_1, DAY_1, order_number='4')) == []
+    assert (logs / 'index' / f"index_{DAY_1}.json").exists()
+    with open(logs / f"orders_{DAY_1}.csv", 'a', newline='', encoding='utf-8') as f:
+        csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES).writerow(order_row(4, DAY_1, '9', comment='late\nentry'))
+    rows = list(kp.search_order_log(DAY_1, DAY_1, order_number='4'))
+    assert [row['universal_comment'] for row in rows] == ['late\nentry']
+    assert [row['order_number'] for row in kp.search_order_log(DAY_1, DAY_1, table_number='9')] == ['4']
+
+
+def test_days_without_the_table_or_item_are_skipped(logs, files_read):
+    assert [row['order_number'] for row in kp.search_order_log(table_number='8')] == ['2']
+    assert [date_str for date_str, _ in files_read] == [DAY_2]
+    files_read.clear()
+    assert [(row['timestamp'][:10], row['order_number']) for row in kp.search_order_log(item_name='unagi')] == [(DAY_1, '2')]
+    assert [date_str for date_str, _ in files_read] == [DAY_1]
+
+
+def test_search_endpoint_streams_matching_orders_as_json(client, logs):
+    response = client.get(f"/api/orders/search?from={DAY_1}&to={DAY_2}&table=3")
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['count'] == 2
+    assert [order['universal_comment'] for order in result['orders']] == ['Birthday\nbring a candle', 'line one\r\n\r\nline three']
+    assert result['orders'][0]['items'][0]['comment'] == 'no salt,\r\n"really" none'
+    assert client.get(f"/api/orders/search?from={DAY_1}&limit=1").get_json()['count'] == 1
+    assert client.get("/api/orders/search?from=May").status_code == 400
+
+
+def test_export_endpoint_streams_the_matching_rows_as_csv(client, logs, monkeypatch):
+    monkeypatch.setattr(kp, 'ORDER_EXPORT_CHUNK_SIZE', 100)
+    response = client.get(f"/api/orders/export?from={DAY_1}&to={DAY_2}")
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert f'filename="orders_{DAY_1}_{DAY_2}.csv"' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True), newline='')))
+    assert [(row['timestamp'][:10], row['order_number']) for row in rows] == \
+        [(DAY_1, '1'), (DAY_1, '2'), (DAY_1, '3'), (DAY_2, '1'), (DAY_2, '2')]
+    assert rows[2]['universal_comment'] == 'line one\r\n\r\nline three'
+    assert rows == [dict(row) for _, row in kp.iter_order_log_rows(kp.order_log_path(DAY_1))] + \
+        [dict(row) for _, row in kp.iter_order_log_rows(kp.order_log_path(DAY_2))]
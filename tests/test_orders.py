@@ -0,0 +1,169 @@
+import collections
+import threading
+import time
+
+import pytest
+
+from conftest import kp, make_order
+
+
+def printed_tickets():
+    return [doc_name for doc_name, _ in kp.get_printer_backend(kp.PRINTER_NAME).tickets]
+
+
+def tickets_for(order_number):
+    return sum(1 for doc_name in printed_tickets() if doc_name.startswith(f"Order_{order_number}_Ticket_"))
+
+
+def wait_for_prints(timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while kp.print_spooler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert kp.print_spooler.pending_count() == 0
+
+
+def logged_order_numbers():
+    return [int(row['order_number']) for _, row in kp.iter_order_log_rows(
+        kp.order_log_path(time.strftime('%Y-%m-%d')))]
+
+
+def post_until_accepted(client, order):
+    # What a tablet does: retry while the same key is still being processed
+    for _ in range(500):
+        response = client.post('/api/orders', json=order)
+        if response.status_code != 409:
+            return response
+        time.sleep(0.005)
+    pytest.fail("order stayed in progress")
+
+
+def test_order_is_numbered_logged_and_printed(client):
+    response = client.post('/api/orders', json=make_order(1))
+    assert response.status_code == 200
+    order_number = response.get_json()['order_number']
+    wait_for_prints()
+    assert order_number in logged_order_numbers()
+    assert tickets_for(order_number) == 2
+
+
+def test_retry_with_the_same_key_returns_the_same_order(client):
+    order = make_order(2, clientRequestId='retry-same-key')
+    first = client.post('/api/orders', json=order).get_json()
+    second = client.post('/api/orders', json=order).get_json()
+    assert second['order_number'] == first['order_number']
+    assert second['duplicate'] is True
+    wait_for_prints()
+    assert logged_order_numbers().count(first['order_number']) == 1
+    assert tickets_for(first['order_number']) == 2
+
+
+def test_failed_log_write_prints_nothing_and_the_retry_prints_once(client, monkeypatch):
+    append = kp.order_journal.append
+    calls = []
+
+    def append_failing_once(row, date_str=None):
+        calls.append(row['order_number'])
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return append(row, date_str=date_str)
+
+    monkeypatch.setattr(kp.order_journal, 'append', append_failing_once)
+    order = make_order(3, clientRequestId='append-fails-once')
+    assert client.post('/api/orders', json=order).status_code == 500
+    wait_for_prints()
+    assert tickets_for(calls[0]) == 0
+    response = client.post('/api/orders', json=order)
+    assert response.status_code == 200
+    order_number = response.get_json()['order_number']
+    assert order_number == calls[0]
+    wait_for_prints()
+    assert tickets_for(order_number) == 2
+    assert logged_order_numbers().count(order_number) == 1
+
+
+def test_concurrent_orders_and_retries_are_numbered_once(client):
+    # Stress test: 20 tablets each send one keyed order 4 times at once (retries over
+    # flaky Wi-Fi) and 20 more send unkeyed orders, all from separate threads.
+    keyed = [make_order(index, clientRequestId=f"stress-{index}") for index in range(20)]
+    attempts = [order for order in keyed for _ in range(4)] + [make_order(index) for index in range(20, 40)]
+    results = collections.defaultdict(list)
+    errors = []
+    start = threading.Barrier(len(attempts))
+
+    def send(order):
+        try:
+            start.wait()
+            response = post_until_accepted(kp.app.test_client(), order)
+            assert response.status_code == 200, response.get_json()
+            results[order.get('clientRequestId') or id(order)].append(response.get_json()['order_number'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=send, args=(order,)) for order in attempts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    numbers = []
+    for key, order_numbers in results.items():
+        assert len(set(order_numbers)) == 1, key
+        numbers.append(order_numbers[0])
+    assert len(numbers) == 40
+    assert sorted(numbers) == list(range(min(numbers), min(numbers) + 40))
+
+    wait_for_prints()
+    logged = logged_order_numbers()
+    for order_number in numbers:
+        assert logged.count(order_number) == 1
+        assert tickets_for(order_number) == 2
+
+
+def test_batch_numbers_and_deduplicates_each_order(client):
+    orders = [make_order(index, clientRequestId=f"batch-{index}") for index in range(5)]
+    orders.append(dict(orders[0]))
+    results = client.post('/api/orders/batch', json={'orders': orders}).get_json()['results']
+    assert [result['status'] for result in results] == ['success'] * 6
+    assert results[5]['order_number'] == results[0]['order_number']
+    replayed = client.post('/api/orders/batch', json={'orders': orders[:5]}).get_json()['results']
+    assert all(result['duplicate'] for result in replayed)
+    wait_for_prints()
+    logged = logged_order_numbers()
+    for result in results[:5]:
+        assert logged.count(result['order_number']) == 1
+        assert tickets_for(result['order_number']) == 2
+
+
+def test_failed_batch_write_prints_nothing_and_the_replay_prints_once(client, monkeypatch):
+    append_many = kp.order_journal.append_many
+    calls = []
+
+    def append_many_failing_once(rows, date_str=None):
+        calls.append([row['order_number'] for row in rows])
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return append_many(rows, date_str=date_str)
+
+    monkeypatch.setattr(kp.order_journal, 'append_many', append_many_failing_once)
+    orders = [make_order(index, clientRequestId=f"batch-fails-once-{index}") for index in range(3)]
+    results = client.post('/api/orders/batch', json=orders).get_json()['results']
+    assert [result['status'] for result in results] == ['error'] * 3
+    assert all(result['retry'] and not result.get('rejected') for result in results)
+    wait_for_prints()
+    assert all(tickets_for(order_number) == 0 for order_number in calls[0])
+    results = client.post('/api/orders/batch', json=orders).get_json()['results']
+    assert [result['order_number'] for result in results] == calls[0]
+    wait_for_prints()
+    for order_number in calls[0]:
+        assert tickets_for(order_number) == 2
+
+
+def test_batch_marks_only_invalid_orders_as_rejected(client):
+    orders = [make_order(40, clientRequestId='batch-valid'),
+              make_order(41, clientRequestId='batch-unknown-item', items=[{'id': 999999, 'quantity': 1}]),
+              {'clientRequestId': 'batch-no-items'}]
+    results = client.post('/api/orders/batch', json=orders).get_json()['results']
+    assert results[0]['status'] == 'success' and not results[0].get('rejected')
+    assert [result.get('rejected') for result in results[1:]] == [True, True]
+    assert not any(result.get('retry') for result in results)
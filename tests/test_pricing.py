@@ -0,0 +1,92 @@
+import pytest
+
+from conftest import kp, make_order
+
+MENU = {
+    'Ramen': [
+        {'id': 1, 'name': 'Shoyu Ramen', 'price': 11.5,
+         'options': [{'name': 'Extra egg', 'price': 1.5}, {'name': 'Small', 'price': -2}]},
+        {'id': 2, 'name': 'Edamame', 'price': 4.2, 'options': ['Normal', 'Spicy']},
+    ],
+}
+
+
+def priced(items):
+    return kp.price_order({'items': items}, kp.MenuIndex(MENU))
+
+
+def test_tampered_prices_are_replaced_with_menu_prices():
+    order = priced([{'id': 1, 'name': 'Shoyu Ramen', 'price': 0.01, 'quantity': 2,
+                     'selectedOptions': [{'name': 'Extra egg', 'price': 0}]}])
+    assert order['items'][0]['price'] == 11.5
+    assert order['items'][0]['selectedOptions'] == [{'name': 'Extra egg', 'price': 1.5}]
+    assert order['line_cents'] == [2600]
+    assert order['total_cents'] == 2600
+
+
+def test_string_options_are_accepted():
+    order = priced([{'id': 2, 'quantity': 3, 'selectedOptions': ['Spicy']}])
+    assert order['items'][0]['selectedOptions'] == [{'name': 'Spicy', 'price': 0}]
+    assert order['total_cents'] == 1260
+
+
+@pytest.mark.parametrize('items', [
+    [{'id': 99, 'name': 'Lobster', 'quantity': 1}],
+    [{'id': 1, 'quantity': 1, 'selectedOptions': [{'name': 'Gold leaf', 'price': 0}]}],
+    [{'id': 2, 'quantity': 1, 'selectedOptions': ['Extra egg']}],
+    [{'id': 1, 'quantity': 0}],
+    [{'id': 1, 'quantity': kp.MAX_ITEM_QUANTITY + 1}],
+    [{'id': 1, 'quantity': -1}],
+    [{'id': 1, 'quantity': True}],
+    [{'id': 1, 'quantity': 1.5}],
+    [{'id': 1, 'quantity': '2'}],
+    [],
+])
+def test_invalid_items_are_rejected(items):
+    with pytest.raises(ValueError):
+        priced(items)
+
+
+def test_order_endpoint_rejects_unknown_items_and_options(client):
+    unknown_item = make_order(1, items=[{'id': 999999, 'name': 'Lobster', 'quantity': 1}])
+    response = client.post('/api/orders', json=unknown_item)
+    assert response.status_code == 400
+    assert 'not on the menu' in response.get_json()['message']
+
+    menu_item = next(entry for entries in kp.menu_cache.get().data.values() for entry in entries)
+    unknown_option = make_order(1, items=[{'id': menu_item['id'], 'quantity': 1,
+                                           'selectedOptions': [{'name': 'Gold leaf', 'price': 0}]}])
+    response = client.post('/api/orders', json=unknown_option)
+    assert response.status_code == 400
+    assert 'not an option' in response.get_json()['message']
+
+    response = client.post('/api/orders', json=make_order(1, items=[{'id': menu_item['id'], 'quantity': True}]))
+    assert response.status_code == 400
+
+
+def test_index_recompiles_only_changed_items():
+    index = kp.MenuIndex(MENU)
+    assert index.compiled_count == 2
+    changed = {'Ramen': [MENU['Ramen'][0], dict(MENU['Ramen'][1], price=4.5)]}
+    new_index = kp.MenuIndex(changed, index)
+    assert new_index.compiled_count == 1
+    assert new_index.items_by_id[1] is index.items_by_id[1]
+    assert new_index.items_by_id[2].price_cents == 450
+
+
+def test_saving_a_menu_with_one_changed_item_recompiles_one(client):
+    menu = client.get('/api/menu', headers={'Accept-Encoding': 'identity'}).get_json()
+    category = next(iter(menu))
+    original_price = menu[category][0]['price']
+    menu[category][0]['price'] = original_price + 1
+    try:
+        assert client.post('/api/menu', json=menu).status_code == 200
+        assert kp.menu_cache.get().index.compiled_count == 1
+    finally:
+        menu[category][0]['price'] = original_price
+        client.post('/api/menu', json=menu)
+
+
+def test_menu_with_duplicate_ids_or_bad_prices_is_not_saved(client):
+    assert client.post('/api/menu', json={'A': [{'id': 1, 'price': 1}, {'id': 1, 'price': 2}]}).status_code == 400
+    assert client.post('/api/menu', json={'A': [{'id': 1, 'price': 'free'}]}).status_code == 400
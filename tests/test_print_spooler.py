@@ -0,0 +1,137 @@
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from conftest import kp, make_order
+
+
+def wait_for_prints(timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while kp.print_spooler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert kp.print_spooler.pending_count() == 0
+
+
+def printed_status(order_number):
+    today = time.strftime('%Y-%m-%d')
+    return next(order['printed_status'] for order in kp.order_db.orders_for_date(today)
+                if order['order_number'] == str(order_number))
+
+
+def test_printed_status_is_recorded_when_all_copies_print(client):
+    order_number = client.post('/api/orders', json=make_order(11)).get_json()['order_number']
+    wait_for_prints()
+    assert printed_status(order_number) == 'Yes (2 copies)'
+
+
+def test_printed_status_is_partial_when_a_copy_fails(client, monkeypatch):
+    send_ticket = kp.send_ticket
+
+    def customer_copy_fails(ticket_data, doc_name, printer_name=None):
+        return not doc_name.endswith('_Customer') and send_ticket(ticket_data, doc_name, printer_name)
+
+    monkeypatch.setattr(kp, 'send_ticket', customer_copy_fails)
+    monkeypatch.setattr(kp, 'PRINT_MAX_ATTEMPTS', 1)
+    order_number = client.post('/api/orders', json=make_order(12)).get_json()['order_number']
+    wait_for_prints()
+    assert printed_status(order_number) == 'Partial (1 copy)'
+
+
+def failed_job(order_number, copy_info, status='failed', minutes_old=1):
+    created_at = (datetime.now() - timedelta(minutes=minutes_old)).strftime('%Y-%m-%d %H:%M:%S')
+    return {'id': f"{order_number}-{copy_info}", 'order_number': str(order_number),
+            'order_timestamp': created_at, 'order_copies': 2, 'copy_info': copy_info,
+            'printer': 'Test Printer', 'status': status, 'attempts': 5, 'last_error': None,
+            'created_at': created_at, 'updated_at': created_at, 'ticket': ''}
+
+
+def test_printer_back_requeues_only_recent_partly_printed_orders(tmp_path, monkeypatch):
+    spooler = kp.PrintSpooler(str(tmp_path / 'print_queue.jsonl'))
+    monkeypatch.setattr(spooler, '_enqueue', lambda job: None)
+    jobs = [
+        failed_job(901, 'Kitchen', status='done'), failed_job(901, 'Customer'),
+        failed_job(902, 'Kitchen'), failed_job(902, 'Customer'),
+        failed_job(903, 'Kitchen', status='done', minutes_old=60), failed_job(903, 'Customer', minutes_old=60),
+    ]
+    spooler._jobs = {job['id']: job for job in jobs}
+    assert spooler.requeue_failed('Test Printer') == 1
+    assert spooler._jobs['901-Customer']['status'] == 'queued'
+    for job_id in ('902-Kitchen', '902-Customer', '903-Customer'):
+        assert spooler._jobs[job_id]['status'] == 'failed'
+        assert spooler._jobs[job_id]['late'] is True
+    assert 'no other copy' in spooler._jobs['902-Kitchen']['last_error']
+    assert 'minutes old' in spooler._jobs['903-Customer']['last_error']
+    # Late tickets stay late the next time the printer comes back
+    assert spooler.requeue_failed('Test Printer') == 0
+
+
+def fake_network_printer(reply):
+    # A port 9100 listener that answers every DLE EOT request with reply(n), or not
+    # at all when reply is None. Returns (port, received bytes).
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    received = bytearray()
+
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            while True:
+                data = connection.recv(1024)
+                if not data:
+                    return
+                received.extend(data)
+                if reply:
+                    connection.sendall(bytes(reply(data[index + 2]) for index in range(0, len(data), 3)
+                                             if data[index:index + 2] == kp.DLE_EOT))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1], received
+
+
+def test_status_reads_the_realtime_status_replies():
+    port, _ = fake_network_printer(lambda request_type: 0x72 if request_type == 4 else 0x12)
+    backend = kp.SocketPrinterBackend('Paperless', '127.0.0.1', port)
+    try:
+        assert backend.status() == ('paper_out', 'Paper out')
+    finally:
+        backend.close()
+
+
+def test_silent_printer_is_probed_briefly_and_then_no_more():
+    port, received = fake_network_printer(None)
+    backend = kp.SocketPrinterBackend('Silent', '127.0.0.1', port)
+    try:
+        for _ in range(kp.PRINTER_STATUS_MAX_MISSES):
+            started = time.monotonic()
+            assert backend.status()[0] == 'ok'
+            assert time.monotonic() - started < kp.PRINTER_STATUS_REPLY_TIMEOUT + 0.2
+        requests_sent = len(received)
+        assert requests_sent == kp.PRINTER_STATUS_MAX_MISSES * 9
+        started = time.monotonic()
+        assert backend.status() == ('ok', "Connected (does not answer status requests)")
+        assert time.monotonic() - started < 0.05
+        backend.send(b"ticket", "Order_1_Ticket_Kitchen")
+        deadline = time.monotonic() + 2
+        while len(received) < requests_sent + len(b"ticket") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert bytes(received[requests_sent:]) == b"ticket"
+    finally:
+        backend.close()
+
+
+def test_broken_job_fails_without_stopping_the_worker(tmp_path):
+    state_file = tmp_path / 'print_queue.jsonl'
+    jobs = [failed_job(911, 'Kitchen', status='queued'), failed_job(912, 'Kitchen', status='queued')]
+    jobs[0]['ticket'] = 'x'
+    jobs[1]['ticket'] = kp.base64.b64encode(b'ticket 912').decode('ascii')
+    state_file.write_text("".join(kp.json.dumps(job) + "\n" for job in jobs), encoding='utf-8')
+    spooler = kp.PrintSpooler(str(state_file))
+    spooler.start()
+    deadline = time.monotonic() + 5
+    while spooler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert spooler.get_job('911-Kitchen')['status'] == 'failed'
+    assert spooler.get_job('912-Kitchen')['status'] == 'done'
+    assert ('Order_912_Ticket_Kitchen', b'ticket 912') in kp.get_printer_backend('Test Printer').tickets
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from conftest import kp
+
+
+def wait_deep(release, depth):
+    if depth:
+        return wait_deep(release, depth - 1)
+    release.wait()
+
+
+def sample_deep_threads(samples):
+    # 48 idle server-like threads, 30 frames deep. Returns (seconds per sample, profiler)
+    release = threading.Event()
+    threads = [threading.Thread(target=wait_deep, args=(release, 30)) for _ in range(48)]
+    for thread in threads:
+        thread.start()
+    profiler = kp.SamplingProfiler(kp.PROFILER_MIN_INTERVAL)
+    try:
+        started = time.perf_counter()
+        for _ in range(samples):
+            profiler.sample()
+        per_sample = (time.perf_counter() - started) / samples
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    return per_sample, profiler
+
+
+def test_sample_records_every_thread_stack():
+    _, profiler = sample_deep_threads(5)
+    samples, collapsed = profiler.report()
+    assert samples == 5
+    assert "test_profiler.py:wait_deep;" * 30 in collapsed
+
+
+@pytest.mark.benchmark
+def test_sample_is_cheap_with_many_threads():
+    # Benchmark: one sample has to stay far below the sampling interval
+    per_sample, _ = sample_deep_threads(50)
+    print(f"\nprofiler: {per_sample * 1e3:.2f}ms per sample of 48 threads")
+    assert per_sample < kp.PROFILER_MIN_INTERVAL / 4
+
+
+def test_profiler_rejects_intervals_below_the_minimum(client):
+    response = client.post('/api/profiler', json={'action': 'start', 'interval': 0.001})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('url, body', [
+    ('/api/profiler', {'action': 'status'}),
+    ('/api/reprint_order', {'order_number': '999999'}),
+])
+def test_json_parse_time_is_recorded_for_the_endpoint(client, url, body):
+    def parse_count():
+        series = kp.JSON_PARSE_SECONDS._series.get((url,))
+        return series[-1] if series else 0
+
+    before = parse_count()
+    client.post(url, json=body)
+    assert parse_count() == before + 1
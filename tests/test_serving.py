@@ -0,0 +1,61 @@
+import http.client
+import json
+import threading
+import time
+
+from waitress.server import create_server
+
+from conftest import kp, make_order
+
+
+def test_concurrent_orders_through_waitress_are_all_logged():
+    # Load test: 16 clients post 25 orders each to a multi-threaded waitress server;
+    # every order must come back with its own number, be logged once and print twice.
+    server = create_server(kp.app, host='127.0.0.1', port=0, threads=8)
+    threading.Thread(target=server.run, daemon=True).start()
+    port = server.socket.getsockname()[1]
+    numbers = []
+    errors = []
+
+    def client(client_index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            for index in range(25):
+                order = make_order(client_index * 25 + index, clientRequestId=f"load-{client_index}-{index}")
+                connection.request('POST', '/api/orders', body=json.dumps(order),
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                body = json.loads(response.read())
+                if response.status != 200:
+                    errors.append(body)
+                    continue
+                numbers.append(body['order_number'])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    try:
+        clients = [threading.Thread(target=client, args=(client_index,)) for client_index in range(16)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    finally:
+        server.close()
+
+    assert not errors
+    assert len(numbers) == 400
+    assert len(set(numbers)) == 400
+
+    deadline = time.monotonic() + 10
+    while kp.print_spooler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    today = time.strftime('%Y-%m-%d')
+    logged = [int(row['order_number']) for _, row in kp.iter_order_log_rows(kp.order_log_path(today))]
+    stored = [int(order['order_number']) for order in kp.order_db.orders_for_date(today)]
+    printed = [doc_name for doc_name, _ in kp.get_printer_backend(kp.PRINTER_NAME).tickets]
+    for order_number in numbers:
+        assert logged.count(order_number) == 1
+        assert stored.count(order_number) == 1
+        assert sum(1 for doc_name in printed if doc_name.startswith(f"Order_{order_number}_Ticket_")) == 2
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from conftest import kp
+
+TIMESTAMP = '2024-05-01 19:30:00'
+PRINT_SECONDS = 0.4
+
+
+class SlowPrinter(kp.MemoryPrinterBackend):
+    # Records how many slow printers were printing at the same time
+    active = 0
+    most_active = 0
+    lock = threading.Lock()
+
+    def _send(self, data, doc_name):
+        with SlowPrinter.lock:
+            SlowPrinter.active += 1
+            SlowPrinter.most_active = max(SlowPrinter.most_active, SlowPrinter.active)
+        time.sleep(PRINT_SECONDS)
+        with SlowPrinter.lock:
+            SlowPrinter.active -= 1
+        super()._send(data, doc_name)
+
+
+@pytest.fixture
+def stations(monkeypatch):
+    # Two stations on their own (slow) printers; the third category is not mapped
+    categories = list(kp.menu_cache.get().data)[:3]
+    monkeypatch.setattr(kp, 'STATIONS', {'sushi': 'Sushi Printer', 'hot': 'Hot Printer'})
+    monkeypatch.setattr(kp, 'CATEGORY_STATIONS', {categories[0]: 'sushi', categories[1]: 'hot'})
+    monkeypatch.setattr(kp, 'DEFAULT_STATION', 'hot')
+    for printer_name in ('Sushi Printer', 'Hot Printer'):
+        monkeypatch.setitem(kp._printer_backends, printer_name, SlowPrinter(printer_name))
+    return categories
+
+
+def station_order(categories):
+    menu = kp.menu_cache.get().data
+    order = {'number': 77, 'items': [
+        {'id': menu[categories[0]][0]['id'], 'quantity': 1},
+        {'id': menu[categories[1]][0]['id'], 'quantity': 2},
+        {'id': menu[categories[0]][1]['id'], 'quantity': 1},
+        {'id': menu[categories[2]][0]['id'], 'quantity': 1},
+    ]}
+    return kp.price_order(order, kp.menu_cache.get().index)
+
+
+def test_items_are_split_by_station_with_a_default(stations):
+    assert kp.route_order_items(station_order(stations)) == {'sushi': [0, 2], 'hot': [1, 3]}
+
+
+def test_station_tickets_print_in_parallel_and_resolve_the_outcome(stations, tmp_path, monkeypatch):
+    order = station_order(stations)
+    tickets = kp.plan_order_tickets(order, TIMESTAMP)
+    assert [(copy_info, printer_name) for copy_info, _, printer_name in tickets] == \
+        [('sushi', 'Sushi Printer'), ('hot', 'Hot Printer'), ('Customer', kp.PRINTER_NAME)]
+    sushi_ticket = "".join(kp.render_ticket_preview(tickets[0][1], 'text')[0].split())
+    assert "".join(order['items'][0]['name'].split()) in sushi_ticket
+    assert "".join(order['items'][2]['name'].split()) in sushi_ticket
+    assert "".join(order['items'][1]['name'].split()) not in sushi_ticket
+
+    outcomes = []
+    monkeypatch.setattr(kp, 'record_print_outcome', lambda *args: outcomes.append(args))
+    monkeypatch.setattr(SlowPrinter, 'most_active', 0)
+    spooler = kp.PrintSpooler(str(tmp_path / 'print_queue.jsonl'))
+    jobs = spooler.submit_many(order['number'], tickets, TIMESTAMP)
+    assert all(job['order_copies'] == len(tickets) for job in jobs)
+    deadline = time.monotonic() + 5
+    while spooler.pending_count() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [spooler.get_job(job['id'])['status'] for job in jobs] == ['done'] * 3
+    assert outcomes == [('77', TIMESTAMP, 'Yes (3 copies)')]
+    # Both stations printed at the same time: one printer's time, not the sum
+    assert SlowPrinter.most_active == 2
@@ -0,0 +1,76 @@
+import csv
+import threading
+from datetime import datetime
+
+from conftest import kp, make_order
+
+DATE = '2024-05-01'
+
+
+def write_log(log_dir, rows):
+    with open(log_dir / f"orders_{DATE}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def order_row(number, **fields):
+    row = kp.build_order_row(make_order(number, number=number), f"{DATE} 19:{number:02d}:00", 2)
+    row.update(fields)
+    return row
+
+
+def test_rollup_skips_items_that_are_not_item_objects(log_dir):
+    write_log(log_dir, [
+        order_row(1),
+        order_row(2, items_json='{"name": "x"}'),
+        order_row(3, items_json='["x", 4, {"name": "Edamame", "price": 4.2, "quantity": 2, "selectedOptions": ["Spicy"]}]'),
+        order_row(4, items_json='[{"name": "Edamame", "price": 4.2, "quantity": "lots"}]'),
+    ])
+    rollup = kp.rollup_from_csv(DATE)
+    assert rollup['order_count'] == 3
+    assert rollup['items']['Edamame']['options'] == {'Spicy': 2}
+
+
+def test_order_succeeds_when_stats_and_database_fail(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AttributeError("'dict' object has no attribute 'get'")
+
+    monkeypatch.setattr(kp.sales_stats, 'add_order', fail)
+    monkeypatch.setattr(kp.order_db, 'insert_orders', fail)
+    response = client.post('/api/orders', json=make_order(8))
+    assert response.status_code == 200
+    assert kp.order_store.get(response.get_json()['order_number'])
+
+
+def test_order_logged_before_the_rollup_loads_is_counted_once(log_dir):
+    today = datetime.now().strftime('%Y-%m-%d')
+    row = kp.build_order_row(make_order(5, number=5), f"{today} 12:00:00", 2)
+    with open(log_dir / f"orders_{today}.csv", 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=kp.CSV_FIELDNAMES)
+        writer.writeheader()
+        writer.writerow(row)
+    stats = kp.SalesStats(str(log_dir / 'stats'))
+    assert stats.daily_rollup(today)['order_count'] == 1
+    stats.add_order(row, make_order(5)['items'])
+    assert stats.daily_rollup(today)['order_count'] == 1
+
+
+def test_concurrent_orders_on_a_cold_rollup_match_the_log(client):
+    # The first orders after a restart load the rollup while others are being added
+    today = datetime.now().strftime('%Y-%m-%d')
+    kp.sales_stats._today = None
+    start = threading.Barrier(40)
+    statuses = []
+
+    def send(index):
+        start.wait()
+        statuses.append(kp.app.test_client().post('/api/orders', json=make_order(index)).status_code)
+
+    threads = [threading.Thread(target=send, args=(index,)) for index in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200] * 40
+    assert kp.sales_stats.daily_rollup(today)['order_count'] == kp.rollup_from_csv(today)['order_count']
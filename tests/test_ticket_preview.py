@@ -0,0 +1,96 @@
+# Golden-file tests for the ticket layout: each fixture order is rendered to ESC/POS
+# bytes and previewed as text, and the result must match tests/golden/<name>.txt.
+# After an intended layout change, regenerate the files with
+#   KP_UPDATE_GOLDEN=1 python -m pytest tests/test_ticket_preview.py
+# and review the diff.
+import os
+import time
+
+import pytest
+
+from conftest import kp, make_order
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+TIMESTAMP = '2024-05-01 19:30:00'
+
+FIXTURE_ORDERS = {
+    'two_items': ({'number': 17, 'items': [
+        {'name': 'Edamame', 'price': 4.2, 'quantity': 2},
+        {'name': 'Gyoza Chicken', 'price': 7.2, 'quantity': 1},
+    ]}, 'Kitchen'),
+    'customer_copy': ({'number': 17, 'items': [
+        {'name': 'Edamame', 'price': 4.2, 'quantity': 2},
+    ]}, 'Customer'),
+    'long_item_name': ({'number': 204, 'items': [
+        {'name': 'Dragon Roll with Tempura Shrimp, Avocado and Spicy Mayo (8 pcs)', 'price': 14.9, 'quantity': 12},
+        {'name': 'Supercalifragilisticexpialidociousmaki', 'price': 9.5, 'quantity': 1},
+    ]}, 'Kitchen'),
+    'options': ({'number': 3, 'items': [
+        {'name': 'Ramen', 'price': 11.5, 'quantity': 1, 'selectedOptions': [
+            {'name': 'Extra egg', 'price': 1.5},
+            {'name': 'No bamboo shoots', 'price': 0},
+            {'name': 'Small portion', 'price': -2},
+        ]},
+    ]}, 'Kitchen'),
+    'notes': ({'number': 58, 'universalComment': 'Birthday table, bring the dessert with a candle\n\nAllergy: sesame',
+               'items': [
+                   {'name': 'Salmon Nigiri', 'price': 6.0, 'quantity': 4,
+                    'comment': 'no wasabi on two of them, the other two with extra wasabi please'},
+                   {'name': 'Miso Soup', 'price': 3.5, 'quantity': 2, 'comment': 'first\nsecond line'},
+               ]}, 'Kitchen'),
+    'non_ascii': ({'number': 9, 'items': [
+        {'name': 'Crème brûlée', 'price': 6.5, 'quantity': 1, 'comment': 'Jalapeño on the side, 5€ tip'},
+    ]}, 'Kitchen'),
+    'empty_order': ({'number': 1, 'items': []}, ''),
+}
+
+
+def preview(name):
+    order, copy_info = FIXTURE_ORDERS[name]
+    text, mimetype = kp.render_ticket_preview(kp.render_kitchen_ticket(order, copy_info, TIMESTAMP), 'text')
+    assert mimetype.startswith('text/plain')
+    return text
+
+
+@pytest.mark.parametrize('name', sorted(FIXTURE_ORDERS))
+def test_preview_matches_golden_file(name):
+    golden_path = os.path.join(GOLDEN_DIR, f"{name}.txt")
+    text = preview(name)
+    if os.environ.get('KP_UPDATE_GOLDEN'):
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(golden_path, 'w', encoding='utf-8', newline='\r\n') as f:
+            f.write(text)
+    with open(golden_path, 'r', encoding='utf-8') as f:
+        assert text == f.read()
+
+
+def test_html_preview_escapes_and_marks_the_cut():
+    order = {'number': 5, 'items': [{'name': '<b>Tuna</b> & Rice', 'price': 5, 'quantity': 1}]}
+    page, mimetype = kp.render_ticket_preview(kp.render_kitchen_ticket(order, 'Kitchen', TIMESTAMP), 'html')
+    assert mimetype.startswith('text/html')
+    assert '&lt;b&gt;Tuna&lt;/b&gt; &amp; Rice' in page
+    assert '<b>Tuna</b>' not in page
+
+
+def test_preview_endpoint_finds_a_logged_order(client):
+    order_number = client.post('/api/orders', json=make_order(21)).get_json()['order_number']
+    response = client.get(f"/api/orders/{order_number}/preview?format=text&copy=Customer")
+    assert response.status_code == 200
+    order_data, original_timestamp = kp.find_logged_order(str(order_number), None)
+    expected = kp.render_ticket_preview(kp.render_kitchen_ticket(order_data, 'Customer', original_timestamp), 'text')[0]
+    assert response.get_data(as_text=True) == expected
+    assert client.get("/api/orders/999999/preview").status_code == 404
+
+
+@pytest.mark.benchmark
+def test_preview_pipeline_throughput():
+    # Benchmark: render + interpret + text preview for 2,000 orders
+    orders = [dict(make_order(index), number=index) for index in range(2000)]
+    for order in orders:
+        kp.price_order(order, kp.menu_cache.get().index)
+    started = time.perf_counter()
+    for order in orders:
+        kp.render_ticket_preview(kp.render_kitchen_ticket(order, 'Kitchen', TIMESTAMP), 'text')
+    elapsed = time.perf_counter() - started
+    print(f"\npreview: {len(orders) / elapsed:,.0f} text previews/s")
+    assert elapsed / len(orders) < 0.005
@@ -0,0 +1,94 @@
+import random
+import time
+
+import pytest
+
+from baseline_ticket import render_baseline_ticket
+from conftest import kp, menu_items
+
+TIMESTAMP = '2024-05-01 19:30:00'
+WORDS = ["Katsu", "Chicken", "Bao", "Bun", "Supercalifragilisticexpialidocious", "Spicy", "Tuna", "Roll",
+         "(VE)", "Crispy", "Shrimp", "Sando", "", "Extra  space", "Crème", "Jalapeño"]
+
+
+def random_text(rng, max_words):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, max_words)))
+
+
+def random_orders(count, seed=1):
+    # Odd inputs on purpose: long unbreakable words, double spaces, empty words,
+    # negative option prices, prices as strings, multi-line notes
+    rng = random.Random(seed)
+    orders = []
+    for number in range(count):
+        items = []
+        for _ in range(rng.randint(0, 6)):
+            item = {
+                'name': random_text(rng, 7),
+                'price': rng.choice([3.5, 7.2, 12.9, '4.20']),
+                'quantity': rng.randint(0, 12),
+                'selectedOptions': [{'name': random_text(rng, 6), 'price': rng.choice([0, 0.5, -1, 2.25])}
+                                    for _ in range(rng.randint(0, 3))],
+            }
+            if rng.random() < 0.3:
+                item['comment'] = random_text(rng, 20)
+            elif rng.random() < 0.1:
+                item['comment'] = "line1\nline2\n\nline4"
+            items.append(item)
+        order = {'number': number, 'items': items}
+        if rng.random() < 0.4:
+            order['universalComment'] = random_text(rng, 30)
+        orders.append(order)
+    return orders
+
+
+def menu_orders(count, seed=2):
+    # Orders the way they arrive from the tablets: real menu items, priced by the server
+    rng = random.Random(seed)
+    items = menu_items()
+    orders = []
+    for number in range(count):
+        order = {'number': number, 'items': [
+            {'id': item['id'], 'quantity': rng.randint(1, 4), 'comment': rng.choice(['', '', 'no onions'])}
+            for item in rng.sample(items, rng.randint(1, 6))]}
+        kp.price_order(order, kp.menu_cache.get().index)
+        orders.append(order)
+    return orders
+
+
+def test_renderer_matches_the_baseline_byte_for_byte():
+    for order in random_orders(2000):
+        for copy_info in ("Kitchen", "Customer", ""):
+            assert kp.render_kitchen_ticket(order, copy_info, TIMESTAMP) == \
+                render_baseline_ticket(order, copy_info, TIMESTAMP), order
+
+
+def test_copies_rendered_together_match_single_renders():
+    for order in random_orders(200, seed=3):
+        kitchen, customer = kp.render_kitchen_tickets(order, ["Kitchen", "Customer"], TIMESTAMP)
+        assert kitchen == render_baseline_ticket(order, "Kitchen", TIMESTAMP)
+        assert customer == render_baseline_ticket(order, "Customer", TIMESTAMP)
+
+
+def test_priced_orders_match_the_baseline():
+    for order in menu_orders(500):
+        assert kp.render_kitchen_ticket(order, "Kitchen", TIMESTAMP) == \
+            render_baseline_ticket(order, "Kitchen", TIMESTAMP)
+
+
+@pytest.mark.benchmark
+def test_render_throughput():
+    # Benchmark: 10k synthetic orders, both copies, against the baseline renderer
+    orders = menu_orders(10000, seed=4)
+    started = time.perf_counter()
+    for order in orders:
+        kp.render_kitchen_tickets(order, ["Kitchen", "Customer"], TIMESTAMP)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for order in orders:
+        render_baseline_ticket(order, "Kitchen", TIMESTAMP)
+        render_baseline_ticket(order, "Customer", TIMESTAMP)
+    baseline_elapsed = time.perf_counter() - started
+    tickets = len(orders) * 2
+    print(f"\nrender: {tickets / elapsed:,.0f} tickets/s (baseline {tickets / baseline_elapsed:,.0f} tickets/s)")
+    assert elapsed < baseline_elapsed